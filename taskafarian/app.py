@@ -2,7 +2,7 @@ import os
 
 from chalice import Chalice, CORSConfig
 
-from chalicelib import auth, core, task, time_entry, user
+from chalicelib import auth, core, maintenance, task, time_entry, user
 
 app = Chalice(app_name='chalicarian')
 app.api.cors = CORSConfig(
@@ -14,3 +14,4 @@ auth.init_app(app)
 user.init_app(app)
 task.init_app(app)
 time_entry.init_app(app)
+maintenance.init_app(app)
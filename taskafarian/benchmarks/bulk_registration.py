@@ -0,0 +1,63 @@
+"""Registration of a team: one register_new_user call per user vs a single register_users call.
+The users are deleted afterwards.
+
+usage (from the taskafarian directory, with the database running):
+    python -m benchmarks.bulk_registration [users]
+"""
+import sys
+import time
+
+from benchmarks.utils import load_env_variables
+
+
+def main(users=100):
+    load_env_variables()
+
+    from chalicelib.core.database import close_db, get_db, release_db
+    from chalicelib.core.security import (close_password_hasher,
+                                          get_password_hasher)
+    from chalicelib.services import auth
+
+    def delete_users(prefix):
+        db = get_db()
+        with db.cursor() as cursor:
+            cursor.execute('''
+            DELETE FROM email_outbox WHERE recipient LIKE %(pattern)s;
+            DELETE FROM app_user WHERE username LIKE %(pattern)s;
+            ''', {'pattern': prefix + '%'})
+            db.commit()
+        release_db()
+
+    def new_users(prefix):
+        return [{
+            'username': f'{prefix}{i}',
+            'email': f'{prefix}{i}@example.com',
+            'password': '12345678'
+        } for i in range(users)]
+
+    print(f'registering {users} users, password hasher workers={get_password_hasher().workers}')
+
+    delete_users('single')
+    start_timestamp = time.perf_counter()
+    for user in new_users('single'):
+        auth.register_new_user(user['username'], user['email'], user['password'])
+        release_db()
+    single = time.perf_counter() - start_timestamp
+    delete_users('single')
+    print(f'{"register_new_user x " + str(users):<40} {single * 1000:.0f}ms')
+
+    delete_users('bulk')
+    start_timestamp = time.perf_counter()
+    created, conflicts = auth.register_users(new_users('bulk'))
+    release_db()
+    bulk = time.perf_counter() - start_timestamp
+    delete_users('bulk')
+    assert len(created) == users and not conflicts
+    print(f'{"register_users":<40} {bulk * 1000:.0f}ms ({single / bulk:.1f}x faster)')
+
+    close_password_hasher()
+    close_db()
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,48 @@
+"""Pool metrics under concurrent load: simulated requests running a query on N threads.
+
+usage (from the taskafarian directory, with the database running):
+    python -m benchmarks.connection_pool [threads] [requests per thread]
+"""
+import os
+import sys
+import threading
+
+from benchmarks.utils import load_env_variables, measure, report
+
+
+def main(threads=16, requests_per_thread=200):
+    load_env_variables()
+
+    from chalicelib.core.database import (check_connection, close_db, get_pool,
+                                          release_db)
+
+    for max_size, max_overflow in ((1, 0), (4, 0), (4, 4), (16, 0)):
+        close_db()
+        os.environ['TASKAFARIAN_DB_POOL_MAX_SIZE'] = str(max_size)
+        os.environ['TASKAFARIAN_DB_POOL_MAX_OVERFLOW'] = str(max_overflow)
+        pool = get_pool()
+        timings = []
+
+        def request():
+            check_connection()
+            release_db()
+
+        def worker():
+            timings.extend(measure(request, repeat=requests_per_thread, warmup=0))
+
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+
+        report(f'max_size={max_size} max_overflow={max_overflow}', timings)
+        stats = pool.stats()
+        print('    waits={waits} wait_time_max={wait_time_max_ms:.3f}ms peak_in_use={peak_in_use} '
+              'peak_overflow={peak_overflow} timeouts={timeouts}'.format(**stats))
+
+    close_db()
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
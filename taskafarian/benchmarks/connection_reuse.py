@@ -0,0 +1,31 @@
+"""Per-request latency of GET /health with a warm connection vs connect-per-request.
+
+usage (from the taskafarian directory, with the database running):
+    python -m benchmarks.connection_reuse
+"""
+import os
+
+from chalice.test import Client
+
+from benchmarks.utils import load_env_variables, measure, report
+
+
+def main():
+    load_env_variables()
+
+    from app import app
+    from chalicelib.core.database import close_db
+
+    with Client(app, stage_name='local') as client:
+        def request():
+            response = client.http.get('/health')
+            assert response.status_code == 200
+
+        for keep_alive in ('False', 'True'):
+            os.environ['TASKAFARIAN_DB_KEEP_ALIVE'] = keep_alive
+            report(f'GET /health keep_alive={keep_alive}', measure(request))
+            close_db()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""Log-in throughput under concurrent load: N threads logging in for a few seconds
+with different password hasher settings (workers / queue size).
+
+usage (from the taskafarian directory, with the database running):
+    python -m benchmarks.login_throughput [threads] [seconds]
+"""
+import os
+import sys
+import threading
+import time
+
+from benchmarks.utils import load_env_variables, report
+
+
+def main(threads=32, seconds=10):
+    load_env_variables()
+    os.environ['TASKAFARIAN_DB_POOL_MAX_SIZE'] = str(threads)
+
+    from chalicelib.core.database import close_db, release_db
+    from chalicelib.core.security import (PasswordHasherBusy,
+                                          close_password_hasher,
+                                          get_password_hasher)
+    from chalicelib.services import auth
+
+    cpus = os.cpu_count() or 1
+    for workers, queue_size in ((threads, 0), (cpus, threads), (cpus, cpus)):
+        close_password_hasher()
+        os.environ['TASKAFARIAN_PASSWORD_HASHER_WORKERS'] = str(workers)
+        os.environ['TASKAFARIAN_PASSWORD_HASHER_QUEUE_SIZE'] = str(queue_size)
+        os.environ['TASKAFARIAN_PASSWORD_HASHER_TIMEOUT'] = '0'
+        hasher = get_password_hasher()
+
+        timings = []
+        deadline = time.monotonic() + seconds
+
+        def worker():
+            while time.monotonic() < deadline:
+                start_timestamp = time.perf_counter()
+                try:
+                    auth.log_in('alice', '12345678')
+                    timings.append((time.perf_counter() - start_timestamp) * 1000)
+                except PasswordHasherBusy:
+                    # a client backing off after 503
+                    time.sleep(0.05)
+                finally:
+                    release_db()
+
+        started_at = time.monotonic()
+        clients = [threading.Thread(target=worker) for _ in range(threads)]
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        elapsed = time.monotonic() - started_at
+
+        report(f'workers={workers} queue_size={queue_size}', timings)
+        print('    logins/s={throughput:.1f} rejected={rejected} peak_pending={peak_pending} '
+              'wait_time_max={wait_time_max_ms:.0f}ms'.format(throughput=len(timings) / elapsed, **hasher.stats()))
+
+    close_password_hasher()
+    close_db()
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
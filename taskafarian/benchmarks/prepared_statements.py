@@ -0,0 +1,37 @@
+"""Task list query (services.task.fetch_many) as a plain query vs a prepared statement.
+
+usage (from the taskafarian directory, with the database running):
+    python -m benchmarks.prepared_statements [username]
+"""
+import sys
+
+from benchmarks.utils import load_env_variables, measure, report
+
+
+def main(username='alice'):
+    load_env_variables()
+
+    from chalicelib.core.database import close_db, get_db
+    from chalicelib.services.task import fetch_many_statement
+
+    db = get_db()
+    with db.cursor() as cursor:
+        cursor.execute('SELECT user_id FROM app_user WHERE username = %s;', (username,))
+        params = {'user_id': cursor.fetchone().user_id, 'limit': 20}
+        db.commit()
+
+        for use_prepared_statements in (False, True):
+            db.use_prepared_statements = use_prepared_statements
+
+            def query():
+                cursor.execute(fetch_many_statement, params)
+                cursor.fetchall()
+                db.commit()
+
+            report(f'fetch_many prepared={use_prepared_statements}', measure(query, repeat=1000))
+
+    close_db()
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
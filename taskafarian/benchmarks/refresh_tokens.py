@@ -0,0 +1,31 @@
+"""Getting a new access token: log-in (bcrypt) vs refresh token rotation.
+
+usage (from the taskafarian directory, with the database running):
+    python -m benchmarks.refresh_tokens [username] [password]
+"""
+import sys
+
+from benchmarks.utils import load_env_variables, measure, report
+
+
+def main(username='alice', password='12345678'):
+    load_env_variables()
+
+    from chalicelib.core.database import close_db
+    from chalicelib.services import auth
+
+    report('log_in', measure(lambda: auth.log_in(username, password), repeat=20, warmup=2))
+
+    refresh_token = auth.log_in(username, password)['refresh_token']
+
+    def refresh():
+        nonlocal refresh_token
+        refresh_token = auth.refresh(refresh_token)['refresh_token']
+
+    report('refresh', measure(refresh, repeat=500))
+
+    close_db()
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,68 @@
+"""fetchall() + TaskList().dump() of 1,000 tasks: NamedTupleCursor vs the Row cursor.
+
+usage (from the taskafarian directory, with the database running):
+    python -m benchmarks.row_factory [number of tasks]
+"""
+import sys
+import time
+import tracemalloc
+
+from psycopg2.extras import NamedTupleCursor
+
+from benchmarks.utils import load_env_variables, measure, report
+
+
+def main(task_count=1000):
+    load_env_variables()
+
+    from chalicelib.core.database import Cursor, close_db, get_db
+    from chalicelib.services.task import fetch_many_statement
+    from chalicelib.task.schema import TaskList
+
+    db = get_db()
+    with db.cursor() as cursor:
+        # the tasks are rolled back at the end
+        cursor.execute('''
+        INSERT INTO task (name, status, created_by, assignee_id)
+        SELECT 'benchmark task ' || i, 'todo', 1, 1
+        FROM generate_series(1, %(task_count)s) AS i
+        ;
+        ''', {'task_count': task_count})
+
+    params = {'user_id': 1, 'limit': task_count}
+    try:
+        for cursor_factory in (NamedTupleCursor, Cursor):
+            with db.cursor(cursor_factory=cursor_factory) as cursor:
+                cursor.execute(fetch_many_statement.query, params)
+                rows = cursor.fetchall()
+
+                def fetch_and_dump():
+                    cursor.scroll(0, mode='absolute')
+                    TaskList().dump({
+                        'entities': cursor.fetchall(),
+                        'meta': {'count': len(rows), 'limit': task_count}
+                    })
+
+                tracemalloc.start()
+                cursor.scroll(0, mode='absolute')
+                cursor.fetchall()
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+
+                cpu_started_at = time.process_time()
+                timings = measure(fetch_and_dump, repeat=20, warmup=2)
+                cpu_time = (time.process_time() - cpu_started_at) * 1000 / 22
+
+                report(cursor_factory.__name__, timings)
+                print('    rows={rows} fetchall peak memory={peak:.1f}KiB cpu={cpu_time:.3f}ms'.format(
+                    rows=len(rows),
+                    peak=peak / 1024,
+                    cpu_time=cpu_time
+                ))
+    finally:
+        db.rollback()
+        close_db()
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,21 @@
+"""Render slow queries captured to TASKAFARIAN_DB_SLOW_QUERY_FILE (see chalicelib/core/slow_queries.py).
+
+usage (from the taskafarian directory):
+    python -m benchmarks.slow_query_report [slow-queries.jsonl]
+"""
+import json
+import os
+import sys
+
+from chalicelib.core.slow_queries import render_report
+
+
+def main(path=None):
+    path = path or os.getenv('TASKAFARIAN_DB_SLOW_QUERY_FILE')
+    with open(path) as f:
+        captures = [json.loads(line) for line in f if line.strip()]
+    print(render_report(captures))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,74 @@
+"""Task name autocomplete (services.task.autocomplete) of a user with 100k tasks among [tasks] rows,
+as typed letter by letter, vs ILIKE '%text%' over the names of the user.
+The users and the tasks are rolled back at the end. Without the pg_trgm and btree_gist extensions
+the substring fallback is measured.
+
+usage (from the taskafarian directory, with the database running):
+    python -m benchmarks.task_autocomplete [tasks]
+"""
+import sys
+
+from benchmarks.utils import load_env_variables, measure, report
+
+
+def main(task_count=1000000):
+    load_env_variables()
+
+    from chalicelib.core.database import close_db, get_db
+    from chalicelib.services.task import autocomplete
+
+    limit = 10
+    user_task_count = 100000
+    ilike_query = '''
+    SELECT task_id, name
+    FROM task
+    WHERE name ILIKE %(pattern)s AND created_by = %(user_id)s
+    ORDER BY task_id DESC
+    LIMIT %(limit)s
+    ;
+    '''
+
+    db = get_db()
+    with db.cursor() as cursor:
+        cursor.execute('''
+        INSERT INTO app_user (username, email, is_active)
+        VALUES ('autocomplete_benchmark', 'autocomplete_benchmark@example.com', true), ('autocomplete_benchmark_other', 'autocomplete_benchmark_other@example.com', true)
+        RETURNING user_id
+        ;
+        ''')
+        user, other_user = cursor.fetchall()
+
+        cursor.execute('''
+        INSERT INTO task (name, status, created_by)
+        SELECT (ARRAY['Invoice', 'Review', 'Deploy', 'Call', 'Plan'])[i %% 5 + 1] || ' '
+               || (ARRAY['ACME', 'Globex', 'Initech', 'Umbrella', 'Hooli', 'Stark'])[i %% 6 + 1] || ' #' || i,
+               'todo',
+               CASE WHEN i <= %(user_task_count)s THEN %(user_id)s ELSE %(other_user_id)s END
+        FROM generate_series(1, %(task_count)s) AS i
+        ;
+        ANALYZE task;
+        ''', {
+            'user_id': user.user_id,
+            'other_user_id': other_user.user_id,
+            'user_task_count': user_task_count,
+            'task_count': task_count
+        })
+
+        print(f'{task_count} tasks, {user_task_count} of the user, {limit} suggestions')
+        try:
+            for text in ('in', 'inv', 'invoice', 'invoice glo', 'umbrela'):
+                report(f'autocomplete {text!r}', measure(lambda: autocomplete(user, text, limit=limit)))
+
+                def query():
+                    cursor.execute(ilike_query, {'user_id': user.user_id, 'pattern': f'%{text}%', 'limit': limit})
+                    cursor.fetchall()
+
+                report(f'ilike {text!r}', measure(query))
+        finally:
+            db.rollback()
+
+    close_db()
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,75 @@
+"""Task list (services.task.fetch_many) of a user with 100k tasks: page 1 vs page 500,
+keyset pagination vs the same query paginated with OFFSET.
+The user and the tasks are rolled back at the end.
+
+usage (from the taskafarian directory, with the database running):
+    python -m benchmarks.task_pagination [tasks] [page]
+"""
+import sys
+
+from benchmarks.utils import load_env_variables, measure, report
+
+
+def main(task_count=100000, page=500):
+    load_env_variables()
+
+    from chalicelib.core.database import close_db, get_db
+    from chalicelib.core.pagination import encode_cursor
+    from chalicelib.services.task import _fetch_many_query, fetch_many
+
+    limit = 20
+    offset_query = _fetch_many_query().replace('LIMIT %(limit)s', 'OFFSET %(offset)s LIMIT %(limit)s')
+
+    db = get_db()
+    with db.cursor() as cursor:
+        cursor.execute('''
+        INSERT INTO app_user (username, email, is_active)
+        VALUES ('pagination_benchmark', 'pagination_benchmark@example.com', true)
+        RETURNING user_id
+        ;
+        ''')
+        user = cursor.fetchone()
+
+        cursor.execute('''
+        INSERT INTO task (name, status, created_by, assignee_id, created_at)
+        SELECT 'benchmark task ' || i, 'todo', %(user_id)s, %(user_id)s, now() - i * interval '1 minute'
+        FROM generate_series(1, %(task_count)s) AS i
+        ;
+        ANALYZE task;
+        ''', {'user_id': user.user_id, 'task_count': task_count})
+
+        cursor.execute('''
+        SELECT created_at, task_id
+        FROM task
+        WHERE created_by = %(user_id)s
+        ORDER BY created_at DESC, task_id DESC
+        OFFSET %(offset)s
+        LIMIT 1
+        ;
+        ''', {'user_id': user.user_id, 'offset': (page - 1) * limit - 1})
+        last_row = cursor.fetchone()
+        cursor_token = encode_cursor([last_row.created_at, last_row.task_id])
+
+        print(f'{task_count} tasks, {limit} per page')
+        try:
+            report('keyset page 1', measure(lambda: fetch_many(user, limit=limit)))
+            report(f'keyset page {page}', measure(lambda: fetch_many(user, limit=limit, cursor=cursor_token)))
+
+            for page_number in (1, page):
+                def query():
+                    cursor.execute(offset_query, {
+                        'user_id': user.user_id,
+                        'offset': (page_number - 1) * limit,
+                        'limit': limit
+                    })
+                    cursor.fetchall()
+
+                report(f'offset page {page_number}', measure(query))
+        finally:
+            db.rollback()
+
+    close_db()
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,75 @@
+"""Task search (services.task.search) of a user with 10k tasks while the table grows to [tasks] rows,
+full-text search on the GIN index vs ILIKE over the names and descriptions.
+The user and the tasks are rolled back at the end.
+
+usage (from the taskafarian directory, with the database running):
+    python -m benchmarks.task_search [tasks]
+"""
+import sys
+
+from benchmarks.utils import load_env_variables, measure, report
+
+
+def main(task_count=1000000):
+    load_env_variables()
+
+    from chalicelib.core.database import close_db, get_db
+    from chalicelib.services.task import search
+
+    limit = 20
+    user_task_count = 10000
+    ilike_query = '''
+    SELECT task_id, name
+    FROM task
+    WHERE (name ILIKE %(pattern)s OR description ILIKE %(pattern)s)
+        AND created_by = %(user_id)s
+    ORDER BY task_id DESC
+    LIMIT %(limit)s
+    ;
+    '''
+
+    db = get_db()
+    with db.cursor() as cursor:
+        cursor.execute('''
+        INSERT INTO app_user (username, email, is_active)
+        VALUES ('search_benchmark', 'search_benchmark@example.com', true), ('search_benchmark_other', 'search_benchmark_other@example.com', true)
+        RETURNING user_id
+        ;
+        ''')
+        user, other_user = cursor.fetchall()
+
+        cursor.execute('''
+        INSERT INTO task (name, description, status, created_by)
+        SELECT 'benchmark task ' || i,
+               'step ' || i || ' of the ' || (ARRAY['billing', 'login', 'export', 'invoice', 'upload'])[i %% 5 + 1] || ' rework',
+               'todo',
+               CASE WHEN i <= %(user_task_count)s THEN %(user_id)s ELSE %(other_user_id)s END
+        FROM generate_series(1, %(task_count)s) AS i
+        ;
+        SELECT gin_clean_pending_list('task_search_vector_idx');
+        ANALYZE task;
+        ''', {
+            'user_id': user.user_id,
+            'other_user_id': other_user.user_id,
+            'user_task_count': user_task_count,
+            'task_count': task_count
+        })
+
+        print(f'{task_count} tasks, {user_task_count} of the user, {limit} per page')
+        try:
+            for term in ('invoice', '4242'):
+                report(f'search {term!r}', measure(lambda: search(user, term, limit=limit)))
+
+                def query():
+                    cursor.execute(ilike_query, {'user_id': user.user_id, 'pattern': f'%{term}%', 'limit': limit})
+                    cursor.fetchall()
+
+                report(f'ilike {term!r}', measure(query))
+        finally:
+            db.rollback()
+
+    close_db()
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
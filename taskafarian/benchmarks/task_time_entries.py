@@ -0,0 +1,117 @@
+"""Task list (services.task.fetch_many) of a user whose tasks have long time tracking histories:
+the page with its capped time entries loaded in one batch vs the previous query,
+which aggregated every time entry of every task of the page into json.
+The user, the tasks and the time entries are rolled back at the end.
+
+usage (from the taskafarian directory, with the database running):
+    python -m benchmarks.task_time_entries [tasks] [time entries per task]
+"""
+import sys
+
+from benchmarks.utils import load_env_variables, measure, report
+
+# the task list before time entries were loaded separately
+PREVIOUS_QUERY = '''
+WITH page AS (
+    SELECT task.*
+    FROM task
+    WHERE task.created_by = %(user_id)s
+    ORDER BY task.created_at DESC, task.task_id DESC
+    LIMIT %(limit)s
+)
+SELECT page.task_id,
+       page.project_id,
+       page.team_id,
+       page.name,
+       page.description,
+       page.estimation,
+       page.status,
+       page.created_at,
+       page.due_date,
+       (
+           SELECT coalesce(jsonb_agg(time_entries), '[]'::jsonb)
+           FROM (
+               SELECT task_time_entry.time_entry_id,
+                      task_time_entry.task_id,
+                      task_time_entry.assignee_id,
+                      task_time_entry.start_datetime,
+                      task_time_entry.end_datetime
+               FROM task_time_entry
+               WHERE task_time_entry.task_id = page.task_id
+               ORDER BY task_time_entry.start_datetime DESC
+           ) AS time_entries
+       ) AS time_entries,
+       jsonb_build_object(
+           'username', creator.username,
+           'user_id', creator.user_id,
+           'first_name', creator.first_name,
+           'last_name', creator.last_name
+       ) as creator,
+       jsonb_build_object(
+           'username', assignee.username,
+           'user_id', assignee.user_id,
+           'first_name', assignee.first_name,
+           'last_name', assignee.last_name
+       ) as assignee
+FROM page
+LEFT JOIN app_user AS creator
+    ON creator.user_id = page.created_by
+LEFT JOIN app_user AS assignee
+    ON assignee.user_id = page.assignee_id
+ORDER BY page.created_at DESC, page.task_id DESC
+;
+'''
+
+
+def main(task_count=1000, entries_per_task=1000):
+    load_env_variables()
+
+    from chalicelib.core.database import close_db, get_db
+    from chalicelib.services.task import fetch_many
+
+    limit = 20
+
+    db = get_db()
+    with db.cursor() as cursor:
+        cursor.execute('''
+        INSERT INTO app_user (username, email, is_active)
+        VALUES ('time_entries_benchmark', 'time_entries_benchmark@example.com', true)
+        RETURNING user_id
+        ;
+        ''')
+        user = cursor.fetchone()
+
+        cursor.execute('''
+        WITH new_task AS (
+            INSERT INTO task (name, status, created_by, assignee_id, created_at)
+            SELECT 'benchmark task ' || i, 'in_progress', %(user_id)s, %(user_id)s, now() - i * interval '1 minute'
+            FROM generate_series(1, %(task_count)s) AS i
+            RETURNING task_id
+        )
+        INSERT INTO task_time_entry (task_id, assignee_id, start_datetime, end_datetime)
+        SELECT new_task.task_id, %(user_id)s, now() - i * interval '1 day', now() - i * interval '1 day' + interval '1 hour'
+        FROM new_task, generate_series(1, %(entries_per_task)s) AS i
+        ;
+        ANALYZE task;
+        ANALYZE task_time_entry;
+        ''', {'user_id': user.user_id, 'task_count': task_count, 'entries_per_task': entries_per_task})
+
+        print(f'{task_count} tasks with {entries_per_task} time entries each, {limit} per page')
+        try:
+            def batched():
+                fetch_many(user, limit=limit)
+
+            def previous():
+                cursor.execute(PREVIOUS_QUERY, {'user_id': user.user_id, 'limit': limit + 1})
+                cursor.fetchall()
+
+            report('page + batched time entries (10/task)', measure(batched, repeat=50))
+            report('previous query (all entries, jsonb)', measure(previous, repeat=50))
+        finally:
+            db.rollback()
+
+    close_db()
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,39 @@
+import json
+import os
+import statistics
+import time
+from pathlib import Path
+
+
+def load_env_variables(stage='local'):
+    """Load environment variables of a chalice stage (benchmarks run outside of chalice)
+    """
+    with open(Path() / '.chalice' / 'config.json') as f:
+        config = json.load(f)
+        for key, value in config['stages'][stage]['environment_variables'].items():
+            os.environ.setdefault(key, value)
+
+
+def measure(func, repeat=200, warmup=10):
+    """Call func repeatedly and return the timings in milliseconds
+    """
+    for _ in range(warmup):
+        func()
+
+    timings = []
+    for _ in range(repeat):
+        start_timestamp = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start_timestamp) * 1000)
+    return timings
+
+
+def report(name, timings):
+    timings = sorted(timings)
+    print('{name:<40} mean={mean:.3f}ms median={median:.3f}ms p95={p95:.3f}ms n={n}'.format(
+        name=name,
+        mean=statistics.mean(timings),
+        median=statistics.median(timings),
+        p95=timings[int(len(timings) * 0.95) - 1],
+        n=len(timings)
+    ))
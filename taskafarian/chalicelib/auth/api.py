@@ -1,15 +1,18 @@
+import os
+
 from chalice import Response
+from marshmallow import ValidationError
 
 from chalicelib.auth.decorators import protected
-from chalicelib.auth.schema import (ActivationToken, LoginCredentials,
-                                    PasswordChange,
-                                    PasswordResetRequestDetails,
+from chalicelib.auth.schema import (ActivationToken, BulkRegistrationSchema,
+                                    LoginCredentials, PasswordChange,
+                                    PasswordResetRequestDetails, RefreshToken,
                                     RegistrationSchema, Token)
 from chalicelib.core.exceptions import APIError
 from chalicelib.core.extensions import Blueprint
 from chalicelib.core.logger import logger
 from chalicelib.core.shared import g
-from chalicelib.services import auth
+from chalicelib.services import auth, user
 
 blueprint = Blueprint(__name__)
 
@@ -32,15 +35,51 @@ def register():
     return Response(body=RegistrationSchema().dump(new_user), status_code=201)
 
 
+@blueprint.route('/register/bulk', methods=['POST'])
+@protected
+def register_bulk():
+    """Team onboarding: register users (at most TASKAFARIAN_BULK_REGISTRATION_LIMIT, default 100)
+    and add them to the team of the leader. Invalid and duplicate users are reported by their index
+    and don't stop the others from being registered.
+    """
+    details = BulkRegistrationSchema().load(blueprint.current_request.json_body or {})
+
+    limit = int(os.getenv('TASKAFARIAN_BULK_REGISTRATION_LIMIT', 100))
+    if len(details['users']) > limit:
+        raise APIError(status=422, fields={'users': ['At most {} users per request'.format(limit)]})
+
+    if user.get_user_role_in_team(g.current_user.user_id, details['team_id'], fresh=True) != 'leader':
+        raise APIError(status=403, detail='Only the team leader can register team members')
+
+    errors = {}
+    valid_users = []
+    indexes = []
+    for index, registration_details in enumerate(details['users']):
+        try:
+            valid_users.append(RegistrationSchema().load(registration_details))
+            indexes.append(index)
+        except ValidationError as error:
+            errors[index] = error.messages
+
+    new_users, conflicts = auth.register_users(valid_users, team_id=details['team_id'])
+    for position, fields in conflicts.items():
+        errors[indexes[position]] = fields
+
+    return Response(body={
+        'created': RegistrationSchema(many=True).dump(new_users),
+        'errors': [{'index': index, 'fields': errors[index]} for index in sorted(errors)]
+    }, status_code=201 if new_users else 200)
+
+
 @blueprint.route('/log-in', methods=['POST'])
 def log_in():
     body = blueprint.current_request.json_body
     try:
         credentials = LoginCredentials().load(body)
-        token, expires_at = auth.log_in(username=credentials['username'], password=credentials['password'])
+        tokens = auth.log_in(username=credentials['username'], password=credentials['password'])
         logger.info('{username} logged in'.format(username=credentials['username']))
         return Response(
-            body=Token().dump({'token': token, 'expires_at': expires_at}),
+            body=Token().dump(tokens),
             status_code=200
         )
     except auth.BadCredentials:
@@ -49,6 +88,21 @@ def log_in():
         raise APIError(status=403, detail='User is not activated')
 
 
+@blueprint.route('/refresh', methods=['POST'])
+def refresh():
+    body = blueprint.current_request.json_body
+
+    try:
+        refresh_token = RefreshToken().load(body)
+        tokens = auth.refresh(refresh_token['refresh_token'])
+        return Response(
+            body=Token().dump(tokens),
+            status_code=200
+        )
+    except auth.BadCredentials:
+        raise APIError(status=401, detail='Invalid refresh token')
+
+
 @blueprint.route('/activate', methods=['POST'])
 def activate():
     body = blueprint.current_request.json_body
@@ -90,4 +144,10 @@ def reset_password():
 @protected
 def log_out():
     auth.log_out(g.current_user.token)
+
+    # the refresh token is optional, it is revoked together with the tokens rotated from it
+    refresh_token = RefreshToken(partial=True).load(blueprint.current_request.json_body or {})
+    if 'refresh_token' in refresh_token:
+        auth.revoke_refresh_token(refresh_token['refresh_token'])
+
     return Response(body={}, status_code=200)
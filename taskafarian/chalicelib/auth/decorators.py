@@ -3,7 +3,7 @@ from functools import wraps
 from chalice import Response
 
 from chalicelib.core.shared import g
-from chalicelib.services.auth import get_user_by_token
+from chalicelib.services.auth import authenticate
 
 
 def protected(func):
@@ -14,8 +14,8 @@ def protected(func):
             authorization_header = g.current_request.headers['Authorization']
             token = authorization_header.split(' ')[1]
 
-            g.current_user = get_user_by_token(token)
-            # TODO: lazy load team roles that the user belongs to?
+            g.current_user = authenticate(token)
+            # team roles are loaded lazily on first use, see services.user.get_team_roles
             if g.current_user:
                 return func(*args, **kwargs)
         except (KeyError, IndexError):
@@ -1,4 +1,4 @@
-from marshmallow import fields
+from marshmallow import fields, validate
 
 from chalicelib.core import fields as custom_fields
 from chalicelib.core.schema import BaseSchema
@@ -14,6 +14,13 @@ class RegistrationSchema(BaseSchema):
     updated_at = fields.AwareDateTime(read_only=True)
 
 
+class BulkRegistrationSchema(BaseSchema):
+    """Users are validated one by one with RegistrationSchema, see POST /auth/register/bulk
+    """
+    team_id = fields.Int(required=True)
+    users = fields.List(fields.Dict(), required=True, validate=validate.Length(min=1))
+
+
 class LoginCredentials(BaseSchema):
     username = custom_fields.Username(required=True)
     password = custom_fields.Password(required=True)
@@ -22,6 +29,12 @@ class LoginCredentials(BaseSchema):
 class Token(BaseSchema):
     token = fields.Str()
     expires_at = fields.AwareDateTime()
+    refresh_token = fields.Str()
+    refresh_token_expires_at = fields.AwareDateTime()
+
+
+class RefreshToken(BaseSchema):
+    refresh_token = fields.Str(required=True)
 
 
 class ActivationToken(BaseSchema):
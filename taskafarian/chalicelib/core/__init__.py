@@ -1,21 +1,29 @@
+import os
+
 from chalicelib.core.api import blueprint
-from chalicelib.core.database import close_db
+from chalicelib.core.database import begin_request, commit_request, release_db
+from chalicelib.core.migrations import migrate
 from chalicelib.core.shared import g
 
 
 def init_app(app):
     app.register_blueprint(blueprint)
 
+    if os.getenv('TASKAFARIAN_DB_MIGRATE_ON_START') == 'True':
+        migrate()
+
     @app.middleware('http')
     def request_lifetime(event, get_response):
         # set shared variables
-        # TODO: put database connection on g?
         g.current_request = app.current_request
+        begin_request(read_only=event.method == 'GET')
 
         try:
             response = get_response(event)
+            if response.status_code < 400:
+                commit_request()
             return response
         finally:
             # clean up
+            release_db()
             g.clear()
-            close_db()
@@ -1,12 +1,17 @@
+import os
+
 from chalice import Response
 
-from chalicelib.core.database import check_connection
+from chalicelib.core import query_stats, slow_queries
+from chalicelib.core.database import check_connection, replica_safe
+from chalicelib.core.exceptions import APIError
 from chalicelib.core.extensions import Blueprint
 
 blueprint = Blueprint(__name__)
 
 
 @blueprint.route('/health', methods=['GET'])
+@replica_safe
 def health_check():
     check_connection()
 
@@ -14,3 +19,48 @@ def health_check():
         body={'status': 'ok'},
         status_code=200
     )
+
+
+@blueprint.route('/debug/query-stats', methods=['GET', 'DELETE'])
+def get_query_stats():
+    """Per-fingerprint query statistics. Available only when TASKAFARIAN_DEBUG is on.
+    """
+    if os.getenv('TASKAFARIAN_DEBUG') != 'True':
+        raise APIError(status=404)
+
+    request = blueprint.current_request
+    if request.method == 'DELETE':
+        query_stats.reset()
+        return Response(body={}, status_code=200)
+
+    order_by = (request.query_params or {}).get('orderBy', 'total_time')
+    if order_by not in ('total_time', 'calls', 'max_time'):
+        raise APIError(status=422, fields={'orderBy': ['Must be one of: total_time, calls, max_time']})
+
+    return Response(
+        body={
+            'enabled': query_stats.is_enabled(),
+            'queries': query_stats.get_stats(order_by=order_by)
+        },
+        status_code=200
+    )
+
+
+@blueprint.route('/debug/slow-queries', methods=['GET', 'DELETE'])
+def get_slow_queries():
+    """Execution plans of captured slow queries. Available only when TASKAFARIAN_DEBUG is on.
+    """
+    if os.getenv('TASKAFARIAN_DEBUG') != 'True':
+        raise APIError(status=404)
+
+    if blueprint.current_request.method == 'DELETE':
+        slow_queries.reset()
+        return Response(body={}, status_code=200)
+
+    return Response(
+        body={
+            'thresholdMs': slow_queries.threshold_ms(),
+            'queries': slow_queries.get_captures()
+        },
+        status_code=200
+    )
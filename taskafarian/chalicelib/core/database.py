@@ -1,76 +1,445 @@
+import logging
 import os
+import sys
+import threading
 import time
 from datetime import datetime, timezone
 from functools import wraps
-from pathlib import Path
 
 import psycopg2
-from psycopg2.extras import NamedTupleCursor
+from psycopg2.extensions import (TRANSACTION_STATUS_IDLE,
+                                 TRANSACTION_STATUS_UNKNOWN)
+from psycopg2.extensions import connection as BaseConnection
 from psycopg2.sql import SQL, Identifier
 
+from chalicelib.core import query_stats, slow_queries
 from chalicelib.core.logger import logger
+from chalicelib.core.pool import ConnectionPool, PoolTimeout
+from chalicelib.core.prepared import PreparedStatement
+from chalicelib.core.rows import row_class
+from chalicelib.core.shared import g
 
-_connection = None
+READ = 'read'
+WRITE = 'write'
+
+_pool = None
+_replica_pool = None
+_pool_lock = threading.Lock()
+
+# user_id -> time of the last write, see is_sticky
+_last_writes = {}
+MAX_LAST_WRITES = 10000
 
 
 def log(f):
     @wraps(f)
-    def wrapper(self, *args, **kwargs):
+    def wrapper(self, query, *args, **kwargs):
         start_timestamp = time.perf_counter()
         try:
-            value = f(self, *args, **kwargs)
+            value = f(self, query, *args, **kwargs)
+        except Exception as exception:
+            logger.exception(exception)
+            if query_stats.is_enabled():
+                query_stats.record(query, None, (time.perf_counter() - start_timestamp) * 1000,
+                                   caller=_caller(), context=self, error=True)
+            raise exception
+
+        execution_time = (time.perf_counter() - start_timestamp) * 1000
+        if logger.isEnabledFor(logging.DEBUG):
             # TODO: Logging may leak credentials
             logger.debug('{date}: query={query} rows={rows}, execution_time={execution_time:.3f}ms'.format(
                 date=datetime.now(timezone.utc),
                 query=self.query.decode('utf-8'),
                 rows=self.rowcount,
-                execution_time=(time.perf_counter() - start_timestamp) * 1000
+                execution_time=execution_time
             ))
-        except Exception as exception:
-            logger.exception(exception)
-            raise exception
+        if query_stats.is_enabled():
+            query_stats.record(query, self.rowcount, execution_time, caller=_caller(), context=self)
+
+        slow_query_threshold = slow_queries.threshold_ms()
+        if slow_query_threshold is not None and execution_time >= slow_query_threshold and f.__name__ == 'execute':
+            params = args[0] if args else kwargs.get('vars')
+            slow_queries.capture(self, query, params, execution_time, caller=_caller())
+
         return value
 
     return wrapper
 
 
-class Cursor(NamedTupleCursor):
+def _caller():
+    """module.function that executed the query (skips this module and the logging wrapper)
+    """
+    frame = sys._getframe(2)
+    while frame and frame.f_globals.get('__name__') == __name__:
+        frame = frame.f_back
+    if frame is None:
+        return None
+    return '{module}.{function}'.format(module=frame.f_globals.get('__name__'), function=frame.f_code.co_name)
+
+
+class Cursor(psycopg2.extensions.cursor):
     """
-    NamedTupleCursor with logging capability.
+    Cursor that returns rows as compact Row objects (see chalicelib/core/rows.py),
+    with logging capability and support for prepared statements.
     """
+    Row = None
+
     @log
     def execute(self, query, vars=None):
+        self.Row = None
+        if isinstance(query, PreparedStatement):
+            return self._execute_prepared(query, vars)
         return super(Cursor, self).execute(query, vars)
 
+    def _execute_prepared(self, statement, vars=None):
+        connection = self.connection
+        if not connection.use_prepared_statements:
+            return super(Cursor, self).execute(statement.query, vars)
+
+        in_transaction = connection.info.transaction_status != TRANSACTION_STATUS_IDLE
+        try:
+            if statement.name not in connection.prepared_statements:
+                super(Cursor, self).execute(statement.prepare_sql)
+                connection.prepared_statements.add(statement.name)
+            return super(Cursor, self).execute(statement.execute_sql, vars)
+        except psycopg2.errors.InvalidSqlStatementName:
+            # the statement is gone (e.g DISCARD ALL by a connection pooler).
+            # prepare it again if nothing else in the transaction can be lost.
+            connection.prepared_statements.clear()
+            if in_transaction:
+                raise
+
+            connection.rollback()
+            super(Cursor, self).execute(statement.prepare_sql)
+            connection.prepared_statements.add(statement.name)
+            return super(Cursor, self).execute(statement.execute_sql, vars)
+
     @log
     def callproc(self, procname, vars=None):
+        self.Row = None
         return super(Cursor, self).callproc(procname, vars)
 
+    def executemany(self, query, vars_list):
+        self.Row = None
+        return super(Cursor, self).executemany(query, vars_list)
+
+    def _row_class(self):
+        if self.Row is None:
+            self.Row = row_class(tuple(column[0] for column in self.description) if self.description else ())
+        return self.Row
+
+    def fetchone(self):
+        values = super(Cursor, self).fetchone()
+        if values is not None:
+            return self._row_class()(*values)
 
-def connect(db_name=None):
-    db_name = db_name if db_name else os.getenv('TASKAFARIAN_DB_NAME')
-    return psycopg2.connect(
-        host=os.getenv('TASKAFARIAN_DB_HOST'),
+    def fetchmany(self, size=None):
+        rows = super(Cursor, self).fetchmany(size) if size is not None else super(Cursor, self).fetchmany()
+        row = self._row_class()
+        return [row(*values) for values in rows]
+
+    def fetchall(self):
+        rows = super(Cursor, self).fetchall()
+        row = self._row_class()
+        return [row(*values) for values in rows]
+
+    def __iter__(self):
+        iterator = super(Cursor, self).__iter__()
+        try:
+            values = next(iterator)
+        except StopIteration:
+            return
+
+        row = self._row_class()
+        yield row(*values)
+        for values in iterator:
+            yield row(*values)
+
+
+class Connection(BaseConnection):
+    """
+    Connection that keeps track of its age and usage so it can outlive a single request.
+
+    Tunable with environment variables:
+        TASKAFARIAN_DB_CONNECTION_MAX_AGE - seconds after which the connection is recycled (default 300)
+        TASKAFARIAN_DB_CONNECTION_MAX_USES - requests after which the connection is recycled (default 1000)
+        TASKAFARIAN_DB_CONNECTION_PING_AFTER - seconds of idleness after which the connection
+                                               is pinged before it is reused (default 30)
+        TASKAFARIAN_DB_PREPARED_STATEMENTS - set to 'False' to execute prepared statements as plain queries,
+                                             e.g behind PgBouncer in transaction pooling mode
+    """
+    def __init__(self, *args, **kwargs):
+        super(Connection, self).__init__(*args, **kwargs)
+        self.created_at = time.monotonic()
+        self.idle_since = None
+        self.uses = 0
+        self.pool = None
+        self.is_replica = False
+        self.prepared_statements = set()
+        self.defer_commit = False
+        self.use_prepared_statements = os.getenv('TASKAFARIAN_DB_PREPARED_STATEMENTS', 'True') == 'True'
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.created_at
+
+    def is_worn_out(self) -> bool:
+        max_age = float(os.getenv('TASKAFARIAN_DB_CONNECTION_MAX_AGE', 300))
+        max_uses = int(os.getenv('TASKAFARIAN_DB_CONNECTION_MAX_USES', 1000))
+        return self.age >= max_age or self.uses >= max_uses
+
+    def is_usable(self) -> bool:
+        """Cheap validation of an idle connection.
+        A round trip to the database is made only if the connection was idle for a while
+        (e.g the lambda container was frozen and the server might have dropped the connection).
+        """
+        if self.closed or self.info.transaction_status == TRANSACTION_STATUS_UNKNOWN:
+            return False
+
+        ping_after = float(os.getenv('TASKAFARIAN_DB_CONNECTION_PING_AFTER', 30))
+        if self.idle_since is not None and time.monotonic() - self.idle_since >= ping_after:
+            try:
+                with self.cursor() as cursor:
+                    cursor.execute('SELECT 1;')
+                self.rollback()
+            except psycopg2.Error:
+                return False
+
+        return True
+
+    def reset(self) -> bool:
+        """Bring the connection back to the idle state (e.g rollback a transaction left open or aborted).
+        Returns False if the connection can not be recovered.
+        """
+        if self.closed:
+            return False
+
+        status = self.info.transaction_status
+        if status == TRANSACTION_STATUS_UNKNOWN:
+            return False
+        elif status != TRANSACTION_STATUS_IDLE:
+            try:
+                self.rollback()
+            except psycopg2.Error:
+                return False
+
+        self.defer_commit = False
+        if self.readonly:
+            self.readonly = False
+        return True
+
+    def commit(self, force=False):
+        """Commit, unless the connection takes part in a request-wide transaction (unit of work).
+        Then the request middleware commits once at the end of the request.
+        force - commit right away, for changes that must be kept even if the request fails
+        """
+        if force or not self.defer_commit:
+            super(Connection, self).commit()
+
+
+def connect(db_name=None, replica=False):
+    """Connect to the primary or to the replica.
+    The replica is configured with TASKAFARIAN_DB_REPLICA_* variables (HOST, NAME, PORT, USER, PASSWORD),
+    any of them that is not set falls back to the primary's value.
+    """
+    def setting(name):
+        value = os.getenv('TASKAFARIAN_DB_REPLICA_' + name) if replica else None
+        return value if value else os.getenv('TASKAFARIAN_DB_' + name)
+
+    db_name = db_name if db_name else setting('NAME')
+    connection = psycopg2.connect(
+        host=setting('HOST'),
         dbname=db_name,
-        user=os.getenv('TASKAFARIAN_DB_USER'),
-        password=os.getenv('TASKAFARIAN_DB_PASSWORD'),
+        user=setting('USER'),
+        password=setting('PASSWORD'),
+        connection_factory=Connection,
         cursor_factory=Cursor,
-        port=os.getenv('TASKAFARIAN_DB_PORT')
+        port=setting('PORT')
     )
+    connection.is_replica = replica
+    return connection
+
+
+def is_replica_configured() -> bool:
+    return bool(os.getenv('TASKAFARIAN_DB_REPLICA_HOST') or os.getenv('TASKAFARIAN_DB_REPLICA_NAME'))
+
+
+def get_pool(replica=False) -> ConnectionPool:
+    """Process wide connection pool (one for the primary and one for the replica).
+
+    Tunable with environment variables:
+        TASKAFARIAN_DB_POOL_MIN_SIZE - connections opened upfront (default 0)
+        TASKAFARIAN_DB_POOL_MAX_SIZE - connections kept open (default 4)
+        TASKAFARIAN_DB_POOL_MAX_OVERFLOW - extra short-lived connections allowed under load (default 0)
+        TASKAFARIAN_DB_POOL_TIMEOUT - seconds to wait for a connection (default 5)
+        TASKAFARIAN_DB_KEEP_ALIVE - set to 'False' to close connections after each request
+    """
+    global _pool, _replica_pool
+    pool = _replica_pool if replica else _pool
+    if pool is None:
+        with _pool_lock:
+            pool = _replica_pool if replica else _pool
+            if pool is None:
+                pool = ConnectionPool(
+                    (lambda: connect(replica=True)) if replica else connect,
+                    min_size=int(os.getenv('TASKAFARIAN_DB_POOL_MIN_SIZE', 0)),
+                    max_size=int(os.getenv('TASKAFARIAN_DB_POOL_MAX_SIZE', 4)),
+                    max_overflow=int(os.getenv('TASKAFARIAN_DB_POOL_MAX_OVERFLOW', 0)),
+                    timeout=float(os.getenv('TASKAFARIAN_DB_POOL_TIMEOUT', 5)),
+                    keep_alive=os.getenv('TASKAFARIAN_DB_KEEP_ALIVE', 'True') == 'True'
+                )
+                if replica:
+                    _replica_pool = pool
+                else:
+                    _pool = pool
+    return pool
+
+
+def get_db(intent=None):
+    """Connection of the current request. Checked out from the pool on first use.
+    In the unit-of-work mode (see begin_request) commits of the services are deferred until the end of the request.
+
+    intent - READ or WRITE, defaults to READ inside functions decorated with replica_safe.
+    Reads go to the replica (if configured) unless the request has already used the primary
+    or the current user wrote recently (see is_sticky). The primary is used when the replica is unreachable.
+    """
+    if intent is None:
+        intent = READ if g.replica_safe else WRITE
+
+    if intent == READ and g.db is None and is_replica_configured() and not is_sticky(g.current_user):
+        replica = _get_replica_db()
+        if replica is not None:
+            return replica
+
+    if g.db is None:
+        g.db = get_pool().checkout()
+        _apply_request_mode(g.db)
+    return g.db
+
+
+def _get_replica_db():
+    if g.replica_db is None:
+        try:
+            g.replica_db = get_pool(replica=True).checkout()
+        except (psycopg2.OperationalError, PoolTimeout) as error:
+            logger.warning('replica is not available, reading from the primary: {error}'.format(error=error))
+            return None
+        g.replica_db.defer_commit = g.unit_of_work
+        g.replica_db.readonly = True
+    return g.replica_db
+
+
+def replica_safe(func):
+    """Route or service function whose reads may be served by the replica (possibly slightly stale).
+    get_db() called inside defaults to the READ intent, so the function must not write.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        g.replica_safe += 1
+        try:
+            return func(*args, **kwargs)
+        finally:
+            g.replica_safe -= 1
+
+    return wrapper
+
+
+def is_sticky(user) -> bool:
+    """Read-your-writes: the user wrote less than TASKAFARIAN_DB_REPLICA_STICKINESS seconds ago
+    (default 0, disabled), so the replica may not have caught up yet.
+    Writes are remembered per process.
+    """
+    stickiness = float(os.getenv('TASKAFARIAN_DB_REPLICA_STICKINESS', 0))
+    if not stickiness or user is None:
+        return False
+
+    written_at = _last_writes.get(user.user_id)
+    return written_at is not None and time.monotonic() - written_at < stickiness
+
+
+def _remember_write(user):
+    stickiness = float(os.getenv('TASKAFARIAN_DB_REPLICA_STICKINESS', 0))
+    if not stickiness or user is None:
+        return
+
+    now = time.monotonic()
+    if len(_last_writes) >= MAX_LAST_WRITES:
+        for user_id, written_at in list(_last_writes.items()):
+            if now - written_at >= stickiness:
+                _last_writes.pop(user_id, None)
+    _last_writes[user.user_id] = now
 
 
-def get_db():
-    global _connection
-    if not _connection:
-        _connection = connect()
-    return _connection
+def _apply_request_mode(connection):
+    connection.defer_commit = g.unit_of_work
+    if connection.info.transaction_status == TRANSACTION_STATUS_IDLE:
+        connection.readonly = g.read_only
+
+
+def begin_request(read_only=False):
+    """Run the current request in a single transaction that is committed by commit_request.
+    read_only - the transaction is started as READ ONLY (e.g GET requests)
+    Disabled with TASKAFARIAN_DB_UNIT_OF_WORK=False.
+    """
+    g.unit_of_work = os.getenv('TASKAFARIAN_DB_UNIT_OF_WORK', 'True') == 'True'
+    g.read_only = g.unit_of_work and read_only
+    if g.db is not None:
+        _apply_request_mode(g.db)
+
+
+def commit_request():
+    """Commit the transaction of the current request (unit-of-work mode).
+    Anything not committed is rolled back when the connection is released.
+    """
+    if g.db is not None and g.current_request is not None and g.current_request.method != 'GET':
+        _remember_write(g.current_user)
+
+    if g.db is not None and g.unit_of_work:
+        g.db.defer_commit = False
+        g.db.commit()
+
+    callbacks, g.on_commit = g.on_commit, []
+    for callback in callbacks:
+        callback()
+
+
+def on_commit(callback):
+    """Call the callback once the transaction of the current request is committed
+    (right away outside of the unit-of-work mode). Dropped if the request fails.
+    """
+    if g.unit_of_work:
+        g.on_commit.append(callback)
+    else:
+        callback()
+
+
+def release_db():
+    """Return the connections of the current request to their pools.
+    """
+    if g.db is not None:
+        connection, g.db = g.db, None
+        connection.pool.checkin(connection)
+    if g.replica_db is not None:
+        connection, g.replica_db = g.replica_db, None
+        connection.pool.checkin(connection)
 
 
 def close_db():
-    global _connection
-    if _connection:
-        _connection.close()
-        _connection = None
+    """Close the connections of the current request and all idle connections.
+    """
+    global _pool, _replica_pool
+    if g.db is not None:
+        connection, g.db = g.db, None
+        connection.pool.discard(connection)
+    if g.replica_db is not None:
+        connection, g.replica_db = g.replica_db, None
+        connection.pool.discard(connection)
+
+    with _pool_lock:
+        for pool in (_pool, _replica_pool):
+            if pool is not None:
+                pool.close()
+        _pool = _replica_pool = None
 
 
 def create_db():
@@ -101,21 +470,6 @@ def drop_db():
         connection.close()
 
 
-def create_all():
-    connection = connect()
-
-    try:
-        with connection.cursor() as cursor:
-            with open(Path() / 'chalicelib' / 'sql' / 'schema.sql') as f:
-                cursor.execute(f.read())
-                connection.commit()
-    except psycopg2.Error as error:
-        connection.rollback()
-        logger.debug(error.pgerror)
-    finally:
-        connection.close()
-
-
 def check_connection():
     """Test database connection
     """
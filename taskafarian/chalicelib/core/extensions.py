@@ -6,6 +6,8 @@ from chalice import Response
 from marshmallow import ValidationError
 
 from chalicelib.core.exceptions import APIError
+from chalicelib.core.pool import PoolTimeout
+from chalicelib.core.security import PasswordHasherBusy
 
 
 class Blueprint(ChaliceBlueprint):
@@ -25,6 +27,8 @@ class Blueprint(ChaliceBlueprint):
                     return APIError(status=422, fields=exception.messages).to_http_response()
                 except APIError as exception:
                     return exception.to_http_response()
+                except (PoolTimeout, PasswordHasherBusy):
+                    return APIError(status=503, detail='Service is busy, try again later').to_http_response()
 
             return register_route(inner)
         return wrapped_view
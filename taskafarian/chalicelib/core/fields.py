@@ -15,3 +15,12 @@ class Password(fields.Str):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.validators.append(validate.Length(min=8, max=32))
+
+
+class CommaSeparatedList(fields.List):
+    """List passed as a single comma separated string, e.g a query parameter: ?status=todo,in_progress
+    """
+    def _deserialize(self, value, attr, data, **kwargs):
+        if isinstance(value, str):
+            value = [item.strip() for item in value.split(',') if item.strip()]
+        return super()._deserialize(value, attr, data, **kwargs)
@@ -0,0 +1,275 @@
+"""Versioned schema migrations.
+
+Migrations are sql files in chalicelib/sql/migrations named <version>_<name>.sql and applied in order.
+Applied versions are recorded in the schema_migration table. A session level advisory lock makes
+concurrent runs (e.g several lambda cold starts with TASKAFARIAN_DB_MIGRATE_ON_START=True) wait for each other.
+
+A migration runs in a single transaction unless its first line is:
+    -- migrate: no-transaction
+Such a migration is split into statements (separated by ';' at the end of a line, outside of $$ quoted
+bodies) and every statement runs on its own, which is required by CREATE INDEX CONCURRENTLY and friends
+and lets a DO block COMMIT between batches. Statements should be idempotent (IF NOT EXISTS) because
+a failed migration is re-run from the beginning; invalid indexes left behind by a failed concurrent build
+are dropped before the re-run.
+
+A migration that needs extensions which may not be installed on the server says so in a comment:
+    -- migrate: requires-extensions pg_trgm, btree_gist
+It is left pending (with a warning) while one of them is not available and applied by the first run
+after they are, so later migrations must not depend on it.
+
+usage (from the taskafarian directory):
+    python -m chalicelib.core.migrations [status]
+"""
+import re
+import sys
+import time
+from collections import namedtuple
+from pathlib import Path
+from typing import List
+
+import psycopg2
+
+from chalicelib.core.database import connect
+from chalicelib.core.logger import logger
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent.parent / 'sql' / 'migrations'
+NO_TRANSACTION_MARKER = '-- migrate: no-transaction'
+REQUIRES_EXTENSIONS_MARKER = '-- migrate: requires-extensions'
+
+# arbitrary key of the advisory lock held while migrating
+ADVISORY_LOCK_KEY = 7261432
+
+_file_name = re.compile(r'^(\d+)_(\w+)\.sql$')
+_statement_end = re.compile(r';[ \t]*$', re.MULTILINE)
+_dollar_quote = re.compile(r'\$(?:[A-Za-z_]\w*)?\$')
+_index_name = re.compile(r'\bINDEX\s+(?:CONCURRENTLY\s+)?(?:IF\s+NOT\s+EXISTS\s+)?(\w+)', re.IGNORECASE)
+
+
+class MigrationError(Exception):
+    pass
+
+
+class Migration(namedtuple('Migration', ['version', 'name', 'path'])):
+    @property
+    def sql(self) -> str:
+        return self.path.read_text()
+
+    @property
+    def is_transactional(self) -> bool:
+        return not self.sql.lstrip().startswith(NO_TRANSACTION_MARKER)
+
+    @property
+    def required_extensions(self) -> List[str]:
+        for line in self.sql.splitlines():
+            line = line.strip()
+            if line.startswith(REQUIRES_EXTENSIONS_MARKER):
+                names = line[len(REQUIRES_EXTENSIONS_MARKER):].split(',')
+                return [name.strip() for name in names if name.strip()]
+        return []
+
+    def statements(self) -> List[str]:
+        statements = []
+        lines = []
+        quote = None
+        for line in self.sql.splitlines():
+            lines.append(line)
+            if line.strip().startswith('--'):
+                continue
+            for tag in _dollar_quote.findall(line):
+                if quote is None:
+                    quote = tag
+                elif tag == quote:
+                    quote = None
+            if quote is None and _statement_end.search(line):
+                lines[-1] = _statement_end.sub('', line)
+                statements.append('\n'.join(lines))
+                lines = []
+        statements.append('\n'.join(lines))
+
+        return [
+            statement.strip() for statement in statements
+            if '\n'.join(line for line in statement.splitlines() if not line.strip().startswith('--')).strip()
+        ]
+
+
+def load_migrations(directory=MIGRATIONS_DIR) -> List[Migration]:
+    migrations = {}
+    for path in sorted(Path(directory).glob('*.sql')):
+        match = _file_name.match(path.name)
+        if not match:
+            raise MigrationError('unexpected migration file name: {}'.format(path.name))
+
+        version = int(match.group(1))
+        if version in migrations:
+            raise MigrationError('duplicate migration version {}: {}, {}'.format(
+                version, migrations[version].path.name, path.name))
+        migrations[version] = Migration(version, match.group(2), path)
+
+    return [migrations[version] for version in sorted(migrations)]
+
+
+def _create_version_table(cursor):
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS schema_migration (
+        version bigint primary key,
+        name text not null,
+        applied_at timestamptz not null default now(),
+        execution_time_ms double precision
+    );
+    ''')
+
+
+def _applied_versions(cursor) -> set:
+    cursor.execute('SELECT version FROM schema_migration;')
+    return {row.version for row in cursor.fetchall()}
+
+
+def _record(cursor, migration, execution_time):
+    cursor.execute('''
+    INSERT INTO schema_migration (version, name, execution_time_ms)
+    VALUES (%(version)s, %(name)s, %(execution_time_ms)s)
+    ;
+    ''', {'version': migration.version, 'name': migration.name, 'execution_time_ms': execution_time})
+
+
+def _missing_extensions(cursor, migration) -> List[str]:
+    """Extensions the migration requires that the server can not install
+    """
+    if not migration.required_extensions:
+        return []
+
+    cursor.execute('''
+    SELECT name
+    FROM pg_available_extensions
+    WHERE name = ANY(%(names)s)
+    ;
+    ''', {'names': migration.required_extensions})
+    available = {row.name for row in cursor.fetchall()}
+    return [name for name in migration.required_extensions if name not in available]
+
+
+def _drop_invalid_indexes(cursor, migration):
+    """Drop indexes of the migration left invalid by a failed CREATE INDEX CONCURRENTLY
+    """
+    names = _index_name.findall(migration.sql)
+    if not names:
+        return
+
+    cursor.execute('''
+    SELECT index_class.relname AS name
+    FROM pg_index
+    JOIN pg_class AS index_class ON index_class.oid = pg_index.indexrelid
+    WHERE NOT pg_index.indisvalid
+        AND index_class.relname = ANY(%(names)s)
+    ;
+    ''', {'names': names})
+
+    for index in cursor.fetchall():
+        logger.info('dropping invalid index {name}'.format(name=index.name))
+        cursor.execute('DROP INDEX CONCURRENTLY IF EXISTS {name};'.format(name=index.name))
+
+
+def _apply(connection, migration):
+    start_timestamp = time.perf_counter()
+    try:
+        with connection.cursor() as cursor:
+            if migration.is_transactional:
+                connection.autocommit = False
+                cursor.execute(migration.sql)
+                _record(cursor, migration, (time.perf_counter() - start_timestamp) * 1000)
+                connection.commit()
+            else:
+                _drop_invalid_indexes(cursor, migration)
+                for statement in migration.statements():
+                    cursor.execute(statement)
+                _record(cursor, migration, (time.perf_counter() - start_timestamp) * 1000)
+    except psycopg2.Error as error:
+        if not connection.autocommit:
+            connection.rollback()
+        raise MigrationError('migration {version}_{name} failed: {error}'.format(
+            version=migration.version,
+            name=migration.name,
+            error=error.pgerror or error
+        )) from error
+    finally:
+        connection.autocommit = True
+
+    logger.info('applied migration {version}_{name} in {execution_time:.3f}ms'.format(
+        version=migration.version,
+        name=migration.name,
+        execution_time=(time.perf_counter() - start_timestamp) * 1000
+    ))
+
+
+def migrate(directory=MIGRATIONS_DIR, target=None) -> List[Migration]:
+    """Apply pending migrations (up to the target version), returns the applied migrations.
+    """
+    migrations = load_migrations(directory)
+    applied = []
+
+    connection = connect()
+    connection.autocommit = True
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_lock(%s);', (ADVISORY_LOCK_KEY,))
+            try:
+                _create_version_table(cursor)
+                applied_versions = _applied_versions(cursor)
+
+                for migration in migrations:
+                    if target is not None and migration.version > target:
+                        break
+                    if migration.version in applied_versions:
+                        continue
+
+                    missing_extensions = _missing_extensions(cursor, migration)
+                    if missing_extensions:
+                        logger.warning('migration {version}_{name} left pending, {extensions} not available'.format(
+                            version=migration.version,
+                            name=migration.name,
+                            extensions=', '.join(missing_extensions)
+                        ))
+                        continue
+
+                    _apply(connection, migration)
+                    applied.append(migration)
+            finally:
+                cursor.execute('SELECT pg_advisory_unlock(%s);', (ADVISORY_LOCK_KEY,))
+    finally:
+        connection.close()
+
+    return applied
+
+
+def status(directory=MIGRATIONS_DIR) -> List[tuple]:
+    """(migration, is_applied) for every migration
+    """
+    connection = connect()
+    connection.autocommit = True
+    try:
+        with connection.cursor() as cursor:
+            _create_version_table(cursor)
+            applied_versions = _applied_versions(cursor)
+    finally:
+        connection.close()
+
+    return [(migration, migration.version in applied_versions) for migration in load_migrations(directory)]
+
+
+def main(command='migrate'):
+    if command == 'status':
+        for migration, is_applied in status():
+            print('{mark} {version:04d}_{name}'.format(
+                mark='[x]' if is_applied else '[ ]',
+                version=migration.version,
+                name=migration.name
+            ))
+    elif command == 'migrate':
+        for migration in migrate():
+            print('applied {version:04d}_{name}'.format(version=migration.version, name=migration.name))
+    else:
+        raise SystemExit('usage: python -m chalicelib.core.migrations [migrate|status]')
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
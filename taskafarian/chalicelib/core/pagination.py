@@ -0,0 +1,50 @@
+"""Keyset (cursor) pagination helpers.
+
+A cursor is the sort key of the last row of a page, e.g (created_at, task_id), encoded as an opaque
+url-safe token. The next page continues strictly after that key, so deep pages cost the same as the
+first one (no OFFSET) and rows inserted meanwhile don't shift the pages.
+"""
+import base64
+import binascii
+import json
+from datetime import datetime
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(values: list) -> str:
+    """Opaque token of the sort key values (datetimes are kept with their time zone and microseconds)
+    """
+    payload = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor(token: str, *types) -> list:
+    """Sort key values of the token, converted with types (e.g datetime.fromisoformat, int)
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        if not isinstance(payload, list) or len(payload) != len(types):
+            raise InvalidCursor(token)
+        return [convert(value) for convert, value in zip(types, payload)]
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError) as error:
+        raise InvalidCursor(token) from error
+
+
+def to_datetime(value: str) -> datetime:
+    """Aware datetime of a cursor value
+    """
+    value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        raise ValueError('naive datetime')
+    return value
+
+
+def nullable(convert):
+    """Converter of a cursor value that may be null (e.g a sort key on a nullable column)
+    """
+    def convert_nullable(value):
+        return None if value is None else convert(value)
+    return convert_nullable
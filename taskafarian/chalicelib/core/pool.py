@@ -0,0 +1,185 @@
+import threading
+import time
+from collections import deque
+
+from chalicelib.core.logger import logger
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """Thread-safe pool of database connections.
+
+    min_size - number of connections opened upfront
+    max_size - number of connections the pool keeps open
+    max_overflow - extra connections allowed under load, closed as soon as they are returned
+    timeout - seconds to wait for a free connection before PoolTimeout is raised
+    keep_alive - if False, connections are closed when returned (connect-per-request)
+    """
+    def __init__(self, connect, min_size=0, max_size=4, max_overflow=0, timeout=5.0, keep_alive=True):
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max(max_size, 1)
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.keep_alive = keep_alive
+        self.closed = False
+
+        self._condition = threading.Condition()
+        self._idle = deque()
+        self._size = 0  # open connections: idle + in use + being opened
+        self._in_use = 0
+
+        # metrics
+        self._checkouts = 0
+        self._timeouts = 0
+        self._waits = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+        self._peak_in_use = 0
+        self._peak_overflow = 0
+
+        for _ in range(min(min_size, self.max_size)):
+            connection = self._open()
+            connection.idle_since = time.monotonic()
+            self._idle.append(connection)
+            self._size += 1
+
+    def _open(self):
+        connection = self._connect()
+        connection.pool = self
+        return connection
+
+    def _acquire(self, deadline):
+        """Take an idle connection or reserve a slot for a new one (returns None).
+        Returns the time spent waiting in seconds as the second value.
+        """
+        wait_started_at = None
+        with self._condition:
+            while True:
+                if self._idle:
+                    # LIFO: the most recently used connection is the warmest one,
+                    # the rest are left to age out.
+                    connection = self._idle.pop()
+                    break
+                elif self._size < self.max_size + self.max_overflow:
+                    self._size += 1
+                    connection = None
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout('no database connection available after {timeout}s (in use: {in_use})'.format(
+                        timeout=self.timeout,
+                        in_use=self._in_use
+                    ))
+
+                if wait_started_at is None:
+                    wait_started_at = time.perf_counter()
+                self._condition.wait(remaining)
+
+        return connection, (time.perf_counter() - wait_started_at if wait_started_at else 0.0)
+
+    def _forget(self):
+        """Forget a connection that was closed or could not be opened.
+        """
+        with self._condition:
+            self._size -= 1
+            self._condition.notify()
+
+    def checkout(self):
+        deadline = time.monotonic() + self.timeout
+        wait_time = 0.0
+
+        while True:
+            connection, waited = self._acquire(deadline)
+            wait_time += waited
+
+            if connection is None:
+                try:
+                    connection = self._open()
+                except Exception:
+                    self._forget()
+                    raise
+            elif not connection.is_usable():
+                connection.close()
+                self._forget()
+                continue
+
+            break
+
+        connection.idle_since = None
+        with self._condition:
+            self._in_use += 1
+            self._checkouts += 1
+            self._peak_in_use = max(self._peak_in_use, self._in_use)
+            self._peak_overflow = max(self._peak_overflow, self._size - self.max_size)
+            if wait_time:
+                self._waits += 1
+                self._wait_time_total += wait_time
+                self._wait_time_max = max(self._wait_time_max, wait_time)
+
+        if wait_time:
+            logger.debug('waited {wait_time:.3f}ms for a database connection'.format(wait_time=wait_time * 1000))
+
+        return connection
+
+    def checkin(self, connection):
+        connection.uses += 1
+        reusable = self.keep_alive and connection.reset() and not connection.is_worn_out()
+
+        with self._condition:
+            self._in_use -= 1
+            if reusable and not self.closed and self._size <= self.max_size:
+                connection.idle_since = time.monotonic()
+                self._idle.append(connection)
+                connection = None
+            else:
+                self._size -= 1
+            self._condition.notify()
+
+        if connection is not None:
+            connection.close()
+
+    def discard(self, connection):
+        """Close a checked out connection instead of returning it to the pool.
+        """
+        connection.close()
+        with self._condition:
+            self._in_use -= 1
+            self._size -= 1
+            self._condition.notify()
+
+    def close(self):
+        """Close idle connections. Connections in use are closed when they are returned.
+        """
+        with self._condition:
+            self.closed = True
+            idle, self._idle = list(self._idle), deque()
+            self._size -= len(idle)
+            self._condition.notify_all()
+
+        for connection in idle:
+            connection.close()
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._in_use,
+                'overflow': max(self._size - self.max_size, 0),
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'max_overflow': self.max_overflow,
+                'checkouts': self._checkouts,
+                'timeouts': self._timeouts,
+                'waits': self._waits,
+                'wait_time_total_ms': self._wait_time_total * 1000,
+                'wait_time_max_ms': self._wait_time_max * 1000,
+                'peak_in_use': self._peak_in_use,
+                'peak_overflow': self._peak_overflow,
+            }
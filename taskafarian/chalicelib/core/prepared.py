@@ -0,0 +1,53 @@
+import re
+
+_statements = {}
+_placeholder = re.compile(r'%\((\w+)\)s')
+
+
+class PreparedStatement:
+    """Named statement that is PREPAREd once per connection and EXECUTEd afterwards,
+    so postgres parses and plans it only once per session.
+
+    The query uses the usual named placeholders (%(name)s), they are translated to
+    positional parameters ($1, $2, ...) for PREPARE.
+    Pass it to cursor.execute() like a regular query.
+    """
+    def __init__(self, name: str, query: str):
+        self.name = name
+        self.query = query
+        self.params = []
+
+        def to_positional(match):
+            param = match.group(1)
+            if param not in self.params:
+                self.params.append(param)
+            return '${}'.format(self.params.index(param) + 1)
+
+        # %% is an escaped % for psycopg2, but PREPARE is sent without parameters
+        body = _placeholder.sub(to_positional, query).replace('%%', '%').strip().rstrip(';')
+        self.prepare_sql = 'PREPARE {name} AS {body};'.format(name=name, body=body)
+
+        if self.params:
+            self.execute_sql = 'EXECUTE {name} ({params});'.format(
+                name=name,
+                params=', '.join('%({})s'.format(param) for param in self.params)
+            )
+        else:
+            self.execute_sql = 'EXECUTE {name};'.format(name=name)
+
+    def __repr__(self):
+        return '<PreparedStatement {name}>'.format(name=self.name)
+
+
+def prepared_statement(name: str, query: str) -> PreparedStatement:
+    """Register a named statement. Names are global per connection so they must be unique.
+    """
+    if name in _statements and _statements[name].query != query:
+        raise ValueError('prepared statement {name} is already registered'.format(name=name))
+
+    _statements.setdefault(name, PreparedStatement(name, query))
+    return _statements[name]
+
+
+def get_statements() -> dict:
+    return dict(_statements)
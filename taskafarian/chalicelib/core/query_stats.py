@@ -0,0 +1,182 @@
+"""In-process statistics of executed queries grouped by fingerprint
+(the query with literals and placeholders replaced by '?').
+
+Enabled with TASKAFARIAN_DB_QUERY_STATS=True or enable().
+"""
+import os
+import re
+import threading
+from bisect import bisect_left
+
+from psycopg2.sql import Composable
+
+from chalicelib.core.prepared import PreparedStatement
+
+# upper bounds of the histogram buckets, the last bucket is unbounded
+TIME_BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000)
+
+MAX_FINGERPRINTS = 1000
+
+_enabled = None
+_lock = threading.Lock()
+_stats = {}
+_fingerprints = {}
+
+_comment = re.compile(r'--[^\n]*')
+_string = re.compile(r"'(?:[^']|'')*'")
+_number = re.compile(r'\b\d+(?:\.\d+)?\b')
+_placeholder = re.compile(r'%\(\w+\)s|%s|\$\d+')
+_in_list = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_whitespace = re.compile(r'\s+')
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, percent):
+        """Upper bound of the bucket holding the percentile (None if it is in the unbounded bucket)
+        """
+        count = sum(self.counts)
+        if not count:
+            return None
+
+        threshold = count * percent / 100
+        seen = 0
+        for bucket, bucket_count in zip(self.buckets, self.counts):
+            seen += bucket_count
+            if seen >= threshold:
+                return bucket
+        return None
+
+    def to_dict(self):
+        return {
+            'buckets': {
+                **{'le_{}'.format(bucket): count for bucket, count in zip(self.buckets, self.counts)},
+                'inf': self.counts[-1]
+            },
+            'total': self.total,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+        }
+
+
+class QueryStats:
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.calls = 0
+        self.errors = 0
+        self.callers = {}
+        self.execution_time = Histogram(TIME_BUCKETS_MS)
+        self.rows = Histogram(ROW_BUCKETS)
+
+    def to_dict(self):
+        return {
+            'fingerprint': self.fingerprint,
+            'calls': self.calls,
+            'errors': self.errors,
+            'callers': dict(self.callers),
+            'execution_time_ms': self.execution_time.to_dict(),
+            'rows': self.rows.to_dict(),
+        }
+
+
+def is_enabled() -> bool:
+    global _enabled
+    if _enabled is None:
+        _enabled = os.getenv('TASKAFARIAN_DB_QUERY_STATS') == 'True'
+    return _enabled
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def normalize(query: str) -> str:
+    query = _comment.sub(' ', query)
+    query = _string.sub('?', query)
+    query = _placeholder.sub('?', query)
+    query = _number.sub('?', query)
+    query = _in_list.sub('(...)', query)
+    return _whitespace.sub(' ', query).strip().rstrip(';').strip()
+
+
+def fingerprint(query, context=None) -> str:
+    """Fingerprint of a query template (str, psycopg2.sql.Composable or PreparedStatement).
+    """
+    if isinstance(query, PreparedStatement):
+        query = query.query
+    elif isinstance(query, Composable):
+        query = query.as_string(context)
+    elif isinstance(query, bytes):
+        query = query.decode('utf-8')
+
+    try:
+        return _fingerprints[query]
+    except KeyError:
+        value = normalize(query)
+        if len(_fingerprints) < MAX_FINGERPRINTS:
+            _fingerprints[query] = value
+        return value
+
+
+def record(query, rows: int, execution_time: float, caller: str = None, context=None, error=False):
+    """Record execution of a query, execution_time is in milliseconds
+    """
+    key = fingerprint(query, context)
+    with _lock:
+        stats = _stats.get(key)
+        if stats is None:
+            if len(_stats) >= MAX_FINGERPRINTS:
+                key = '<other>'
+                stats = _stats.setdefault(key, QueryStats(key))
+            else:
+                stats = _stats[key] = QueryStats(key)
+
+        stats.calls += 1
+        if error:
+            stats.errors += 1
+        if caller:
+            stats.callers[caller] = stats.callers.get(caller, 0) + 1
+        stats.execution_time.add(execution_time)
+        if rows is not None and rows >= 0:
+            stats.rows.add(rows)
+
+
+def get_stats(order_by='total_time') -> list:
+    """Statistics of every fingerprint, the most expensive first.
+    order_by: total_time | calls | max_time
+    """
+    sort_keys = {
+        'total_time': lambda stats: stats.execution_time.total,
+        'calls': lambda stats: stats.calls,
+        'max_time': lambda stats: stats.execution_time.max or 0,
+    }
+    with _lock:
+        ordered = sorted(_stats.values(), key=sort_keys[order_by], reverse=True)
+        return [stats.to_dict() for stats in ordered]
+
+
+def reset():
+    with _lock:
+        _stats.clear()
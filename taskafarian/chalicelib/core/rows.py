@@ -0,0 +1,98 @@
+import keyword
+import re
+import threading
+
+MAX_CACHE = 1024
+
+_cache = {}
+_lock = threading.Lock()
+_re_clean = re.compile('[^a-zA-Z0-9_]')
+
+
+class Row:
+    """Compact row with attribute access.
+    Row classes are generated once per column signature (see row_class) and use __slots__.
+
+    Behaves like the namedtuples of NamedTupleCursor (row.name, row[0], iteration, _asdict()),
+    row['name'] is supported as well, which is what marshmallow tries first when it dumps an object.
+    """
+    __slots__ = ()
+    _fields = ()
+
+    def __getitem__(self, key):
+        if key.__class__ is str:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        elif isinstance(key, slice):
+            return tuple(self)[key]
+        return getattr(self, self._fields[key])
+
+    def __iter__(self):
+        for field in self._fields:
+            yield getattr(self, field)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __eq__(self, other):
+        if isinstance(other, (Row, tuple)):
+            return tuple(self) == tuple(other)
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(tuple(self))
+
+    def __repr__(self):
+        return 'Row({})'.format(', '.join('{}={!r}'.format(field, value) for field, value in self._asdict().items()))
+
+    def _asdict(self) -> dict:
+        return {field: getattr(self, field) for field in self._fields}
+
+
+def _field_names(columns):
+    fields = []
+    for column in columns:
+        field = _re_clean.sub('_', column) or 'f'
+        # same rules as NamedTupleCursor: no leading underscore or digit
+        if field[0] == '_' or '0' <= field[0] <= '9':
+            field = 'f' + field
+        if keyword.iskeyword(field):
+            field += '_'
+        while field in fields:
+            field += '_'
+        fields.append(field)
+    return tuple(fields)
+
+
+def _make_row_class(columns):
+    fields = _field_names(columns)
+
+    # __init__ is generated so that a row is built with plain slot assignments
+    # (the same way collections.namedtuple used to build its classes)
+    source = 'def __init__(self, {args}):\n{body}\n'.format(
+        args=', '.join(fields),
+        body='\n'.join('    self.{field} = {field}'.format(field=field) for field in fields) or '    pass'
+    )
+    namespace = {}
+    exec(source, namespace)
+
+    return type('Row', (Row,), {
+        '__slots__': fields,
+        '_fields': fields,
+        '__init__': namespace['__init__'],
+    })
+
+
+def row_class(columns: tuple) -> type:
+    """Row class for the column names of a result set, cached by the column signature.
+    """
+    try:
+        return _cache[columns]
+    except KeyError:
+        cls = _make_row_class(columns)
+        with _lock:
+            if len(_cache) >= MAX_CACHE:
+                _cache.clear()
+            return _cache.setdefault(columns, cls)
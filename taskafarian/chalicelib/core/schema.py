@@ -1,4 +1,4 @@
-from marshmallow import Schema, fields
+from marshmallow import Schema, fields, validate
 
 
 def camelcase(s):
@@ -21,3 +21,11 @@ class EntityListMeta(BaseSchema):
     count = fields.Int()
     offset = fields.Int()
     limit = fields.Int()
+    next_cursor = fields.Str(allow_none=True)  # continuation token of keyset paginated lists
+
+
+class PageParams(BaseSchema):
+    """Query parameters of keyset paginated lists
+    """
+    limit = fields.Int(missing=20, validate=validate.Range(min=1, max=100))
+    cursor = fields.Str()
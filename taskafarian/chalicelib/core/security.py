@@ -1,10 +1,175 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import bcrypt
 
+_hasher = None
+_hasher_lock = threading.Lock()
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+class PasswordHasher:
+    """Runs bcrypt on a pool of worker threads (bcrypt releases the GIL).
+
+    workers - passwords hashed / checked at the same time
+    queue_size - calls waiting for a free worker, beyond that calls wait for a place in the queue
+    timeout - seconds to wait for a place in the queue before PasswordHasherBusy is raised (0 sheds right away)
+
+    Batches (map) have at most workers items in the queue at once, the other places stay free for single calls
+    such as log-ins.
+    """
+    def __init__(self, workers=2, queue_size=16, timeout=1.0):
+        self.workers = max(workers, 1)
+        self.queue_size = max(queue_size, 0)
+        self.timeout = timeout
+
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='password-hasher')
+        self._slots = threading.BoundedSemaphore(self.workers + self.queue_size)
+        self._batch_slots = threading.BoundedSemaphore(self.workers)
+        self._lock = threading.Lock()
+
+        # metrics
+        self._pending = 0
+        self._peak_pending = 0
+        self._calls = 0
+        self._rejected = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+
+    def run(self, func, *args):
+        """Run func on a worker and wait for its result
+        """
+        return self._submit(func, *args).result()
+
+    def map(self, func, *iterables) -> list:
+        """Run func for every item on the workers and wait for all the results (in order).
+        The items are submitted as earlier ones finish, at most workers at a time, so a large batch
+        neither waits for places in the queue nor takes them from single calls.
+        """
+        futures = []
+        for args in zip(*iterables):
+            self._batch_slots.acquire()
+            try:
+                future = self._submit(func, *args)
+            except BaseException:
+                self._batch_slots.release()
+                raise
+            future.add_done_callback(lambda _: self._batch_slots.release())
+            futures.append(future)
+        return [future.result() for future in futures]
+
+    def _submit(self, func, *args):
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._rejected += 1
+            raise PasswordHasherBusy()
+
+        with self._lock:
+            self._calls += 1
+            self._pending += 1
+            self._peak_pending = max(self._peak_pending, self._pending)
+
+        submitted_at = time.perf_counter()
+
+        def call():
+            wait_time = time.perf_counter() - submitted_at
+            with self._lock:
+                self._wait_time_total += wait_time
+                self._wait_time_max = max(self._wait_time_max, wait_time)
+            return func(*args)
+
+        def release(future):
+            with self._lock:
+                self._pending -= 1
+            self._slots.release()
+
+        future = self._executor.submit(call)
+        future.add_done_callback(release)
+        return future
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'queue_size': self.queue_size,
+                'pending': self._pending,
+                'peak_pending': self._peak_pending,
+                'calls': self._calls,
+                'rejected': self._rejected,
+                'wait_time_total_ms': self._wait_time_total * 1000,
+                'wait_time_max_ms': self._wait_time_max * 1000,
+            }
+
+
+def get_password_hasher() -> PasswordHasher:
+    """Process wide password hasher.
+
+    Tunable with environment variables:
+        TASKAFARIAN_PASSWORD_HASHER_WORKERS - concurrency cap (default: number of cpus, at most 4)
+        TASKAFARIAN_PASSWORD_HASHER_QUEUE_SIZE - calls allowed to wait for a worker (default 16)
+        TASKAFARIAN_PASSWORD_HASHER_TIMEOUT - seconds to wait when the queue is full (default 1)
+    """
+    global _hasher
+    if _hasher is None:
+        with _hasher_lock:
+            if _hasher is None:
+                _hasher = PasswordHasher(
+                    workers=int(os.getenv('TASKAFARIAN_PASSWORD_HASHER_WORKERS', min(os.cpu_count() or 1, 4))),
+                    queue_size=int(os.getenv('TASKAFARIAN_PASSWORD_HASHER_QUEUE_SIZE', 16)),
+                    timeout=float(os.getenv('TASKAFARIAN_PASSWORD_HASHER_TIMEOUT', 1))
+                )
+    return _hasher
+
+
+def close_password_hasher():
+    global _hasher
+    with _hasher_lock:
+        if _hasher is not None:
+            _hasher.close()
+            _hasher = None
+
+
+def get_rounds() -> int:
+    """bcrypt cost of new hashes, TASKAFARIAN_PASSWORD_ROUNDS (default 12)
+    """
+    return int(os.getenv('TASKAFARIAN_PASSWORD_ROUNDS', 12))
+
+
+def _hash_password(plain_password: str, rounds: int) -> str:
+    return bcrypt.hashpw(plain_password.encode(), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _check_password(plain_password: str, hashed_password: str) -> bool:
+    return bcrypt.checkpw(plain_password.encode(), hashed_password.encode())
+
 
 def hash_password(plain_password: str) -> str:
-    return bcrypt.hashpw(plain_password.encode(), bcrypt.gensalt()).decode('utf-8')
+    return get_password_hasher().run(_hash_password, plain_password, get_rounds())
+
+
+def hash_passwords(plain_passwords: list) -> list:
+    """Hashes of the passwords, computed in parallel by the workers of the password hasher
+    """
+    rounds = get_rounds()
+    return get_password_hasher().map(_hash_password, plain_passwords, [rounds] * len(plain_passwords))
 
 
 def check_password(plain_password: str, hashed_password: str) -> bool:
-    return bcrypt.checkpw(plain_password.encode(), hashed_password.encode())
+    return get_password_hasher().run(_check_password, plain_password, hashed_password)
+
 
+def needs_rehash(hashed_password: str) -> bool:
+    """The hash was created with a cost other than the configured one ($2b$<cost>$...)
+    """
+    try:
+        return int(hashed_password.split('$')[2]) != get_rounds()
+    except (IndexError, ValueError):
+        return True
@@ -1,11 +1,32 @@
-class Shared:
+import threading
+
+
+class Shared(threading.local):
+    """Request context. Every thread gets its own copy so concurrent requests don't share state.
+    """
     def __init__(self):
         self.current_user = None
         self.current_request = None
+        self.db = None
+        self.replica_db = None
+        self.replica_safe = 0
+        self.on_commit = []
+        self.team_roles = {}  # user_id -> {team_id: user_role}, see services.user.get_team_roles
+        self.fresh_team_roles = set()  # users whose team_roles were read from the database by this request
+        self.unit_of_work = False
+        self.read_only = False
 
     def clear(self):
         self.current_user = None
         self.current_request = None
+        self.db = None
+        self.replica_db = None
+        self.replica_safe = 0
+        self.on_commit = []
+        self.team_roles = {}
+        self.fresh_team_roles = set()
+        self.unit_of_work = False
+        self.read_only = False
 
 
 g = Shared()
@@ -0,0 +1,226 @@
+"""Capture execution plans of slow queries.
+
+Queries slower than TASKAFARIAN_DB_SLOW_QUERY_MS are explained right after they run:
+    - inside a transaction: EXPLAIN (ANALYZE, BUFFERS) in a savepoint that is rolled back,
+      so neither the data nor the surrounding transaction is affected
+      (sequences used by an INSERT are still advanced, they are not transactional)
+    - in autocommit mode: EXPLAIN (ANALYZE, BUFFERS) for reads, plain EXPLAIN for writes
+
+Parameters and literals in the plan are redacted. Every fingerprint is captured at most once per
+TASKAFARIAN_DB_SLOW_QUERY_COOLDOWN seconds (default 60). Captures are kept in memory and appended to
+TASKAFARIAN_DB_SLOW_QUERY_FILE (json lines) if set.
+
+Report:
+    python -m benchmarks.slow_query_report slow-queries.jsonl
+"""
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_INERROR
+from psycopg2.sql import Composable
+
+from chalicelib.core import query_stats
+from chalicelib.core.logger import logger
+from chalicelib.core.prepared import PreparedStatement
+
+EXPLAINABLE = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'VALUES', 'TABLE')
+
+# plan fields that may contain literals
+CONDITION_KEYS = ('Filter', 'Index Cond', 'Recheck Cond', 'Join Filter', 'Hash Cond',
+                  'Merge Cond', 'One-Time Filter', 'TID Cond')
+
+_threshold_ms = None
+_lock = threading.Lock()
+_captures = deque(maxlen=100)
+_captured_at = {}
+
+_write = re.compile(r'\b(INSERT|UPDATE|DELETE|MERGE)\b', re.IGNORECASE)
+_literal = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+
+def threshold_ms():
+    """Threshold in milliseconds or None if the capture is disabled
+    """
+    global _threshold_ms
+    if _threshold_ms is None:
+        _threshold_ms = float(os.getenv('TASKAFARIAN_DB_SLOW_QUERY_MS', -1))
+    return _threshold_ms if _threshold_ms >= 0 else None
+
+
+def configure(threshold=None):
+    """Set the threshold in milliseconds, None disables the capture
+    """
+    global _threshold_ms
+    _threshold_ms = -1 if threshold is None else threshold
+    with _lock:
+        _captured_at.clear()
+
+
+def redact_params(params):
+    if isinstance(params, dict):
+        return {key: type(value).__name__ for key, value in params.items()}
+    elif isinstance(params, (list, tuple)):
+        return [type(value).__name__ for value in params]
+    return None
+
+
+def redact_plan(node):
+    if isinstance(node, dict):
+        return {
+            key: _literal.sub('?', value) if key in CONDITION_KEYS and isinstance(value, str) else redact_plan(value)
+            for key, value in node.items()
+        }
+    elif isinstance(node, list):
+        return [redact_plan(value) for value in node]
+    return node
+
+
+def _explain(cursor, options, query, params):
+    cursor.execute('EXPLAIN ({options}, FORMAT JSON) {query}'.format(options=options, query=query), params)
+    return cursor.fetchone()[0]
+
+
+def _should_capture(fingerprint):
+    cooldown = float(os.getenv('TASKAFARIAN_DB_SLOW_QUERY_COOLDOWN', 60))
+    now = time.monotonic()
+    with _lock:
+        if fingerprint in _captured_at and now - _captured_at[fingerprint] < cooldown:
+            return False
+        _captured_at[fingerprint] = now
+        return True
+
+
+def capture(cursor, query, params, execution_time, caller=None):
+    """Explain a query that has just been executed by the cursor. Never raises.
+    """
+    if isinstance(query, PreparedStatement):
+        query = query.query
+    elif isinstance(query, Composable):
+        query = query.as_string(cursor)
+    elif isinstance(query, bytes):
+        query = query.decode('utf-8')
+
+    text = query.strip().rstrip(';').strip()
+    if ';' in text or not text.split(None, 1) or text.split(None, 1)[0].upper() not in EXPLAINABLE:
+        # multiple statements or a statement that can't be explained
+        return None
+
+    connection = cursor.connection
+    if connection.closed or connection.info.transaction_status == TRANSACTION_STATUS_INERROR:
+        return None
+
+    fingerprint = query_stats.fingerprint(text)
+    if not _should_capture(fingerprint):
+        return None
+
+    is_write = bool(_write.search(text))
+    plan, analyzed = None, False
+    try:
+        with connection.cursor(cursor_factory=psycopg2.extensions.cursor) as explain_cursor:
+            if connection.autocommit:
+                if not is_write:
+                    plan, analyzed = _explain(explain_cursor, 'ANALYZE, BUFFERS', text, params), True
+            else:
+                explain_cursor.execute('SAVEPOINT slow_query_capture;')
+                try:
+                    plan, analyzed = _explain(explain_cursor, 'ANALYZE, BUFFERS', text, params), True
+                except psycopg2.Error as error:
+                    logger.debug('could not analyze slow query: {error}'.format(error=error))
+                finally:
+                    explain_cursor.execute('ROLLBACK TO SAVEPOINT slow_query_capture;')
+                    explain_cursor.execute('RELEASE SAVEPOINT slow_query_capture;')
+
+            if plan is None:
+                plan = _explain(explain_cursor, 'VERBOSE false', text, params)
+    except psycopg2.Error as error:
+        logger.warning('could not explain slow query: {error}'.format(error=error))
+        return None
+
+    entry = {
+        'fingerprint': fingerprint,
+        'query': text,
+        'params': redact_params(params),
+        'caller': caller,
+        'execution_time_ms': execution_time,
+        'captured_at': datetime.now(timezone.utc).isoformat(),
+        'analyzed': analyzed,
+        'plan': redact_plan(plan),
+    }
+    with _lock:
+        _captures.append(entry)
+
+    path = os.getenv('TASKAFARIAN_DB_SLOW_QUERY_FILE')
+    if path:
+        with open(path, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+
+    logger.info('slow query ({execution_time:.3f}ms) captured: {caller}'.format(
+        execution_time=execution_time,
+        caller=caller or fingerprint[:80]
+    ))
+    return entry
+
+
+def get_captures() -> list:
+    with _lock:
+        return list(_captures)
+
+
+def reset():
+    with _lock:
+        _captures.clear()
+        _captured_at.clear()
+
+
+def render_plan(node, depth=0) -> list:
+    details = [node['Node Type']]
+    if 'Relation Name' in node:
+        details.append('on {}'.format(node['Relation Name']))
+    if 'Index Name' in node:
+        details.append('using {}'.format(node['Index Name']))
+
+    line = '{indent}-> {details}  (cost={cost} rows={rows})'.format(
+        indent='   ' * depth,
+        details=' '.join(details),
+        cost=node.get('Total Cost'),
+        rows=node.get('Plan Rows')
+    )
+    if 'Actual Total Time' in node:
+        line += ' (actual time={time}ms rows={rows} loops={loops} shared hit={hit} read={read})'.format(
+            time=node['Actual Total Time'],
+            rows=node['Actual Rows'],
+            loops=node['Actual Loops'],
+            hit=node.get('Shared Hit Blocks'),
+            read=node.get('Shared Read Blocks')
+        )
+
+    lines = [line]
+    for key in CONDITION_KEYS:
+        if key in node:
+            lines.append('{indent}      {key}: {value}'.format(indent='   ' * depth, key=key, value=node[key]))
+    for child in node.get('Plans', []):
+        lines.extend(render_plan(child, depth + 1))
+    return lines
+
+
+def render_report(captures) -> str:
+    lines = []
+    for entry in sorted(captures, key=lambda entry: entry['execution_time_ms'], reverse=True):
+        [plan] = entry['plan']
+        lines.append('=' * 100)
+        lines.append('{execution_time_ms:.3f}ms  {caller}  {captured_at}  analyzed={analyzed}'.format(**entry))
+        lines.append(entry['fingerprint'])
+        lines.append('params: {}'.format(entry['params']))
+        lines.extend(render_plan(plan['Plan']))
+        if 'Execution Time' in plan:
+            lines.append('planning: {planning}ms execution: {execution}ms'.format(
+                planning=plan.get('Planning Time'),
+                execution=plan['Execution Time']
+            ))
+    return '\n'.join(lines)
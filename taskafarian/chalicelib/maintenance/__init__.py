@@ -0,0 +1,5 @@
+from chalicelib.maintenance.scheduled import blueprint
+
+
+def init_app(app):
+    app.register_blueprint(blueprint)
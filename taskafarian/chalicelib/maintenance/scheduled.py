@@ -0,0 +1,50 @@
+import os
+
+from chalice import Blueprint, Rate
+
+from chalicelib.core.database import release_db
+from chalicelib.core.shared import g
+from chalicelib.services import auth, mail
+
+blueprint = Blueprint(__name__)
+
+
+@blueprint.schedule(Rate(1, unit=Rate.HOURS))
+def purge_expired_tokens(event):
+    """Hourly purge of expired tokens.
+
+    Tunable with environment variables:
+        TASKAFARIAN_PURGE_BATCH_SIZE - rows deleted per transaction (default 1000)
+        TASKAFARIAN_PURGE_TIME_BUDGET - seconds the purge may run, keep it below the lambda timeout (default 60)
+    """
+    try:
+        return auth.purge_expired_tokens(
+            batch_size=int(os.getenv('TASKAFARIAN_PURGE_BATCH_SIZE', 1000)),
+            time_budget=float(os.getenv('TASKAFARIAN_PURGE_TIME_BUDGET', 60))
+        )
+    finally:
+        # scheduled events don't go through the http middleware
+        release_db()
+        g.clear()
+
+
+@blueprint.schedule(Rate(1, unit=Rate.MINUTES))
+def deliver_emails(event):
+    """Delivery of the email outbox (activation links, password resets), see services.mail.deliver_emails.
+
+    Tunable with environment variables (SMTP settings, see services.mail.get_mailer):
+        TASKAFARIAN_EMAIL_BATCH_SIZE - emails claimed per transaction (default 50)
+        TASKAFARIAN_EMAIL_TIME_BUDGET - seconds the delivery may run, keep it below the lambda timeout (default 50)
+        TASKAFARIAN_EMAIL_MAX_ATTEMPTS - attempts before an email is marked as failed (default 5)
+        TASKAFARIAN_EMAIL_RETRY_BACKOFF - seconds before the first retry, doubled after every attempt (default 30)
+    """
+    try:
+        return mail.deliver_emails(
+            batch_size=int(os.getenv('TASKAFARIAN_EMAIL_BATCH_SIZE', 50)),
+            time_budget=float(os.getenv('TASKAFARIAN_EMAIL_TIME_BUDGET', 50)),
+            max_attempts=int(os.getenv('TASKAFARIAN_EMAIL_MAX_ATTEMPTS', 5)),
+            retry_backoff=float(os.getenv('TASKAFARIAN_EMAIL_RETRY_BACKOFF', 30))
+        )
+    finally:
+        release_db()
+        g.clear()
@@ -1,15 +1,44 @@
+import hashlib
 import os
 import secrets
-from collections import namedtuple
+import threading
+import time
 from datetime import datetime, timedelta, timezone
 from enum import Enum
 
 import jwt
 import psycopg2
+from psycopg2.extras import execute_values
+from psycopg2.sql import SQL, Identifier
 
-from chalicelib.core.database import get_db
+from chalicelib.core.cache import TTLCache
+from chalicelib.core.database import (READ, WRITE, get_db, on_commit,
+                                      replica_safe)
 from chalicelib.core.logger import logger
-from chalicelib.core.security import check_password, hash_password
+from chalicelib.core.prepared import prepared_statement
+from chalicelib.core.rows import Row, row_class
+from chalicelib.core.security import (check_password, hash_password,
+                                      hash_passwords, needs_rehash)
+from chalicelib.services.mail import enqueue_email, enqueue_emails
+from chalicelib.services.user import add_team_members
+
+_token_cache = None
+
+# tables purged by purge_expired_tokens and their primary keys
+EXPIRING_TABLES = (
+    ('token', ('user_id', 'token')),
+    ('revoked_token', ('jti',)),
+    ('refresh_token', ('refresh_token_id',)),
+)
+
+# jti -> expires_at of revoked access tokens, reloaded from the revoked_token table, see is_revoked
+_revoked_tokens = {}
+_revoked_tokens_loaded_at = None
+_revoked_tokens_lock = threading.Lock()
+
+# g.current_user authenticated by an access token looks like the row returned by get_user_by_token
+AccessTokenUser = row_class(('user_id', 'username', 'email', 'first_name', 'last_name',
+                             'created_at', 'updated_at', 'is_active', 'token', 'expires_at'))
 
 
 class DuplicateEmail(Exception):
@@ -36,6 +65,10 @@ class UserNotFound(Exception):
     pass
 
 
+class RefreshTokenReused(BadCredentials):
+    pass
+
+
 class ActionType(Enum):
     """Intended to be used with JWT tokens.
     Users should not be able to use token from one flow in another flow.
@@ -43,6 +76,23 @@ class ActionType(Enum):
     """
     PASSWORD_RESET = 'password_reset'
     USER_ACTIVATION = 'user_activation'
+    ACCESS = 'access'
+
+
+class AuthTokenMode(Enum):
+    """How log_in authenticates users, see get_auth_token_mode.
+    """
+    OPAQUE = 'opaque'
+    JWT = 'jwt'
+
+
+def get_auth_token_mode() -> AuthTokenMode:
+    """TASKAFARIAN_AUTH_TOKEN_MODE:
+        opaque (default) - random tokens stored in the token table, looked up on every request (see get_token_cache)
+        jwt - short-lived signed access tokens verified without the database, see create_access_token
+    Both kinds of tokens are accepted in either mode, so the mode can be switched without logging everybody out.
+    """
+    return AuthTokenMode(os.getenv('TASKAFARIAN_AUTH_TOKEN_MODE', AuthTokenMode.OPAQUE.value))
 
 
 def register_new_user(username, email, password, is_activation_required=True):
@@ -60,14 +110,13 @@ def register_new_user(username, email, password, is_activation_required=True):
                 'password_hash': password_hash,
                 'is_active': not is_activation_required
             })
-            db.commit()
-
             new_user = cursor.fetchone()
 
             if is_activation_required:
                 token = create_activation_token(new_user.user_id).decode('utf-8')
                 send_activation_link(new_user.email, token)
 
+            db.commit()
             return new_user
 
         except psycopg2.errors.UniqueViolation as error:
@@ -82,11 +131,103 @@ def register_new_user(username, email, password, is_activation_required=True):
             raise error
 
 
+def register_users(users: list, team_id=None, is_activation_required=True):
+    """Register many users with a single INSERT (passwords are hashed in parallel, see hash_passwords).
+    users - dicts with username, email, password and optionally first_name and last_name
+
+    A user whose username or email already exists (or repeats an earlier user of the batch) is skipped,
+    the others are registered anyway. New users are added to the team as members when team_id is given.
+    Returns (new users in the order of users, {index in users: {field: [error]}})
+    """
+    conflicts = {}
+    usernames = set()
+    emails = set()
+    candidates = []
+    for index, user in enumerate(users):
+        errors = {}
+        if user['username'] in usernames:
+            errors['username'] = ['Duplicate']
+        if user['email'] in emails:
+            errors['email'] = ['Duplicate']
+        usernames.add(user['username'])
+        emails.add(user['email'])
+
+        if errors:
+            conflicts[index] = errors
+        else:
+            candidates.append(index)
+
+    if not candidates:
+        return [], conflicts
+
+    password_hashes = hash_passwords([users[index]['password'] for index in candidates])
+
+    db = get_db()
+    with db.cursor() as cursor:
+        # ON CONFLICT DO NOTHING skips duplicates of both unique constraints without aborting the statement
+        new_users = execute_values(cursor, '''
+        INSERT INTO app_user (username, email, password_hash, first_name, last_name, is_active)
+        VALUES %s
+        ON CONFLICT DO NOTHING
+        RETURNING *
+        ;
+        ''', [
+            (
+                users[index]['username'],
+                users[index]['email'],
+                password_hash,
+                users[index].get('first_name'),
+                users[index].get('last_name'),
+                not is_activation_required
+            )
+            for index, password_hash in zip(candidates, password_hashes)
+        ], page_size=len(candidates), fetch=True)
+
+        new_usernames = {user.username for user in new_users}
+        skipped = [index for index in candidates if users[index]['username'] not in new_usernames]
+        if skipped:
+            cursor.execute('''
+            SELECT username, email
+            FROM app_user
+            WHERE username = ANY(%(usernames)s) OR email = ANY(%(emails)s)
+            ;
+            ''', {
+                'usernames': [users[index]['username'] for index in skipped],
+                'emails': [users[index]['email'] for index in skipped]
+            })
+            existing = cursor.fetchall()
+            existing_usernames = {user.username for user in existing}
+            existing_emails = {user.email for user in existing}
+
+            for index in skipped:
+                errors = {}
+                if users[index]['username'] in existing_usernames:
+                    errors['username'] = ['Already exists']
+                if users[index]['email'] in existing_emails:
+                    errors['email'] = ['Already exists']
+                conflicts[index] = errors
+
+    order = {users[index]['username']: position for position, index in enumerate(candidates)}
+    new_users.sort(key=lambda user: order[user.username])
+
+    if team_id is not None:
+        add_team_members(team_id, [user.user_id for user in new_users], 'member')
+
+    if is_activation_required:
+        enqueue_emails('user_activation', [
+            (user.email, {'token': create_activation_token(user.user_id).decode('utf-8')})
+            for user in new_users
+        ])
+
+    db.commit()
+    return new_users, conflicts
+
+
 def log_in(username, password):
     db = get_db()
     with db.cursor() as cursor:
         query = '''
-            SELECT user_id, is_active, password_hash
+            SELECT user_id, username, email, first_name, last_name, created_at, updated_at, is_active, password_hash
             FROM app_user
             WHERE username = %(username)s
             ;
@@ -98,8 +239,29 @@ def log_in(username, password):
             db.commit()
             raise UserIsNotActive()
         elif user and check_password(password, user.password_hash):
-            token, expires_at = generate_auth_token_with_expiry_date()
+            if needs_rehash(user.password_hash):
+                # the cost (TASKAFARIAN_PASSWORD_ROUNDS) has changed since the password was hashed
+                cursor.execute('''
+                UPDATE app_user
+                SET password_hash = %(password_hash)s
+                WHERE user_id = %(user_id)s
+                ;
+                ''', {'password_hash': hash_password(password), 'user_id': user.user_id})
 
+            return issue_tokens(db, user)
+
+        raise BadCredentials()
+
+
+def issue_tokens(db, user, family_id=None) -> dict:
+    """Access token (opaque or signed, see get_auth_token_mode) and a refresh token for the user.
+    family_id - family of the rotated refresh token, a new family is started on log-in
+    """
+    with db.cursor() as cursor:
+        if get_auth_token_mode() == AuthTokenMode.JWT:
+            token, expires_at = create_access_token(user)
+        else:
+            token, expires_at = generate_auth_token_with_expiry_date()
             cursor.execute('''
             INSERT INTO token (user_id, token, expires_at)
             VALUES (%(user_id)s, %(token)s, %(expires_at)s);
@@ -108,11 +270,115 @@ def log_in(username, password):
                 'token': token,
                 'expires_at': expires_at
             })
-            db.commit()
 
-            return token, expires_at
+        refresh_token = secrets.token_urlsafe(32)
+        refresh_token_expires_at = datetime.now(timezone.utc) + timedelta(
+            seconds=int(os.getenv('TASKAFARIAN_AUTH_REFRESH_TOKEN_TTL', 30 * 24 * 60 * 60)))
+        cursor.execute('''
+        INSERT INTO refresh_token (user_id, token_hash, family_id, expires_at)
+        VALUES (%(user_id)s, %(token_hash)s, %(family_id)s, %(expires_at)s);
+        ''', {
+            'user_id': user.user_id,
+            'token_hash': hash_refresh_token(refresh_token),
+            'family_id': family_id or secrets.token_hex(16),
+            'expires_at': refresh_token_expires_at
+        })
+        db.commit()
 
-        raise BadCredentials()
+    return {
+        'token': token,
+        'expires_at': expires_at,
+        'refresh_token': refresh_token,
+        'refresh_token_expires_at': refresh_token_expires_at,
+    }
+
+
+def hash_refresh_token(refresh_token: str) -> str:
+    # refresh tokens are random, a fast hash is as good as bcrypt here
+    return hashlib.sha256(refresh_token.encode('utf-8')).hexdigest()
+
+
+rotate_refresh_token_statement = prepared_statement('rotate_refresh_token', '''
+UPDATE refresh_token
+SET used_at = now()
+FROM app_user
+WHERE refresh_token.token_hash = %(token_hash)s
+    AND refresh_token.used_at IS NULL
+    AND refresh_token.revoked_at IS NULL
+    AND refresh_token.expires_at > now()
+    AND app_user.user_id = refresh_token.user_id
+    AND app_user.is_active
+RETURNING
+    app_user.user_id,
+    app_user.username,
+    app_user.email,
+    app_user.first_name,
+    app_user.last_name,
+    app_user.created_at,
+    app_user.updated_at,
+    refresh_token.family_id
+;
+''')
+
+
+def refresh(refresh_token: str) -> dict:
+    """Exchange the refresh token for new tokens without checking the password.
+
+    The refresh token can be used once, the new refresh token expires TASKAFARIAN_AUTH_REFRESH_TOKEN_TTL
+    seconds (default 30 days) from now. A token that has already been used means that somebody else holds a copy:
+    the whole family (every token rotated from the same log-in) is revoked and RefreshTokenReused is raised.
+    """
+    params = {'token_hash': hash_refresh_token(refresh_token)}
+
+    db = get_db()
+    with db.cursor() as cursor:
+        cursor.execute(rotate_refresh_token_statement, params)
+        user = cursor.fetchone()
+
+        if user is None:
+            cursor.execute('''
+            UPDATE refresh_token
+            SET revoked_at = now()
+            WHERE family_id = (
+                SELECT family_id
+                FROM refresh_token
+                WHERE token_hash = %(token_hash)s
+                    AND used_at IS NOT NULL
+            )
+                AND revoked_at IS NULL
+            RETURNING user_id
+            ;
+            ''', params)
+            revoked = cursor.fetchall()
+            # the revocation is kept even though the request fails
+            db.commit(force=True)
+
+            if revoked:
+                logger.warning('refresh token reused, revoked the token family of user {user_id}'.format(
+                    user_id=revoked[0].user_id))
+                raise RefreshTokenReused()
+            raise BadCredentials()
+
+    return issue_tokens(db, user, family_id=user.family_id)
+
+
+def revoke_refresh_token(refresh_token: str):
+    """Revoke the refresh token and every token of its family
+    """
+    db = get_db()
+    with db.cursor() as cursor:
+        cursor.execute('''
+        UPDATE refresh_token
+        SET revoked_at = now()
+        WHERE family_id = (
+            SELECT family_id
+            FROM refresh_token
+            WHERE token_hash = %(token_hash)s
+        )
+            AND revoked_at IS NULL
+        ;
+        ''', {'token_hash': hash_refresh_token(refresh_token)})
+        db.commit()
 
 
 def generate_auth_token_with_expiry_date():
@@ -122,6 +388,144 @@ def generate_auth_token_with_expiry_date():
     return secrets.token_hex(32), datetime.now(timezone.utc) + timedelta(hours=1)
 
 
+def is_access_token(token: str) -> bool:
+    """Signed access token (header.payload.signature) as opposed to an opaque token
+    """
+    return token.count('.') == 2
+
+
+def create_access_token(user) -> tuple:
+    """Signed access token carrying the user claims.
+    Lives for TASKAFARIAN_AUTH_ACCESS_TOKEN_TTL seconds (default 900), returns the token and the expiry date.
+    """
+    ttl = int(os.getenv('TASKAFARIAN_AUTH_ACCESS_TOKEN_TTL', 900))
+    expires_at = datetime.now(timezone.utc) + timedelta(seconds=ttl)
+    token = jwt.encode({
+        'iss': os.getenv('TASKAFARIAN_ENV'),
+        'sub': user.user_id,
+        'jti': secrets.token_hex(16),
+        'exp': expires_at,
+        'action': ActionType.ACCESS.value,
+        'user': {
+            'username': user.username,
+            'email': user.email,
+            'first_name': user.first_name,
+            'last_name': user.last_name,
+            'created_at': user.created_at.isoformat() if user.created_at else None,
+            'updated_at': user.updated_at.isoformat() if user.updated_at else None,
+        }
+    }, os.getenv('TASKAFARIAN_SECRET_KEY'), algorithm='HS256').decode('utf-8')
+    # exp is stored in whole seconds
+    return token, expires_at.replace(microsecond=0)
+
+
+def decode_access_token(token: str) -> dict:
+    """Claims of a valid access token, None if the token is invalid, expired or revoked.
+    """
+    try:
+        claims = jwt.decode(
+            token,
+            os.getenv('TASKAFARIAN_SECRET_KEY'),
+            algorithms=['HS256'],
+            issuer=os.getenv('TASKAFARIAN_ENV')
+        )
+    except jwt.exceptions.PyJWTError:
+        return None
+
+    if claims.get('action') != ActionType.ACCESS.value or 'jti' not in claims or is_revoked(claims['jti']):
+        return None
+    return claims
+
+
+def get_user_by_access_token(token: str) -> AccessTokenUser:
+    claims = decode_access_token(token)
+    if claims is None:
+        return None
+
+    user = claims['user']
+    return AccessTokenUser(
+        claims['sub'],
+        user['username'],
+        user['email'],
+        user['first_name'],
+        user['last_name'],
+        datetime.fromisoformat(user['created_at']) if user['created_at'] else None,
+        datetime.fromisoformat(user['updated_at']) if user['updated_at'] else None,
+        True,
+        token,
+        datetime.fromtimestamp(claims['exp'], timezone.utc)
+    )
+
+
+def authenticate(token: str) -> Row:
+    """User of an access token or of an opaque token, None if the token is not valid
+    """
+    if is_access_token(token):
+        return get_user_by_access_token(token)
+    return get_user_by_token(token)
+
+
+def is_revoked(jti: str) -> bool:
+    """Check the in-process copy of the revocation list.
+    The copy is reloaded every TASKAFARIAN_AUTH_REVOCATION_REFRESH seconds (default 10), so a token revoked
+    by another process is rejected within that time. Tokens revoked by this process are rejected right away.
+    """
+    global _revoked_tokens, _revoked_tokens_loaded_at
+    refresh = float(os.getenv('TASKAFARIAN_AUTH_REVOCATION_REFRESH', 10))
+
+    with _revoked_tokens_lock:
+        is_stale = _revoked_tokens_loaded_at is None or time.monotonic() - _revoked_tokens_loaded_at >= refresh
+    if is_stale:
+        db = get_db(READ)
+        with db.cursor() as cursor:
+            cursor.execute('''
+            SELECT jti, expires_at
+            FROM revoked_token
+            WHERE expires_at > now()
+            ;
+            ''')
+            db.commit()
+            revoked_tokens = {row.jti: row.expires_at for row in cursor.fetchall()}
+
+        with _revoked_tokens_lock:
+            # keep local revocations that may not be committed / replicated yet
+            revoked_tokens.update(_revoked_tokens)
+            now = datetime.now(timezone.utc)
+            _revoked_tokens = {key: expires_at for key, expires_at in revoked_tokens.items() if expires_at > now}
+            _revoked_tokens_loaded_at = time.monotonic()
+
+    return jti in _revoked_tokens
+
+
+def revoke_access_token(token: str):
+    claims = decode_access_token(token)
+    if claims is None:
+        return
+
+    expires_at = datetime.fromtimestamp(claims['exp'], timezone.utc)
+    with _revoked_tokens_lock:
+        _revoked_tokens[claims['jti']] = expires_at
+
+    db = get_db()
+    with db.cursor() as cursor:
+        cursor.execute('''
+        INSERT INTO revoked_token (jti, user_id, expires_at)
+        VALUES (%(jti)s, %(user_id)s, %(expires_at)s)
+        ON CONFLICT DO NOTHING
+        ;
+        ''', {'jti': claims['jti'], 'user_id': claims['sub'], 'expires_at': expires_at})
+        db.commit()
+
+
+def reset_revoked_tokens():
+    """Forget the in-process copy of the revocation list
+    """
+    global _revoked_tokens, _revoked_tokens_loaded_at
+    with _revoked_tokens_lock:
+        _revoked_tokens = {}
+        _revoked_tokens_loaded_at = None
+
+
 def is_valid_token(token):
     db = get_db()
     with db.cursor() as cursor:
@@ -139,6 +543,7 @@ def is_valid_token(token):
             return False
 
 
+@replica_safe
 def get_user_by_id(user_id):
     db = get_db()
     with db.cursor() as cursor:
@@ -160,39 +565,80 @@ def get_user_by_id(user_id):
         return cursor.fetchone()
 
 
-def get_user_by_token(token: str) -> namedtuple:
-    db = get_db()
-    with db.cursor() as cursor:
-        cursor.execute('''
-        SELECT 
-            app_user.user_id, 
-            username, 
-            email, 
-            first_name, 
-            last_name, 
-            created_at, 
-            updated_at, 
-            is_active,
-            token
-        FROM app_user
-        JOIN token ON token.user_id = app_user.user_id 
-            AND token.token = %(token)s
-            AND token.expires_at > %(expires_at)s
-        ;
-        ''', {
-            'token': token,
-            'expires_at': datetime.now(timezone.utc) + timedelta(minutes=1)
-        })
-        db.commit()
-        user = cursor.fetchone()
+get_user_by_token_statement = prepared_statement('get_user_by_token', '''
+SELECT 
+    app_user.user_id, 
+    username, 
+    email, 
+    first_name, 
+    last_name, 
+    created_at, 
+    updated_at, 
+    is_active,
+    token,
+    token.expires_at
+FROM app_user
+JOIN token ON token.user_id = app_user.user_id 
+    AND token.token = %(token)s
+    AND token.expires_at > %(expires_at)s
+;
+''')
+
+
+def get_token_cache() -> TTLCache:
+    """Cache of token -> user used by get_user_by_token.
+
+    Tunable with environment variables:
+        TASKAFARIAN_AUTH_CACHE_SIZE - number of cached tokens (default 1024)
+        TASKAFARIAN_AUTH_CACHE_TTL - seconds a token is trusted without asking the database (default 60, 0 disables).
+                                     log_out and deactivate_user invalidate the cache of the current process only,
+                                     other processes notice within the ttl.
+    """
+    global _token_cache
+    if _token_cache is None:
+        _token_cache = TTLCache(
+            max_size=int(os.getenv('TASKAFARIAN_AUTH_CACHE_SIZE', 1024)),
+            ttl=float(os.getenv('TASKAFARIAN_AUTH_CACHE_TTL', 60))
+        )
+    return _token_cache
+
+
+def get_user_by_token(token: str) -> Row:
+    cache = get_token_cache()
+    user = cache.get(token)
+    if user is not None:
         return user
 
+    db = get_db(READ)
+    while True:
+        with db.cursor() as cursor:
+            cursor.execute(get_user_by_token_statement, {
+                'token': token,
+                'expires_at': datetime.now(timezone.utc) + timedelta(minutes=1)
+            })
+            db.commit()
+            user = cursor.fetchone()
+
+        if user is None and db.is_replica:
+            # the token might have been issued moments ago and not replicated yet
+            db = get_db(WRITE)
+            continue
+        break
+
+    if user is not None:
+        # never trust the token longer than the database would
+        time_to_live = user.expires_at - timedelta(minutes=1) - datetime.now(timezone.utc)
+        cache.set(token, user, ttl=time_to_live.total_seconds())
+    return user
+
 
 def send_activation_link(email, token):
     """
     Send user an activation link containing a token.
+    The email is added to the outbox in the current transaction and sent by services.mail.deliver_emails.
     """
-    logger.info('sending an activation link to {email}, {token}'.format(email=email, token=token))
+    logger.info('sending an activation link to {email}'.format(email=email))
+    enqueue_email('user_activation', email, {'token': token})
 
 
 def activate_user(user_id):
@@ -240,9 +686,10 @@ def create_activation_token(user_id, token_life=timedelta(minutes=15)):
 
 
 def send_password_reset_by_email(email: str, token: str):
-    """TODO
+    """The email is added to the outbox in the current transaction and sent by services.mail.deliver_emails.
     """
-    logger.info(f'Sending password reset email:\n\temail: {email}\n\ttoken: {token}')
+    logger.info(f'Sending password reset email:\n\temail: {email}')
+    enqueue_email('password_reset', email, {'token': token})
 
 
 def request_password_reset(email: str):
@@ -254,15 +701,16 @@ def request_password_reset(email: str):
         WHERE email = %(email)s
         ;
         ''', {'email': email})
-        db.commit()
         user = cursor.fetchone()
 
         if not user:
             # no user with such email
+            db.commit()
             raise UserNotFound()
 
     token = create_token_for_password_reset(email).decode('utf-8')
     send_password_reset_by_email(email, token)
+    db.commit()
 
 
 def create_token_for_password_reset(email, token_life=timedelta(minutes=10)):
@@ -303,6 +751,11 @@ def reset_password(token, new_password):
 
 
 def log_out(token):
+    if is_access_token(token):
+        revoke_access_token(token)
+        return
+
+    get_token_cache().invalidate(token)
     db = get_db()
     with db.cursor() as cursor:
         cursor.execute('''
@@ -311,10 +764,13 @@ def log_out(token):
         WHERE token = %(token)s
         ''', {'token': token})
         db.commit()
+    # a concurrent request may have cached the token again before the deletion was committed
+    on_commit(lambda: get_token_cache().invalidate(token))
 
 
 def deactivate_user(user_id):
     """Deactivates user by setting the is_active flag to false and removing all tokens."""
+    get_token_cache().invalidate_where(lambda user: user.user_id == user_id)
     db = get_db()
 
     with db.cursor() as cursor:
@@ -328,7 +784,78 @@ def deactivate_user(user_id):
         FROM token
         WHERE user_id = %(user_id)s
         ; 
+
+        UPDATE refresh_token
+        SET revoked_at = now()
+        WHERE user_id = %(user_id)s
+            AND revoked_at IS NULL
+        ;
         '''
         params = {'user_id': user_id}
         cursor.execute(query, params)
         db.commit()
+    on_commit(lambda: get_token_cache().invalidate_where(lambda user: user.user_id == user_id))
+
+
+def purge_expired_tokens(batch_size=1000, time_budget=60.0, lock_timeout='1s') -> dict:
+    """Delete expired rows of token, revoked_token and refresh_token.
+
+    Every batch of at most batch_size rows is deleted and committed in its own short transaction,
+    rows locked by other transactions (e.g log_out) are skipped, and lock_timeout bounds the wait for
+    the table lock (e.g behind a migration). Stops once time_budget seconds are spent,
+    the next run continues where this one stopped.
+    """
+    start_timestamp = time.perf_counter()
+    deadline = time.monotonic() + time_budget
+    deleted = {table: 0 for table, _ in EXPIRING_TABLES}
+    batches = 0
+    completed = True
+
+    db = get_db()
+    with db.cursor() as cursor:
+        for table, key in EXPIRING_TABLES:
+            query = SQL('''
+            DELETE
+            FROM {table}
+            WHERE ({key}) IN (
+                SELECT {key}
+                FROM {table}
+                WHERE expires_at < now()
+                LIMIT %(batch_size)s
+                FOR UPDATE SKIP LOCKED
+            )
+            ;
+            ''').format(table=Identifier(table), key=SQL(', ').join(map(Identifier, key)))
+
+            while True:
+                if time.monotonic() >= deadline:
+                    completed = False
+                    break
+
+                try:
+                    cursor.execute('SET LOCAL lock_timeout = %(lock_timeout)s;', {'lock_timeout': lock_timeout})
+                    cursor.execute(query, {'batch_size': batch_size})
+                    db.commit()
+                except psycopg2.errors.LockNotAvailable:
+                    db.rollback()
+                    logger.warning('purge of {table} gave up waiting for a lock'.format(table=table))
+                    completed = False
+                    break
+
+                batches += 1
+                deleted[table] += cursor.rowcount
+                if cursor.rowcount < batch_size:
+                    break
+
+    execution_time = (time.perf_counter() - start_timestamp) * 1000
+    logger.info('purged expired tokens: {deleted} in {batches} batches, {execution_time:.3f}ms'.format(
+        deleted=deleted,
+        batches=batches,
+        execution_time=execution_time
+    ))
+    return {
+        'deleted': deleted,
+        'batches': batches,
+        'completed': completed,
+        'execution_time_ms': execution_time,
+    }
@@ -0,0 +1,252 @@
+import os
+import smtplib
+import time
+from email.message import EmailMessage
+
+from psycopg2.extras import Json, execute_values
+
+from chalicelib.core.database import get_db
+from chalicelib.core.logger import logger
+
+# template -> (subject, body), formatted with the context of the email
+TEMPLATES = {
+    'user_activation': (
+        'Activate your taskafarian account',
+        'Welcome to taskafarian!\n\nActivate your account with the following token:\n\n{token}\n'
+    ),
+    'password_reset': (
+        'Reset your taskafarian password',
+        'Somebody asked to reset the password of your account.\n\n'
+        'Reset it with the following token, or ignore this email if it wasn\'t you:\n\n{token}\n'
+    ),
+}
+
+# upper bound of the delay between attempts
+MAX_RETRY_BACKOFF = 3600
+
+
+class UnknownTemplate(Exception):
+    pass
+
+
+class SMTPMailer:
+    """Sends emails over a single SMTP connection, opened by the with statement.
+    """
+    def __init__(self, host='localhost', port=1025, sender='noreply@taskafarian.local',
+                 user=None, password=None, starttls=False, timeout=10.0):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.user = user
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+        self._smtp = None
+
+    def __enter__(self):
+        self._smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.starttls:
+            self._smtp.starttls()
+        if self.user:
+            self._smtp.login(self.user, self.password)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        smtp, self._smtp = self._smtp, None
+        try:
+            smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            smtp.close()
+
+    def send(self, recipient: str, subject: str, body: str):
+        message = EmailMessage()
+        message['From'] = self.sender
+        message['To'] = recipient
+        message['Subject'] = subject
+        message.set_content(body)
+        self._smtp.send_message(message)
+
+
+def get_mailer() -> SMTPMailer:
+    """Mailer configured with environment variables:
+        TASKAFARIAN_SMTP_HOST (default localhost), TASKAFARIAN_SMTP_PORT (default 1025)
+        TASKAFARIAN_SMTP_USER, TASKAFARIAN_SMTP_PASSWORD - log in when the user is set
+        TASKAFARIAN_SMTP_STARTTLS - True to upgrade the connection with STARTTLS (default False)
+        TASKAFARIAN_EMAIL_SENDER - From address (default noreply@taskafarian.local)
+    """
+    return SMTPMailer(
+        host=os.getenv('TASKAFARIAN_SMTP_HOST', 'localhost'),
+        port=int(os.getenv('TASKAFARIAN_SMTP_PORT', 1025)),
+        sender=os.getenv('TASKAFARIAN_EMAIL_SENDER', 'noreply@taskafarian.local'),
+        user=os.getenv('TASKAFARIAN_SMTP_USER'),
+        password=os.getenv('TASKAFARIAN_SMTP_PASSWORD'),
+        starttls=os.getenv('TASKAFARIAN_SMTP_STARTTLS', 'False') == 'True'
+    )
+
+
+def render_email(template: str, context: dict):
+    """(subject, body) of the email
+    """
+    try:
+        subject, body = TEMPLATES[template]
+    except KeyError:
+        raise UnknownTemplate(template)
+    return subject.format(**context), body.format(**context)
+
+
+def enqueue_email(template: str, recipient: str, context: dict):
+    """Add the email to the outbox in the current transaction, it is sent by deliver_emails once committed
+    (and never if the transaction is rolled back).
+    """
+    if template not in TEMPLATES:
+        raise UnknownTemplate(template)
+
+    db = get_db()
+    with db.cursor() as cursor:
+        cursor.execute('''
+        INSERT INTO email_outbox (template, recipient, context)
+        VALUES (%(template)s, %(recipient)s, %(context)s)
+        ;
+        ''', {'template': template, 'recipient': recipient, 'context': Json(context)})
+
+
+def enqueue_emails(template: str, emails: list):
+    """enqueue_email for many (recipient, context) pairs with a single statement
+    """
+    if template not in TEMPLATES:
+        raise UnknownTemplate(template)
+    if not emails:
+        return
+
+    db = get_db()
+    with db.cursor() as cursor:
+        execute_values(cursor, '''
+        INSERT INTO email_outbox (template, recipient, context)
+        VALUES %s
+        ;
+        ''', [(template, recipient, Json(context)) for recipient, context in emails], page_size=len(emails))
+
+
+def get_retry_backoff(attempts: int, retry_backoff: float) -> float:
+    """Seconds before the next attempt, doubled after every failed attempt
+    """
+    return min(retry_backoff * 2 ** (attempts - 1), MAX_RETRY_BACKOFF)
+
+
+def deliver_emails(batch_size=50, time_budget=60.0, max_attempts=5, retry_backoff=30.0, lease=300.0,
+                   mailer=None) -> dict:
+    """Send due emails of the outbox.
+
+    Every batch is claimed in a short transaction (FOR UPDATE SKIP LOCKED, so concurrent workers get
+    different emails) that pushes next_attempt_at lease seconds ahead, the emails are sent outside of
+    the transaction and marked as sent afterwards. An email claimed by a worker that died is picked up
+    again once the lease runs out, so delivery is at least once.
+    A failed email is retried after retry_backoff seconds, doubled after every attempt,
+    and marked as failed after max_attempts attempts.
+    Stops once time_budget seconds are spent, the next run continues where this one stopped.
+    """
+    start_timestamp = time.perf_counter()
+    deadline = time.monotonic() + time_budget
+    mailer = mailer or get_mailer()
+    sent = 0
+    retried = 0
+    failed = 0
+    batches = 0
+    completed = True
+
+    db = get_db()
+    with db.cursor() as cursor:
+        while True:
+            if time.monotonic() >= deadline:
+                completed = False
+                break
+
+            cursor.execute('''
+            UPDATE email_outbox
+            SET attempts = attempts + 1,
+                next_attempt_at = now() + %(lease)s * interval '1 second'
+            WHERE email_id IN (
+                SELECT email_id
+                FROM email_outbox
+                WHERE status = 'pending' AND next_attempt_at <= now()
+                ORDER BY next_attempt_at
+                LIMIT %(batch_size)s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING email_id, template, recipient, context, attempts
+            ;
+            ''', {'batch_size': batch_size, 'lease': lease})
+            emails = cursor.fetchall()
+            db.commit()
+
+            if not emails:
+                break
+            batches += 1
+
+            sent_ids = []
+            errors = {}
+            try:
+                with mailer:
+                    for email in emails:
+                        try:
+                            subject, body = render_email(email.template, email.context)
+                            mailer.send(email.recipient, subject, body)
+                            sent_ids.append(email.email_id)
+                        except (smtplib.SMTPException, UnknownTemplate, KeyError) as error:
+                            errors[email.email_id] = repr(error)
+            except (smtplib.SMTPException, OSError) as error:
+                # could not connect, or the connection broke: whatever wasn't sent is retried
+                logger.warning('email delivery failed: {error!r}'.format(error=error))
+                for email in emails:
+                    if email.email_id not in sent_ids:
+                        errors.setdefault(email.email_id, repr(error))
+
+            if sent_ids:
+                cursor.execute('''
+                UPDATE email_outbox
+                SET status = 'sent', sent_at = now(), last_error = NULL
+                WHERE email_id = ANY(%(email_ids)s)
+                ;
+                ''', {'email_ids': sent_ids})
+                sent += len(sent_ids)
+
+            for email in emails:
+                if email.email_id not in errors:
+                    continue
+
+                gives_up = email.attempts >= max_attempts
+                cursor.execute('''
+                UPDATE email_outbox
+                SET status = %(status)s,
+                    next_attempt_at = now() + %(backoff)s * interval '1 second',
+                    last_error = %(error)s
+                WHERE email_id = %(email_id)s
+                ;
+                ''', {
+                    'status': 'failed' if gives_up else 'pending',
+                    'backoff': get_retry_backoff(email.attempts, retry_backoff),
+                    'error': errors[email.email_id],
+                    'email_id': email.email_id
+                })
+                if gives_up:
+                    failed += 1
+                else:
+                    retried += 1
+            db.commit()
+
+            if len(emails) < batch_size:
+                break
+
+    execution_time = (time.perf_counter() - start_timestamp) * 1000
+    message = ('delivered emails: {sent} sent, {retried} retried, {failed} failed in {batches} batches, '
+               '{execution_time:.3f}ms')
+    logger.info(message.format(sent=sent, retried=retried, failed=failed, batches=batches,
+                               execution_time=execution_time))
+    return {
+        'sent': sent,
+        'retried': retried,
+        'failed': failed,
+        'batches': batches,
+        'completed': completed,
+        'execution_time_ms': execution_time,
+    }
@@ -1,11 +1,22 @@
+import hashlib
+import html
+import os
+import threading
+import time
 from collections import namedtuple
 from enum import Enum
 from typing import List, Tuple
 
 from psycopg2.sql import SQL, Identifier, Placeholder
 
-from chalicelib.core.database import get_db
+from chalicelib.core.database import get_db, replica_safe
 from chalicelib.core.exceptions import DeletionError, EntityNotFound
+from chalicelib.core.pagination import (decode_cursor, encode_cursor, nullable,
+                                        to_datetime)
+from chalicelib.core.prepared import PreparedStatement, prepared_statement
+from chalicelib.core.rows import row_class
+from chalicelib.services import time_entry
+from chalicelib.services.user import get_team_ids
 
 
 class StatusEnum(Enum):
@@ -24,301 +35,538 @@ class InvalidEndTimestamp(Exception):
     pass
 
 
-def fetch(user: namedtuple, task_id: int):
+# fields of a task (task.schema.Task) that come from the query: field -> expression over the task row {task},
+# the columns of the task are always selected, the fields of TASK_JOINS only when requested
+TASK_COLUMNS = {
+    'task_id': SQL('{task}.task_id'),
+    'project_id': SQL('{task}.project_id'),
+    'team_id': SQL('{task}.team_id'),
+    'name': SQL('{task}.name'),
+    'description': SQL('{task}.description'),
+    'estimation': SQL('{task}.estimation'),
+    'status': SQL('{task}.status'),
+    'created_at': SQL('{task}.created_at'),
+    'due_date': SQL('{task}.due_date'),
+    'created_by': SQL('{task}.created_by'),
+    'assignee_id': SQL('{task}.assignee_id'),
+    'creator': SQL('''jsonb_build_object(
+           'username', creator.username,
+           'user_id', creator.user_id,
+           'first_name', creator.first_name,
+           'last_name', creator.last_name
+       ) AS creator'''),
+    'assignee': SQL('''jsonb_build_object(
+           'username', assignee.username,
+           'user_id', assignee.user_id,
+           'first_name', assignee.first_name,
+           'last_name', assignee.last_name
+       ) AS assignee'''),
+}
+
+# joins that only the fields of the same name need, the only part of the query the requested fields change
+# (a statement per combination of joins, not per subset of fields a client can ask for)
+TASK_JOINS = {
+    'creator': SQL('''LEFT JOIN app_user AS creator
+    ON creator.user_id = {task}.created_by'''),
+    'assignee': SQL('''LEFT JOIN app_user AS assignee
+    ON assignee.user_id = {task}.assignee_id'''),
+}
+
+# fields loaded after the query, for all the tasks at once (see time_entry.fetch_of_tasks)
+TASK_TIME_ENTRY_FIELDS = ('time_entries', 'time_entry_count')
+
+# fields of a task when none are requested
+DEFAULT_TASK_FIELDS = ('task_id', 'project_id', 'team_id', 'name', 'description', 'estimation', 'status',
+                       'created_at', 'due_date', 'creator', 'assignee')
+DEFAULT_TASK_LIST_FIELDS = DEFAULT_TASK_FIELDS + TASK_TIME_ENTRY_FIELDS
+
+_task_statements = {}
+_task_statements_lock = threading.Lock()
+
+_trigram_support = None
+_trigram_support_checked_at = None
+
+
+def _task_joins(fields) -> tuple:
+    """Names of TASK_JOINS the fields need, in a stable order
+    """
+    return tuple(field for field in TASK_JOINS if field in fields)
+
+
+def _task_projection(joins: tuple, task: str) -> Tuple[SQL, SQL]:
+    """Select list and joins over the task row alias: the columns of the task and the fields of the joins
+    (names of TASK_JOINS)
+    """
+    columns = [expression.format(task=SQL(task)) for field, expression in TASK_COLUMNS.items()
+               if field not in TASK_JOINS or field in joins]
+    joins = [TASK_JOINS[field].format(task=SQL(task)) for field in joins]
+    return SQL(',\n       ').join(columns), SQL('\n').join(joins)
+
+
+def _get_task_statement(shape: tuple, default_name: str, build_query) -> PreparedStatement:
+    """Prepared statement of a query shape (e.g the filters in use, not their values) composed once per shape.
+    default_name - name of the statement, None to derive it from the shape
+    """
+    statement = _task_statements.get(shape)
+    if statement is None:
+        with _task_statements_lock:
+            if shape not in _task_statements:
+                name = default_name or '{}_{}'.format(shape[0], hashlib.sha1(repr(shape).encode()).hexdigest()[:12])
+                _task_statements[shape] = prepared_statement(name, build_query())
+            statement = _task_statements[shape]
+    return statement
+
+
+def _with_time_entries(tasks: list, fields, limit: int) -> list:
+    """Tasks with time_entries and time_entry_count when one of them is requested, loaded in one query
+    """
+    if not tasks or not set(fields) & set(TASK_TIME_ENTRY_FIELDS):
+        return tasks
+
+    time_entries = time_entry.fetch_of_tasks([task.task_id for task in tasks],
+                                             limit=limit if 'time_entries' in fields else 0)
+    Task = row_class(tasks[0]._fields + TASK_TIME_ENTRY_FIELDS)
+    return [Task(*task, *time_entries[task.task_id]) for task in tasks]
+
+
+def _fetch_query(joins: tuple = tuple(TASK_JOINS)) -> str:
+    """A task the user created or can see through the teams.
+    joins - names of TASK_JOINS, the other joins are left out
+    """
+    columns, join_clauses = _task_projection(joins, 'task')
+    query = SQL('''
+SELECT {columns}
+FROM task
+{joins}
+WHERE task.task_id = %(task_id)s
+    AND (task.created_by = %(user_id)s OR task.team_id = ANY(%(team_ids)s))
+;
+''').format(columns=columns, joins=join_clauses)
+    return query.as_string(None)
+
+
+def get_fetch_statement(fields: tuple = DEFAULT_TASK_FIELDS) -> PreparedStatement:
+    joins = _task_joins(fields)
+    default_name = 'fetch_task' if joins == _task_joins(DEFAULT_TASK_FIELDS) else None
+    return _get_task_statement(('fetch_task', joins), default_name, lambda: _fetch_query(joins))
+
+
+fetch_statement = get_fetch_statement()
+
+
+@replica_safe
+def fetch(user: namedtuple, task_id: int, fields: tuple = None, time_entries_limit: int = 10):
+    """Task of the given id if the user created it or can see it through the teams.
+    fields - names of task.schema.Task fields to load (DEFAULT_TASK_FIELDS if None),
+    the task may have a few more (the columns of the task are always loaded)
+    """
+    fields = DEFAULT_TASK_FIELDS if fields is None else fields
     db = get_db()
     with db.cursor() as cursor:
-        query = '''
-        SELECT
-            task.task_id,
-            task.project_id,
-            task.team_id,
-            task.name,
-            task.description,
-            task.estimation,
-            task.status,
-            task.created_at,
-            task.due_date,
-            jsonb_build_object(
-                'username', creator.username,
-                'user_id', creator.user_id,
-                'first_name', creator.first_name,
-                'last_name', creator.last_name
-            ) as creator,
-            jsonb_build_object(
-                'username', assignee.username,
-                'user_id', assignee.user_id,
-                'first_name', assignee.first_name,
-                'last_name', assignee.last_name
-            ) as assignee
-        FROM task
-        LEFT JOIN user_to_team
-            ON user_to_team.team_id = task.team_id AND user_to_team.user_id = %(user_id)s
-        LEFT JOIN app_user AS creator
-            ON creator.user_id = task.created_by
-        LEFT JOIN app_user AS assignee
-            ON assignee.user_id = task.assignee_id
-        WHERE task.task_id = %(task_id)s
-            AND (task.created_by = %(user_id)s OR user_to_team.user_role IS NOT NULL)
-        ;
-        '''
-
         params = {
             'task_id': task_id,
-            'user_id': user.user_id
+            'user_id': user.user_id,
+            'team_ids': get_team_ids(user.user_id)
         }
 
-        cursor.execute(query, params)
+        cursor.execute(get_fetch_statement(fields), params)
         db.commit()
 
-        return cursor.fetchone()
-
-
-# TODO: BIG TODO here
-# TODO: no offset
-# TODO: ordering
-# order_by=['-due_date', 'created_at']
-# -descending
-# def fetch_many(user,
-#                name: str = None,
-#                assignee_id: int = None,
-#                status: list = None,
-#                due_date: datetime = None,
-#                due_date_gt: datetime = None,
-#                due_date_lt: datetime = None,
-#                created_at: datetime = None,
-#                created_at_gt: datetime = None,
-#                created_at_lt: datetime = None,
-#                offset: int = 0,
-#                limit: int = 20):
-#
-#     params = {
-#         'user_id': user.user_id,
-#         'name': name,
-#         'assignee_id': assignee_id or user.user_id,
-#         'status': status,
-#         'due_date': due_date,
-#         'due_date_gt': due_date_gt,
-#         'due_date_lt': due_date_lt,
-#         'created_at': created_at,
-#         'created_at_gt': created_at_gt,
-#         'created_at_lt': created_at_lt,
-#         'offset': offset,
-#         'limit': limit
-#     }
-#
-#     db = get_db()
-#     with db.cursor() as cursor:
-#         query = SQL('''
-#         WITH extended_task AS (
-#             SELECT task.task_id,
-#                    task.project_id,
-#                    task.team_id,
-#                    task.name,
-#                    task.description,
-#                    task.estimation,
-#                    task.status,
-#                    task.created_at,
-#                    task.due_date,
-#                    task.created_by,
-#                    task.assignee_id,
-#                    coalesce(jsonb_agg(time_entries) filter ( where time_entries.task_id is not null ), '[]'::jsonb) as time_entries
-#             FROM task
-#             LEFT JOIN LATERAL (
-#                 SELECT task_time_entry.time_entry_id,
-#                        task_time_entry.task_id,
-#                        task_time_entry.assignee_id,
-#                        task_time_entry.start_datetime,
-#                        task_time_entry.end_datetime
-#                 FROM task_time_entry
-#                 WHERE task_time_entry.task_id = task.task_id
-#                 ORDER BY task_time_entry.start_datetime DESC
-#             ) AS time_entries ON true
-#             WHERE task.created_by = %(user_id)s
-#             --     AND {conditions}
-#             GROUP BY task.task_id
-#             OFFSET %(offset)s
-#             LIMIT %(limit)s
-#         ),
-#         tasks_with_user_and_time_info AS (
-#             SELECT extended_task.task_id,
-#                     extended_task.project_id,
-#                     extended_task.team_id,
-#                     extended_task.name,
-#                     extended_task.description,
-#                     extended_task.estimation,
-#                     extended_task.status,
-#                     extended_task.created_at,
-#                     extended_task.due_date,
-#                     extended_task.time_entries,
-#                 jsonb_build_object(
-#                    'username', creator.username,
-#                    'user_id', creator.user_id,
-#                    'first_name', creator.first_name,
-#                    'last_name', creator.last_name
-#                 ) as creator,
-#                 jsonb_build_object(
-#                    'username', assignee.username,
-#                    'user_id', assignee.user_id,
-#                    'first_name', assignee.first_name,
-#                    'last_name', assignee.last_name
-#                 ) as assignee
-#             FROM extended_task
-#             LEFT JOIN app_user AS creator
-#                 ON creator.user_id = extended_task.created_by
-#             LEFT JOIN app_user AS assignee
-#                 ON assignee.user_id = extended_task.assignee_id
-#         )
-#         SELECT *
-#         FROM tasks_with_user_and_time_info
-#         ORDER BY tasks_with_user_and_time_info.created_at DESC
-#         ;
-#         ''')
-#
-#         sql_conditions = [
-#             # ANY - https://www.psycopg.org/docs/usage.html#lists-adaptation
-#             SQL('task.status = ANY({})').format(Placeholder('status')) if params['status'] else None,
-#             SQL('task.assignee_id = {}').format(Placeholder('assignee_id')) if params['assignee_id'] else None,
-#             SQL('task.due_date > {}').format(Placeholder('due_date_gt')) if params['due_date_gt'] else None,
-#             SQL('task.due_date < {}').format(Placeholder('due_date_lt')) if params['due_date_lt'] else None,
-#             SQL('task.due_date = {}').format(Placeholder('due_date')) if params['due_date'] else None,
-#             SQL("task.name ILIKE '%%' || {} || '%%'").format(Placeholder('name')) if params['name'] else None,
-#             SQL('task.created_at > {}').format(Placeholder('created_at_gt')) if params['created_at_gt'] else None,
-#             SQL('task.created_at < {}').format(Placeholder('created_at_lt')) if params['created_at_lt'] else None,
-#             SQL('task.created_at = {}').format(Placeholder('created_at')) if params['created_at'] else None
-#         ]
-#
-#         conditions = SQL(' AND ').join([condition for condition in sql_conditions if condition])
-#
-#         # query_count_total = query_count_total.format(conditions=conditions)
-#         # cursor.execute(query_count_total, params)
-#         # count_total = cursor.fetchone()
-#
-#         query = query.format(conditions=conditions)
-#         cursor.execute(query, params)
-#         tasks = cursor.fetchall()
-#
-#         return {
-#             'entities': tasks,
-#             'meta': {
-#                 # 'total': count_total['count'],
-#                 'count': len(tasks),
-#                 'offset': offset,
-#                 'limit': limit
-#             }
-#         }
+        tasks = _with_time_entries(cursor.fetchall(), fields, time_entries_limit)
+        return tasks[0] if tasks else None
+
+
+# filters of the task list, the value of a filter is passed as the parameter of the same name
+TASK_FILTERS = {
+    # ANY - https://www.psycopg.org/docs/usage.html#lists-adaptation
+    'status': SQL('task.status = ANY({})').format(Placeholder('status')),
+    # a single status is compared with =, then the page is read in order from the status index
+    # (postgres can't keep the order of an index scan with = ANY on a leading column)
+    'single_status': SQL('task.status = {}').format(Placeholder('single_status')),
+    'assignee_id': SQL('task.assignee_id = {}').format(Placeholder('assignee_id')),
+    'due_date_gt': SQL('task.due_date > {}').format(Placeholder('due_date_gt')),
+    'due_date_lt': SQL('task.due_date < {}').format(Placeholder('due_date_lt')),
+    'created_at_gt': SQL('task.created_at > {}').format(Placeholder('created_at_gt')),
+    'created_at_lt': SQL('task.created_at < {}').format(Placeholder('created_at_lt')),
+}
+
+# sort keys of the task list: column -> expression the rows are ordered by (the task id breaks ties),
+# tasks without a due date come last in the ascending order
+TASK_ORDERINGS = {
+    'created_at': SQL('{}'),
+    'due_date': SQL("coalesce({}, 'infinity'::timestamptz)"),
+}
+DEFAULT_TASK_ORDERING = '-created_at'
+
+
+def _fetch_many_query(filters: tuple = (), order_by: str = DEFAULT_TASK_ORDERING, after: bool = False,
+                      joins: tuple = tuple(TASK_JOINS)) -> str:
+    """Page of the tasks a user created (keyset pagination on the sort key and task_id),
+    without the time entries (see fetch_many).
+    filters - names of TASK_FILTERS
+    order_by - column of TASK_ORDERINGS, prefixed with - for the descending order
+    after - continue after the cursor (%(sort_value)s, %(task_id)s)
+    joins - names of TASK_JOINS, the other joins are left out
+    """
+    descending = order_by.startswith('-')
+    sort_key = TASK_ORDERINGS[order_by.lstrip('-')]
+
+    conditions = [SQL('task.created_by = %(user_id)s')]
+    conditions.extend(TASK_FILTERS[name] for name in filters)
+    if after:
+        conditions.append(SQL('({key}, task.task_id) {operator} ({value}, %(task_id)s)').format(
+            key=sort_key.format(SQL('task.' + order_by.lstrip('-'))),
+            operator=SQL('<' if descending else '>'),
+            value=sort_key.format(Placeholder('sort_value'))
+        ))
+
+    direction = SQL('DESC' if descending else 'ASC')
+    columns, join_clauses = _task_projection(joins, 'page')
+    query = SQL('''
+WITH page AS (
+    SELECT task.task_id,
+           task.project_id,
+           task.team_id,
+           task.name,
+           task.description,
+           task.estimation,
+           task.status,
+           task.created_at,
+           task.due_date,
+           task.created_by,
+           task.assignee_id
+    FROM task
+    WHERE {conditions}
+    ORDER BY {page_sort_key} {direction}, task.task_id {direction}
+    LIMIT %(limit)s
+)
+SELECT {columns}
+FROM page
+{joins}
+ORDER BY {sort_key} {direction}, page.task_id {direction}
+;
+''').format(
+        conditions=SQL('\n        AND ').join(conditions),
+        columns=columns,
+        joins=join_clauses,
+        page_sort_key=sort_key.format(SQL('task.' + order_by.lstrip('-'))),
+        sort_key=sort_key.format(SQL('page.' + order_by.lstrip('-'))),
+        direction=direction
+    )
+    # only SQL and Placeholder are composed, they don't need a connection to be rendered
+    return query.as_string(None)
+
+
+def get_fetch_many_statement(filters: tuple = (), order_by: str = DEFAULT_TASK_ORDERING,
+                             after: bool = False, fields: tuple = DEFAULT_TASK_FIELDS) -> PreparedStatement:
+    """Prepared statement of the task list for a filter shape (the names of the filters in use,
+    not their values) and the joins the fields need, composed once per shape.
+    """
+    filters = tuple(sorted(filters))
+    joins = _task_joins(fields)
+    default_name = None
+    if (filters, order_by, joins) == ((), DEFAULT_TASK_ORDERING, _task_joins(DEFAULT_TASK_FIELDS)):
+        default_name = 'fetch_many_tasks_after' if after else 'fetch_many_tasks'
+    return _get_task_statement(('fetch_many_tasks', filters, order_by, after, joins), default_name,
+                               lambda: _fetch_many_query(filters, order_by, after, joins))
+
 
+fetch_many_statement = get_fetch_many_statement()
+fetch_many_after_statement = get_fetch_many_statement(after=True)
+
+
+@replica_safe
 def fetch_many(user,
-               offset: int = 0,
-               limit: int = 20):
+               limit: int = 20,
+               cursor: str = None,
+               order_by: str = DEFAULT_TASK_ORDERING,
+               time_entries_limit: int = 10,
+               fields: tuple = None,
+               **filters):
+    """Page of tasks, continues after the cursor (meta.next_cursor of the previous page) if given.
+    Every task comes with its most recent time entries (at most time_entries_limit) and time_entry_count,
+    loaded for the whole page in a second query.
+    fields - names of task.schema.Task fields to load (DEFAULT_TASK_LIST_FIELDS if None), the tasks may have
+    a few more (the columns of the task are always loaded)
+    filters - values of TASK_FILTERS, None means not filtered
+    Raises InvalidCursor.
+    """
+    fields = DEFAULT_TASK_LIST_FIELDS if fields is None else fields
+    filters = {name: value for name, value in filters.items() if value is not None}
+    if len(filters.get('status', ())) == 1:
+        filters['single_status'], = filters.pop('status')
+    params = {
+        **filters,
+        'user_id': user.user_id,
+        # one more row tells whether there is a next page
+        'limit': limit + 1,
+    }
+
+    column = order_by.lstrip('-')
+    if cursor is not None:
+        params['sort_value'], params['task_id'] = decode_cursor(cursor, nullable(to_datetime), int)
+
+    statement = get_fetch_many_statement(tuple(filters), order_by, after=cursor is not None, fields=fields)
 
+    db = get_db()
+    with db.cursor() as db_cursor:
+        db_cursor.execute(statement, params)
+        tasks = db_cursor.fetchall()
+
+    next_cursor = None
+    if len(tasks) > limit:
+        tasks = tasks[:limit]
+        next_cursor = encode_cursor([getattr(tasks[-1], column), tasks[-1].task_id])
+
+    return {
+        'entities': _with_time_entries(tasks, fields, time_entries_limit),
+        'meta': {
+            'count': len(tasks),
+            'limit': limit,
+            'next_cursor': next_cursor
+        }
+    }
+
+
+# control characters (chr(1) and chr(2) in the query, valid in any server encoding) that ts_headline puts
+# around the matches, they become <mark> tags once the rest of the snippet is HTML-escaped
+SNIPPET_START = '\x01'
+SNIPPET_STOP = '\x02'
+
+
+def _highlight(snippet: str) -> str:
+    """HTML of a ts_headline snippet: the text escaped, the matches wrapped in <mark></mark>
+    """
+    return html.escape(snippet).replace(SNIPPET_START, '<mark>').replace(SNIPPET_STOP, '</mark>')
+
+
+def _search_query(after: str = '') -> str:
+    """Page of the tasks a user can see that match the search, best match first
+    (keyset pagination on rank, task_id). Snippets are highlighted only for the tasks of the page,
+    the matches are wrapped in SNIPPET_START / SNIPPET_STOP (removed from the text beforehand), see _highlight.
+    after - condition that continues after the cursor
+    """
+    return '''
+WITH page AS (
+    SELECT task.task_id,
+           task.team_id,
+           task.name,
+           task.description,
+           task.status,
+           task.created_at,
+           task.due_date,
+           ts_rank(task.search_vector, websearch_to_tsquery('english', %(query)s)) AS rank
+    FROM task
+    WHERE task.search_vector @@ websearch_to_tsquery('english', %(query)s)
+        AND (task.created_by = %(user_id)s OR task.team_id = ANY(%(team_ids)s))
+        {after}
+    ORDER BY rank DESC, task.task_id DESC
+    LIMIT %(limit)s
+)
+SELECT page.task_id,
+       page.team_id,
+       page.name,
+       page.status,
+       page.created_at,
+       page.due_date,
+       page.rank,
+       ts_headline('english', translate(page.name, chr(1) || chr(2), ''),
+                   websearch_to_tsquery('english', %(query)s),
+                   'StartSel=' || chr(1) || ', StopSel=' || chr(2) || ', HighlightAll=true') AS name_snippet,
+       ts_headline('english', translate(coalesce(page.description, ''), chr(1) || chr(2), ''),
+                   websearch_to_tsquery('english', %(query)s),
+                   'StartSel=' || chr(1) || ', StopSel=' || chr(2)
+                   || ', MaxWords=30, MinWords=10, MaxFragments=2') AS description_snippet
+FROM page
+ORDER BY page.rank DESC, page.task_id DESC
+;
+'''.format(after=after)
+
+
+search_statement = prepared_statement('search_tasks', _search_query())
+search_after_statement = prepared_statement('search_tasks_after', _search_query(
+    "AND (ts_rank(task.search_vector, websearch_to_tsquery('english', %(query)s)), task.task_id) "
+    "< (%(rank)s::real, %(task_id)s)"
+))
+
+
+@replica_safe
+def search(user, query: str, limit: int = 20, cursor: str = None):
+    """Full-text search (websearch syntax: words, "quoted phrases", or, -excluded) over the names and
+    descriptions of the tasks the user created or can see through the teams.
+    Raises InvalidCursor.
+    """
     params = {
+        'query': query,
         'user_id': user.user_id,
-        'limit': limit,
-        'offset': offset,
+        'team_ids': get_team_ids(user.user_id),
+        # one more row tells whether there is a next page
+        'limit': limit + 1,
     }
 
+    statement = search_statement
+    if cursor is not None:
+        params['rank'], params['task_id'] = decode_cursor(cursor, float, int)
+        statement = search_after_statement
+
     db = get_db()
-    with db.cursor() as cursor:
-        query = SQL('''
-        WITH extended_task AS (
-            SELECT task.task_id,
-                   task.project_id,
-                   task.team_id,
-                   task.name,
-                   task.description,
-                   task.estimation,
-                   task.status,
-                   task.created_at,
-                   task.due_date,
-                   task.created_by,
-                   task.assignee_id,
-                   coalesce(jsonb_agg(time_entries) filter ( where time_entries.task_id is not null ), '[]'::jsonb) as time_entries
+    with db.cursor() as db_cursor:
+        db_cursor.execute(statement, params)
+        tasks = db_cursor.fetchall()
+
+    for task in tasks:
+        task.name_snippet = _highlight(task.name_snippet)
+        task.description_snippet = _highlight(task.description_snippet)
+
+    next_cursor = None
+    if len(tasks) > limit:
+        tasks = tasks[:limit]
+        next_cursor = encode_cursor([tasks[-1].rank, tasks[-1].task_id])
+
+    return {
+        'entities': tasks,
+        'meta': {
+            'count': len(tasks),
+            'limit': limit,
+            'next_cursor': next_cursor
+        }
+    }
+
+
+# every scope (the tasks created by the user, the tasks of each team) reads its closest names from its own
+# gist index (task_created_by_name_trgm_idx, task_team_id_name_trgm_idx), at most limit rows each.
+# name %> query - the query is similar to a word (or the beginning of a word) of the name, see pg_trgm
+# word_similarity, name <->> query is 1 - that similarity
+# the ids are cast to bigint: btree_gist has no cross-type operators, created_by = <integer> would only
+# filter the rows read through the name trigrams of the whole table instead of being an index condition
+autocomplete_statement = prepared_statement('autocomplete_tasks', '''
+SELECT candidate.task_id, candidate.name
+FROM (
+    (
+        SELECT task.task_id, task.name, task.name <->> %(query)s AS distance
+        FROM task
+        WHERE task.created_by = %(user_id)s::bigint
+            AND task.name %%> %(query)s
+        ORDER BY task.name <->> %(query)s
+        LIMIT %(limit)s
+    )
+    UNION
+    (
+        SELECT team_task.task_id, team_task.name, team_task.distance
+        FROM unnest(%(team_ids)s::bigint[]) AS team(team_id)
+        CROSS JOIN LATERAL (
+            SELECT task.task_id, task.name, task.name <->> %(query)s AS distance
             FROM task
-            LEFT JOIN LATERAL (
-                SELECT task_time_entry.time_entry_id,
-                       task_time_entry.task_id,
-                       task_time_entry.assignee_id,
-                       task_time_entry.start_datetime,
-                       task_time_entry.end_datetime
-                FROM task_time_entry
-                WHERE task_time_entry.task_id = task.task_id
-                ORDER BY task_time_entry.start_datetime DESC
-            ) AS time_entries ON true
-            WHERE task.created_by = %(user_id)s
-            GROUP BY task.task_id
-            OFFSET %(offset)s
+            WHERE task.team_id = team.team_id
+                AND task.name %%> %(query)s
+            ORDER BY task.name <->> %(query)s
             LIMIT %(limit)s
-        ),
-        tasks_with_user_and_time_info AS (
-            SELECT extended_task.task_id,
-                    extended_task.project_id,
-                    extended_task.team_id,
-                    extended_task.name,
-                    extended_task.description,
-                    extended_task.estimation,
-                    extended_task.status,
-                    extended_task.created_at,
-                    extended_task.due_date,
-                    extended_task.time_entries,
-                jsonb_build_object(
-                   'username', creator.username,
-                   'user_id', creator.user_id,
-                   'first_name', creator.first_name,
-                   'last_name', creator.last_name
-                ) as creator,
-                jsonb_build_object(
-                   'username', assignee.username,
-                   'user_id', assignee.user_id,
-                   'first_name', assignee.first_name,
-                   'last_name', assignee.last_name
-                ) as assignee
-            FROM extended_task
-            LEFT JOIN app_user AS creator
-                ON creator.user_id = extended_task.created_by
-            LEFT JOIN app_user AS assignee
-                ON assignee.user_id = extended_task.assignee_id
-        )
-        SELECT *
-        FROM tasks_with_user_and_time_info
-        ORDER BY tasks_with_user_and_time_info.created_at DESC
-        ;
-        ''')
+        ) AS team_task
+    )
+) AS candidate
+ORDER BY candidate.distance, candidate.task_id DESC
+LIMIT %(limit)s
+;
+''')
+
+
+# without the trigram indexes (migration 0010 pending or not finished): names that contain the text,
+# earliest match first. Reads every task the user can see, no typos tolerated.
+autocomplete_substring_statement = prepared_statement('autocomplete_tasks_substring', '''
+SELECT task.task_id, task.name
+FROM task
+WHERE (task.created_by = %(user_id)s OR task.team_id = ANY(%(team_ids)s))
+    AND strpos(lower(task.name), lower(%(query)s)) > 0
+ORDER BY strpos(lower(task.name), lower(%(query)s)), length(task.name), task.task_id DESC
+LIMIT %(limit)s
+;
+''')
+
+
+def has_trigram_support() -> bool:
+    """Both trigram indexes of migration 0010 are built and valid (a failed concurrent build leaves an invalid one).
+    Checked again every TASKAFARIAN_TASK_AUTOCOMPLETE_INDEX_CHECK seconds (default 60), so warm processes
+    switch to the trigram query within that time once the migration has run.
+    """
+    global _trigram_support, _trigram_support_checked_at
+    check_every = float(os.getenv('TASKAFARIAN_TASK_AUTOCOMPLETE_INDEX_CHECK', 60))
+
+    is_stale = _trigram_support_checked_at is None or time.monotonic() - _trigram_support_checked_at >= check_every
+    if is_stale:
+        db = get_db()
+        with db.cursor() as cursor:
+            cursor.execute('''
+            SELECT count(*) = 2 AS built
+            FROM pg_index
+            WHERE indexrelid IN (
+                to_regclass('task_created_by_name_trgm_idx'),
+                to_regclass('task_team_id_name_trgm_idx')
+            )
+                AND indisvalid
+                AND indisready
+            ;
+            ''')
+            _trigram_support = cursor.fetchone().built
+        _trigram_support_checked_at = time.monotonic()
+    return _trigram_support
+
+
+@replica_safe
+def autocomplete(user, query: str, limit: int = 10) -> list:
+    """Tasks (task_id, name only) the user created or can see through the teams whose names match the text
+    typed so far, closest first. Tolerates typos and unfinished words (substrings only until the trigram indexes
+    are built, see has_trigram_support).
+    """
+    statement = autocomplete_statement if has_trigram_support() else autocomplete_substring_statement
+    db = get_db()
+    with db.cursor() as cursor:
+        cursor.execute(statement, {
+            'query': query,
+            'user_id': user.user_id,
+            'team_ids': get_team_ids(user.user_id),
+            'limit': limit
+        })
+        return cursor.fetchall()
 
-        cursor.execute(query, params)
-        tasks = cursor.fetchall()
-
-        return {
-            'entities': tasks,
-            'meta': {
-                'count': len(tasks),
-                'offset': offset,
-                'limit': limit
-            }
-        }
+
+def _create_query() -> str:
+    """Insert a task and return it the way fetch does, in the same statement
+    """
+    columns, joins = _task_projection(_task_joins(DEFAULT_TASK_FIELDS), 'new_task')
+    query = SQL('''
+WITH new_task AS (
+    INSERT INTO task(name, status, created_by, assignee_id, due_date, estimation, description, team_id, project_id)
+    VALUES (
+        %(name)s,
+        %(status)s,
+        %(created_by)s,
+        %(assignee_id)s,
+        %(due_date)s,
+        %(estimation)s,
+        %(description)s,
+        %(team_id)s,
+        %(project_id)s
+    )
+    RETURNING *
+)
+SELECT {columns}
+FROM new_task
+{joins}
+;
+''').format(columns=columns, joins=joins)
+    return query.as_string(None)
+
+
+create_statement = prepared_statement('create_task', _create_query())
 
 
 def create_task(user, name, status, created_by,
                 assignee_id=None, due_date=None, estimation=None,
                 description='', team_id=None, project_id=None):
+    """New task with its creator and assignee (same row as fetch), inserted and read in a single round trip
+    """
     db = get_db()
     with db.cursor() as cursor:
-        query = '''
-        INSERT INTO task(name, status, created_by, assignee_id, due_date, estimation, description, team_id, project_id)
-        VALUES (
-            %(name)s,
-            %(status)s,
-            %(created_by)s,
-            %(assignee_id)s,
-            %(due_date)s,
-            %(estimation)s,
-            %(description)s,
-            %(team_id)s,
-            %(project_id)s
-        )
-        RETURNING task_id
-        ;
-        '''
-
         params = {
             'name': name,
             'status': status,
@@ -331,12 +579,11 @@ def create_task(user, name, status, created_by,
             'project_id': project_id
         }
 
-        cursor.execute(query, params)
-
-        insertion_result = cursor.fetchone()
+        cursor.execute(create_statement, params)
+        new_task = cursor.fetchone()
         db.commit()
 
-    return fetch(user, insertion_result.task_id)
+    return new_task
 
 
 def update_task(user: namedtuple, task_id: int, details: dict) -> dict:
@@ -353,18 +600,10 @@ def update_task(user: namedtuple, task_id: int, details: dict) -> dict:
         ]
 
         query = SQL('''
-        WITH prepare_task_for_update(task_id) as (
-            SELECT task.task_id
-            FROM task
-            INNER JOIN user_to_team
-                ON user_to_team.team_id = task.team_id
-                AND user_to_team.user_id = %(user_id)s
-            WHERE task.task_id = %(task_id)s
-        )
         UPDATE task
         SET {changes}
-        FROM prepare_task_for_update
-        WHERE task.task_id = prepare_task_for_update.task_id
+        WHERE task.task_id = %(task_id)s
+            AND task.team_id = ANY(%(team_ids)s)
         RETURNING task.task_id, 
             task.project_id,
             task.team_id,
@@ -382,7 +621,7 @@ def update_task(user: namedtuple, task_id: int, details: dict) -> dict:
         params = {
             **details,
             'task_id': task_id,
-            'user_id': user.user_id
+            'team_ids': get_team_ids(user.user_id, fresh=True)
         }
         cursor.execute(query, params)
         db.commit()
@@ -402,23 +641,16 @@ def delete_tasks(user: namedtuple, task_ids: Tuple[int, ...], all_or_nothing=Tru
     db = get_db()
     with db.cursor() as cursor:
         query = '''
-        with prepare_for_deletion(task_id) as (
-            SELECT task_id
-            FROM task
-            INNER JOIN user_to_team 
-                ON user_to_team.team_id = task.team_id 
-                AND user_to_team.user_id = %(user_id)s
-            WHERE task_id IN %(task_ids)s
-        )
         DELETE
         FROM task
-        WHERE task.task_id IN (SELECT task_id FROM prepare_for_deletion)
+        WHERE task.task_id IN %(task_ids)s
+            AND task.team_id = ANY(%(team_ids)s)
         RETURNING task.task_id
         ;
         '''
         params = {
             'task_ids': tuple(task_ids),
-            'user_id': user.user_id
+            'team_ids': get_team_ids(user.user_id, fresh=True)
         }
 
         cursor.execute(query, params)
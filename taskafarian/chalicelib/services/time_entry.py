@@ -1,12 +1,45 @@
 from collections import namedtuple
 from datetime import datetime
-from typing import List, Tuple
+from typing import Dict, List, Tuple
 
 from psycopg2.sql import SQL, Identifier, Placeholder
 
-from chalicelib.core.database import get_db
+from chalicelib.core.database import get_db, replica_safe
 from chalicelib.core.exceptions import (DeletionError, EntityNotFound,
                                         InvalidValue)
+from chalicelib.core.prepared import prepared_statement
+from chalicelib.core.rows import row_class
+
+TimeEntry = row_class(('time_entry_id', 'task_id', 'assignee_id', 'start_datetime', 'end_datetime'))
+
+# the most recent time entries of every task, read from task_time_entry_task_id_start_datetime_idx
+# (at most limit rows per task, however long the history is), and the number of entries of the task
+fetch_of_tasks_statement = prepared_statement('fetch_time_entries_of_tasks', '''
+SELECT batch.task_id,
+       entry_count.total,
+       entry.time_entry_id,
+       entry.assignee_id,
+       entry.start_datetime,
+       entry.end_datetime
+FROM unnest(%(task_ids)s::bigint[]) AS batch(task_id)
+CROSS JOIN LATERAL (
+    SELECT count(*) AS total
+    FROM task_time_entry
+    WHERE task_time_entry.task_id = batch.task_id
+) AS entry_count
+LEFT JOIN LATERAL (
+    SELECT task_time_entry.time_entry_id,
+           task_time_entry.assignee_id,
+           task_time_entry.start_datetime,
+           task_time_entry.end_datetime
+    FROM task_time_entry
+    WHERE task_time_entry.task_id = batch.task_id
+    ORDER BY task_time_entry.start_datetime DESC
+    LIMIT %(limit)s
+) AS entry ON true
+ORDER BY batch.task_id, entry.start_datetime DESC
+;
+''')
 
 
 def create(task_id: int, assignee_id: int, start_datetime: datetime, end_datetime: datetime = None):
@@ -31,6 +64,29 @@ def create(task_id: int, assignee_id: int, start_datetime: datetime, end_datetim
     return time_entry
 
 
+@replica_safe
+def fetch_of_tasks(task_ids: List[int], limit: int = 10) -> Dict[int, Tuple[List[TimeEntry], int]]:
+    """Batch loader of the time entries of many tasks (e.g a page of the task list) in a single query:
+    task_id -> (the most recent entries first, at most limit of them; the number of entries of the task).
+    Every task id is in the result, tasks without time entries have ([], 0).
+    """
+    time_entries = {task_id: ([], 0) for task_id in task_ids}
+    if not task_ids:
+        return time_entries
+
+    db = get_db()
+    with db.cursor() as cursor:
+        cursor.execute(fetch_of_tasks_statement, {'task_ids': list(time_entries), 'limit': limit})
+        for row in cursor.fetchall():
+            entries, _ = time_entries[row.task_id]
+            if row.time_entry_id is not None:
+                entries.append(TimeEntry(row.time_entry_id, row.task_id, row.assignee_id,
+                                         row.start_datetime, row.end_datetime))
+            time_entries[row.task_id] = (entries, row.total)
+
+    return time_entries
+
+
 def update(user: namedtuple, time_entry_id: int, **kwargs) -> dict:
     """Update details of time entry (e.g stop task)
     User can update only time entries he owns.
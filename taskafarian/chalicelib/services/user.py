@@ -1,25 +1,130 @@
-from chalicelib.core.database import get_db
+import os
+
+from psycopg2.extras import execute_values
+
+from chalicelib.core.cache import TTLCache
+from chalicelib.core.database import get_db, on_commit
+from chalicelib.core.prepared import prepared_statement
+from chalicelib.core.shared import g
+
+_team_roles_cache = None
+
+get_team_roles_statement = prepared_statement('get_team_roles', '''
+SELECT team_id, user_role
+FROM user_to_team
+WHERE user_id = %(user_id)s
+;
+''')
+
+
+def get_team_roles_cache() -> TTLCache:
+    """Cross-request cache of user_id -> team roles, see get_team_roles.
+
+    Tunable with environment variables:
+        TASKAFARIAN_TEAM_ROLES_CACHE_SIZE - number of cached users (default 1024)
+        TASKAFARIAN_TEAM_ROLES_CACHE_TTL - seconds the roles are reused across requests (default 0, disabled).
+                                           Membership changes made through this module invalidate the cache
+                                           of the current process only, other processes notice within the ttl.
+                                           Only reads use the cache, writes are authorized with fresh roles.
+    """
+    global _team_roles_cache
+    if _team_roles_cache is None:
+        _team_roles_cache = TTLCache(
+            max_size=int(os.getenv('TASKAFARIAN_TEAM_ROLES_CACHE_SIZE', 1024)),
+            ttl=float(os.getenv('TASKAFARIAN_TEAM_ROLES_CACHE_TTL', 0))
+        )
+    return _team_roles_cache
+
+
+def get_team_roles(user_id: int, fresh: bool = False) -> dict:
+    """team_id -> user_role of every team the user belongs to.
+    Loaded on first use and memoised on the request context (and in the cross-request cache if enabled).
+    fresh=True - for write authorization: skip the cross-request cache, the roles are read from the database
+    once per request
+    """
+    team_roles = g.team_roles.get(user_id)
+    if team_roles is not None and (not fresh or user_id in g.fresh_team_roles):
+        return team_roles
+
+    cache = get_team_roles_cache()
+    team_roles = None if fresh else cache.get(user_id)
+    if team_roles is None:
+        db = get_db()
+        with db.cursor() as cursor:
+            cursor.execute(get_team_roles_statement, {'user_id': user_id})
+            team_roles = {row.team_id: row.user_role for row in cursor.fetchall()}
+        cache.set(user_id, team_roles)
+        if fresh:
+            g.fresh_team_roles.add(user_id)
+
+    g.team_roles[user_id] = team_roles
+    return team_roles
+
+
+def get_team_ids(user_id: int, fresh: bool = False) -> list:
+    """Teams of the user, for team_id = ANY(...) predicates
+    """
+    return list(get_team_roles(user_id, fresh))
+
+
+def invalidate_team_roles(user_id: int):
+    """Forget the memoised roles of the user, call it whenever the memberships of the user change
+    """
+    g.team_roles.pop(user_id, None)
+    g.fresh_team_roles.discard(user_id)
+    get_team_roles_cache().invalidate(user_id)
+    # a concurrent request may have cached the roles again before the change was committed
+    on_commit(lambda: get_team_roles_cache().invalidate(user_id))
 
 
 def get_teams(user_id: int):
+    return list(get_team_roles(user_id).items())
+
+
+def get_user_role_in_team(user_id: int, team_id: int, fresh: bool = False):
+    return get_team_roles(user_id, fresh).get(team_id)
+
+
+def add_team_member(team_id: int, user_id: int, user_role: str):
     db = get_db()
     with db.cursor() as cursor:
         cursor.execute('''
-        SELECT team_id, user_role
-        FROM user_to_team
-        WHERE user_id = %(user_id)s
+        INSERT INTO user_to_team (user_id, team_id, user_role)
+        VALUES (%(user_id)s, %(team_id)s, %(user_role)s)
+        ON CONFLICT (user_id, team_id) DO UPDATE SET user_role = excluded.user_role
         ;
-        ''', {'user_id': user_id})
-        return cursor.fetchall()
+        ''', {'user_id': user_id, 'team_id': team_id, 'user_role': user_role})
+        db.commit()
+    invalidate_team_roles(user_id)
+
+
+def add_team_members(team_id: int, user_ids: list, user_role: str):
+    """Add many users to the team with a single statement, in the transaction of the caller
+    """
+    if not user_ids:
+        return
+
+    db = get_db()
+    with db.cursor() as cursor:
+        execute_values(cursor, '''
+        INSERT INTO user_to_team (user_id, team_id, user_role)
+        VALUES %s
+        ON CONFLICT (user_id, team_id) DO UPDATE SET user_role = excluded.user_role
+        ;
+        ''', [(user_id, team_id, user_role) for user_id in user_ids], page_size=len(user_ids))
+
+    for user_id in user_ids:
+        invalidate_team_roles(user_id)
 
 
-def get_user_role_in_team(user_id: int, team_id: int):
+def remove_team_member(team_id: int, user_id: int):
     db = get_db()
     with db.cursor() as cursor:
         cursor.execute('''
-        SELECT user_role
+        DELETE
         FROM user_to_team
         WHERE user_id = %(user_id)s AND team_id = %(team_id)s
         ;
         ''', {'user_id': user_id, 'team_id': team_id})
-        return cursor.fetchone()
+        db.commit()
+    invalidate_team_roles(user_id)
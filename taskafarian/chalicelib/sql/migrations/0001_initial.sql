@@ -1,8 +1,5 @@
-
--- CREATE DATABASE taskafarian;
--- sudo -u postgres psql createdb taskafarian
-
--- BEGIN;
+-- initial schema
+-- IF NOT EXISTS everywhere so that databases created before migrations were introduced can be adopted
 
 CREATE TABLE IF NOT EXISTS app_user (
     user_id bigint generated by default as identity primary key,
@@ -72,6 +69,7 @@ INSERT INTO task_status(status)
            ('completed'),
            ('archived'),
            ('on_hold')
+ON CONFLICT DO NOTHING
 ;
 
 -- task can be associated with many tags
@@ -116,5 +114,3 @@ CREATE TABlE IF NOT EXISTS task_time_entry (
 
     CHECK (start_datetime < end_datetime)
 );
-
--- COMMIT;
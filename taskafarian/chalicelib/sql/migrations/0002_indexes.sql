@@ -0,0 +1,13 @@
+-- migrate: no-transaction
+-- indexes for the hot access paths, built without locking the tables for writes
+
+-- get_user_by_token, log_out
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS token_token_key ON token (token);
+
+-- task list of a user (services.task.fetch_many)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS task_created_by_created_at_idx ON task (created_by, created_at DESC);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS task_assignee_id_idx ON task (assignee_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS task_team_id_idx ON task (team_id);
+
+-- time entries of a task, latest first
+CREATE INDEX CONCURRENTLY IF NOT EXISTS task_time_entry_task_id_start_datetime_idx ON task_time_entry (task_id, start_datetime DESC);
@@ -0,0 +1,9 @@
+-- revocation list of signed access tokens (TASKAFARIAN_AUTH_TOKEN_MODE=jwt)
+-- a row is only needed until the token expires on its own
+
+CREATE TABLE IF NOT EXISTS revoked_token (
+    jti text primary key,
+    user_id bigint references app_user (user_id) on delete cascade not null,
+    expires_at timestamptz not null,
+    revoked_at timestamptz not null default now()
+);
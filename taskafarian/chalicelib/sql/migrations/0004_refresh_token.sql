@@ -0,0 +1,23 @@
+-- refresh tokens, rotated on every use (services.auth.refresh)
+-- only the sha256 of a token is stored, the token itself is random so a fast hash is enough
+
+CREATE TABLE IF NOT EXISTS refresh_token (
+    refresh_token_id bigint generated by default as identity primary key,
+    user_id bigint references app_user (user_id) on delete cascade not null,
+    token_hash text not null,
+    -- every token rotated from the same log-in shares the family
+    family_id text not null,
+    expires_at timestamptz not null,
+    created_at timestamptz not null default now(),
+    used_at timestamptz,
+    revoked_at timestamptz
+);
+
+-- services.auth.refresh
+CREATE UNIQUE INDEX IF NOT EXISTS refresh_token_token_hash_key ON refresh_token (token_hash);
+
+-- revocation of a family on reuse
+CREATE INDEX IF NOT EXISTS refresh_token_family_id_idx ON refresh_token (family_id);
+
+-- revocation of every token of a user (deactivate_user)
+CREATE INDEX IF NOT EXISTS refresh_token_user_id_idx ON refresh_token (user_id);
@@ -0,0 +1,8 @@
+-- migrate: no-transaction
+-- expired rows are purged in batches (services.auth.purge_expired_tokens)
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS token_expires_at_idx ON token (expires_at);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS revoked_token_expires_at_idx ON revoked_token (expires_at);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS refresh_token_expires_at_idx ON refresh_token (expires_at);
@@ -0,0 +1,19 @@
+-- transactional outbox of emails, written in the transaction of the change that triggers the email
+-- (e.g registration) and delivered by services.mail.deliver_emails
+
+CREATE TABLE IF NOT EXISTS email_outbox (
+    email_id bigint generated by default as identity primary key,
+    template text not null,
+    recipient text not null,
+    context jsonb not null default '{}',
+    -- pending -> sent, or failed once max attempts are used up
+    status text not null default 'pending' check (status in ('pending', 'sent', 'failed')),
+    attempts integer not null default 0,
+    next_attempt_at timestamptz not null default now(),
+    last_error text,
+    created_at timestamptz not null default now(),
+    sent_at timestamptz
+);
+
+-- claiming due emails (services.mail.deliver_emails)
+CREATE INDEX IF NOT EXISTS email_outbox_pending_idx ON email_outbox (next_attempt_at) WHERE status = 'pending';
@@ -0,0 +1,8 @@
+-- migrate: no-transaction
+-- keyset pagination of the task list (services.task.fetch_many): the index matches
+-- WHERE created_by = ? AND (created_at, task_id) < (?, ?) ORDER BY created_at DESC, task_id DESC
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS task_created_by_created_at_task_id_idx ON task (created_by, created_at DESC, task_id DESC);
+
+-- superseded by the index above
+DROP INDEX CONCURRENTLY IF EXISTS task_created_by_created_at_idx;
@@ -0,0 +1,12 @@
+-- migrate: no-transaction
+-- common filters and orderings of the task list (services.task.fetch_many), every index ends with
+-- the sort key and task_id so the page is read in order and the cursor is an index condition
+
+-- ?status=...
+CREATE INDEX CONCURRENTLY IF NOT EXISTS task_created_by_status_created_at_task_id_idx ON task (created_by, status, created_at DESC, task_id DESC);
+
+-- ?assigneeId=...
+CREATE INDEX CONCURRENTLY IF NOT EXISTS task_created_by_assignee_id_created_at_task_id_idx ON task (created_by, assignee_id, created_at DESC, task_id DESC);
+
+-- ?orderBy=dueDate / -dueDate (tasks without a due date last), scanned backwards for the descending order
+CREATE INDEX CONCURRENTLY IF NOT EXISTS task_created_by_due_date_task_id_idx ON task (created_by, (coalesce(due_date, 'infinity'::timestamptz)), task_id);
@@ -0,0 +1,51 @@
+-- migrate: no-transaction
+-- full-text search over task names and descriptions (services.task.search),
+-- names weigh more than descriptions in the rank.
+-- Nothing here rewrites or locks the task table for long: the column is added empty (a catalog change),
+-- a trigger fills it on insert and on updates of the name or description, the existing rows are filled
+-- in batches of their own transactions and the index is built concurrently.
+-- Until the backfill is done, tasks without a vector are just not found by the search.
+
+ALTER TABLE task ADD COLUMN IF NOT EXISTS search_vector tsvector;
+
+CREATE OR REPLACE FUNCTION task_search_vector(name text, description text) RETURNS tsvector
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT setweight(to_tsvector('english', coalesce(name, '')), 'A') ||
+           setweight(to_tsvector('english', coalesce(description, '')), 'B')
+$$;
+
+CREATE OR REPLACE FUNCTION task_search_vector_trigger() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    NEW.search_vector := task_search_vector(NEW.name, NEW.description);
+    RETURN NEW;
+END
+$$;
+
+DROP TRIGGER IF EXISTS task_search_vector_update ON task;
+
+CREATE TRIGGER task_search_vector_update
+BEFORE INSERT OR UPDATE OF name, description ON task
+FOR EACH ROW EXECUTE FUNCTION task_search_vector_trigger();
+
+-- rows inserted from now on have their vector, fill the older ones 10000 task ids at a time
+DO $$
+DECLARE
+    batch_size constant bigint := 10000;
+    last_task_id bigint := 0;
+    max_task_id bigint;
+BEGIN
+    SELECT max(task_id) INTO max_task_id FROM task;
+    WHILE last_task_id < coalesce(max_task_id, 0) LOOP
+        UPDATE task
+        SET search_vector = task_search_vector(name, description)
+        WHERE task_id > last_task_id
+            AND task_id <= last_task_id + batch_size
+            AND search_vector IS NULL;
+        last_task_id := last_task_id + batch_size;
+        COMMIT;
+    END LOOP;
+END
+$$;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS task_search_vector_idx ON task USING gin (search_vector);
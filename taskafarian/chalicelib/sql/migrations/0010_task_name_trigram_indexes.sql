@@ -0,0 +1,15 @@
+-- migrate: no-transaction
+-- migrate: requires-extensions pg_trgm, btree_gist
+-- as-you-type lookup of task names (services.task.autocomplete)
+-- pg_trgm gives the word similarity operators and their GiST support, btree_gist lets the scope
+-- column lead the same index, so the nearest names of one creator or one team are read straight
+-- from the index (ORDER BY name <->> query LIMIT n) whatever the size of the table.
+-- Both extensions are trusted (postgres 13+), the owner of the database can create them. On a server
+-- without them (no contrib package) the migration stays pending and autocomplete matches substrings.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE EXTENSION IF NOT EXISTS btree_gist;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS task_created_by_name_trgm_idx ON task USING gist (created_by, name gist_trgm_ops);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS task_team_id_name_trgm_idx ON task USING gist (team_id, name gist_trgm_ops);
@@ -1,12 +1,18 @@
+import os
+
 from chalice import Response
 
 from chalicelib.auth.decorators import protected
 from chalicelib.core.exceptions import APIError, EntityNotFound
 from chalicelib.core.extensions import Blueprint
+from chalicelib.core.pagination import InvalidCursor
 from chalicelib.core.shared import g
 from chalicelib.services import task
 from chalicelib.services.task import DeletionError
-from chalicelib.task.schema import Task, TaskList
+from chalicelib.task.schema import (Task, TaskAutocompleteParams,
+                                    TaskFieldsParams, TaskList, TaskListParams,
+                                    TaskSearchParams, TaskSearchResult,
+                                    TaskSuggestionList)
 
 blueprint = Blueprint(__name__)
 
@@ -19,14 +25,54 @@ def create_new_task():
     task_details = Task().load(body)
     task_details['created_by'] = g.current_user.user_id
     new_task = task.create_task(user=g.current_user, **task_details)
-    return Response(body=Task().dump(new_task), status_code=201)
+    return Response(body=Task(only=task.DEFAULT_TASK_FIELDS).dump(new_task), status_code=201)
 
 
 @blueprint.route('/', methods=['GET'])
 @protected
 def get_many_tasks():
+    params = TaskListParams().load(blueprint.current_request.query_params or {})
+    try:
+        tasks = task.fetch_many(
+            user=g.current_user,
+            time_entries_limit=int(os.getenv('TASKAFARIAN_TASK_LIST_TIME_ENTRIES', 10)),
+            **params
+        )
+    except InvalidCursor:
+        raise APIError(status=422, fields={'cursor': ['Invalid cursor']})
+
+    # the tasks have a few more fields than requested (or loaded by default)
+    only = ['meta'] + ['entities.' + field for field in params.get('fields', task.DEFAULT_TASK_LIST_FIELDS)]
+
+    return Response(
+        body=TaskList(only=only).dump(tasks),
+        status_code=200
+    )
+
+
+@blueprint.route('/search', methods=['GET'])
+@protected
+def search_tasks():
+    params = TaskSearchParams().load(blueprint.current_request.query_params or {})
+    try:
+        tasks = task.search(user=g.current_user, query=params.pop('q'), **params)
+    except InvalidCursor:
+        raise APIError(status=422, fields={'cursor': ['Invalid cursor']})
+
+    return Response(
+        body=TaskSearchResult().dump(tasks),
+        status_code=200
+    )
+
+
+@blueprint.route('/autocomplete', methods=['GET'])
+@protected
+def autocomplete_tasks():
+    params = TaskAutocompleteParams().load(blueprint.current_request.query_params or {})
+    tasks = task.autocomplete(user=g.current_user, query=params['q'], limit=params['limit'])
+
     return Response(
-        body=TaskList().dump(task.fetch_many(user=g.current_user)),
+        body=TaskSuggestionList().dump({'entities': tasks}),
         status_code=200
     )
 
@@ -34,9 +80,16 @@ def get_many_tasks():
 @blueprint.route('/{task_id}', methods=['GET'])
 @protected
 def get_task(task_id):
-    requested_task = task.fetch(g.current_user, int(task_id))
+    params = TaskFieldsParams().load(blueprint.current_request.query_params or {})
+    requested_task = task.fetch(
+        g.current_user,
+        int(task_id),
+        time_entries_limit=int(os.getenv('TASKAFARIAN_TASK_LIST_TIME_ENTRIES', 10)),
+        **params
+    )
     if requested_task:
-        return Response(body=Task().dump(requested_task), status_code=200)
+        return Response(body=Task(only=params.get('fields', task.DEFAULT_TASK_FIELDS)).dump(requested_task),
+                        status_code=200)
 
     raise APIError(status=404)
 
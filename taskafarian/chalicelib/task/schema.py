@@ -1,7 +1,9 @@
-from marshmallow import ValidationError, fields, validate
+from marshmallow import ValidationError, fields, post_load, validate
 
-from chalicelib.core.schema import BaseSchema, EntityListMeta
-from chalicelib.services.task import StatusEnum
+from chalicelib.core import fields as custom_fields
+from chalicelib.core.schema import (BaseSchema, EntityListMeta, PageParams,
+                                    camelcase)
+from chalicelib.services.task import TASK_ORDERINGS, StatusEnum
 
 
 class Status(fields.Field):
@@ -23,8 +25,8 @@ class TimeEntry(BaseSchema):
     time_entry_id = fields.Int()
     task_id = fields.Int()
     assignee_id = fields.Int()
-    start_datetime = fields.Str()  # comes as a string from the database
-    end_datetime = fields.Str()  # same here
+    start_datetime = fields.AwareDateTime()
+    end_datetime = fields.AwareDateTime()
 
 
 class Task(BaseSchema):
@@ -42,8 +44,91 @@ class Task(BaseSchema):
     creator = fields.Nested(User, dump_only=True)
     assignee = fields.Nested(User, dump_only=True)
     time_entries = fields.Nested(TimeEntry, many=True, dump_only=True)
+    # all the time entries of the task, time_entries has only the most recent ones
+    time_entry_count = fields.Int(dump_only=True)
+
+
+class TaskFieldsParams(BaseSchema):
+    """Sparse fieldset: ?fields=taskId,name,status returns (and loads) only these fields of Task
+    """
+    # data key "fields", the attribute name is taken by marshmallow
+    task_fields = custom_fields.CommaSeparatedList(
+        fields.Str(validate=validate.OneOf([camelcase(name) for name in Task._declared_fields])),
+        data_key='fields',
+        validate=validate.Length(min=1)
+    )
+
+    @post_load
+    def field_names(self, data, **kwargs):
+        if 'task_fields' in data:
+            requested = data.pop('task_fields')
+            data['fields'] = tuple(name for name in Task._declared_fields if camelcase(name) in requested)
+        return data
 
 
 class TaskList(BaseSchema):
     entities = fields.Nested(Task, many=True)
     meta = fields.Nested(EntityListMeta)
+
+
+class TaskSearchHit(BaseSchema):
+    task_id = fields.Int()
+    team_id = fields.Int()
+    name = fields.Str()
+    status = fields.Str()
+    created_at = fields.AwareDateTime()
+    due_date = fields.AwareDateTime()
+    rank = fields.Float()
+    # HTML: the text is escaped, matched words are wrapped in <mark></mark>
+    name_snippet = fields.Str()
+    description_snippet = fields.Str()
+
+
+class TaskSearchResult(BaseSchema):
+    entities = fields.Nested(TaskSearchHit, many=True)
+    meta = fields.Nested(EntityListMeta)
+
+
+class TaskSearchParams(PageParams):
+    """Query parameters of GET /task/search
+    """
+    q = fields.Str(required=True, validate=validate.Length(min=1, max=256))
+
+
+class TaskSuggestion(BaseSchema):
+    task_id = fields.Int()
+    name = fields.Str()
+
+
+class TaskSuggestionList(BaseSchema):
+    entities = fields.Nested(TaskSuggestion, many=True)
+
+
+class TaskAutocompleteParams(BaseSchema):
+    """Query parameters of GET /task/autocomplete
+    """
+    q = fields.Str(required=True, validate=validate.Length(min=1, max=255))
+    limit = fields.Int(missing=10, validate=validate.Range(min=1, max=20))
+
+
+class TaskListParams(PageParams, TaskFieldsParams):
+    """Query parameters of GET /task
+    """
+    status = custom_fields.CommaSeparatedList(Status(), validate=validate.Length(min=1))
+    assignee_id = fields.Int()
+    due_date_gt = fields.AwareDateTime()
+    due_date_lt = fields.AwareDateTime()
+    created_at_gt = fields.AwareDateTime()
+    created_at_lt = fields.AwareDateTime()
+    # camel-case column, prefixed with - for the descending order: ?orderBy=-dueDate
+    order_by = fields.Str(validate=validate.OneOf([
+        prefix + camelcase(column) for column in TASK_ORDERINGS for prefix in ('', '-')
+    ]))
+
+    @post_load
+    def order_by_column(self, data, **kwargs):
+        if 'order_by' in data:
+            descending = data['order_by'].startswith('-')
+            column = next(column for column in TASK_ORDERINGS if camelcase(column) == data['order_by'].lstrip('-'))
+            data['order_by'] = ('-' if descending else '') + column
+        return data
@@ -8,15 +8,20 @@ from chalice.test import Client, TestHTTPClient
 from marshmallow.fields import AwareDateTime
 
 from app import app as application
-from chalicelib.core.database import close_db, create_all, create_db, drop_db
+from chalicelib.core.database import close_db, create_db, drop_db
+from chalicelib.core.migrations import migrate
+from chalicelib.core.rows import Row
+from chalicelib.services.auth import get_token_cache, reset_revoked_tokens
 
 
 class JSONEncoder(jsonlib.JSONEncoder):
-    """JSON encoder with datetime support
+    """JSON encoder with datetime and database row support
     """
     def default(self, obj):
         if isinstance(obj, datetime):
             return obj.isoformat()
+        if isinstance(obj, Row):
+            return list(obj)
         return super().default(obj)
 
 
@@ -54,8 +59,10 @@ def app():
         # TODO: ^ or try TRUNCATE
         drop_db()
         create_db()
-        create_all()
+        migrate()
         load_fixture('base.sql')
+        get_token_cache().clear()
+        reset_revoked_tokens()
 
         yield client
 
@@ -63,7 +70,7 @@ def app():
 
 
 def get_user(username):
-    from chalicelib.core.database import get_db
+    from chalicelib.core.database import get_db, release_db
     db = get_db()
     with db.cursor() as cursor:
         query = '''
@@ -76,8 +83,11 @@ def get_user(username):
         params = {'username': username}
         cursor.execute(query, params)
         db.commit()
+        user = cursor.fetchone()
 
-        return cursor.fetchone()
+    # don't let the connection leak into the next request
+    release_db()
+    return user
 
 
 @pytest.fixture
@@ -146,3 +156,15 @@ def db():
     connection = connect()
     yield connection
     connection.close()
+
+
+@pytest.fixture
+def trigram_indexes(app, db):
+    """Skip the test when migration 0010 is pending: the server has no pg_trgm / btree_gist
+    """
+    with db.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('task_team_id_name_trgm_idx') IS NOT NULL AS created;")
+        created = cursor.fetchone().created
+        db.commit()
+    if not created:
+        pytest.skip('pg_trgm and btree_gist are not available')
@@ -0,0 +1,56 @@
+-- realistically sized dataset on top of base.sql: 5000 users, 60k tasks, 120k time entries, 20k tokens, 20k refresh tokens
+INSERT INTO app_user (username, email, is_active, password_hash)
+SELECT 'user' || i, 'user' || i || '@example.com', true, NULL
+FROM generate_series(1, 5000) AS i
+;
+
+INSERT INTO token (user_id, token, expires_at)
+SELECT user_id, md5(random()::text) || md5(user_id::text || i::text), now() + (i - 2) * '1 hour'::interval
+FROM app_user, generate_series(1, 4) AS i
+;
+
+INSERT INTO refresh_token (user_id, token_hash, family_id, expires_at, used_at)
+SELECT user_id,
+       encode(sha256((user_id::text || ':' || i::text)::bytea), 'hex'),
+       md5(user_id::text),
+       now() + '30 days'::interval,
+       CASE WHEN i < 4 THEN now() END
+FROM app_user, generate_series(1, 4) AS i
+;
+
+INSERT INTO task (status, created_by, assignee_id, team_id, project_id, name, created_at)
+SELECT 'todo',
+       first_user.user_id + i % 5000,
+       first_user.user_id + i % 5000,
+       NULL,
+       NULL,
+       'task ' || i,
+       now() - i * '1 minute'::interval
+FROM generate_series(1, 50000) AS i,
+     (SELECT min(user_id) AS user_id FROM app_user WHERE username LIKE 'user%') AS first_user
+;
+
+-- alice has a long task list with assignees, due dates and mostly finished tasks (filters of services.task.fetch_many)
+INSERT INTO task (status, created_by, assignee_id, team_id, project_id, name, created_at, due_date)
+SELECT CASE i % 50 WHEN 0 THEN 'todo' WHEN 1 THEN 'in_progress' ELSE (ARRAY['completed', 'cancelled', 'archived'])[1 + i % 3] END,
+       alice.user_id,
+       first_user.user_id + i % 50,
+       NULL,
+       NULL,
+       'alice task ' || i,
+       now() - i * '1 minute'::interval,
+       CASE WHEN i % 7 <> 0 THEN now() + (i % 365) * '1 day'::interval END
+FROM generate_series(1, 10000) AS i,
+     (SELECT user_id FROM app_user WHERE username = 'alice') AS alice,
+     (SELECT min(user_id) AS user_id FROM app_user WHERE username LIKE 'user%') AS first_user
+;
+
+INSERT INTO task_time_entry (task_id, assignee_id, start_datetime, end_datetime)
+SELECT task_id, assignee_id, created_at + i * '1 hour'::interval, created_at + i * '1 hour'::interval + '30 minutes'::interval
+FROM task, generate_series(1, 2) AS i
+;
+
+-- what autovacuum does after a bulk load: move the GIN pending list into the index
+SELECT gin_clean_pending_list('task_search_vector_idx');
+
+ANALYZE;
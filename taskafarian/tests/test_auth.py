@@ -1,12 +1,15 @@
 import os
+import time
 from datetime import datetime, timedelta, timezone
 
 import jwt
 
 from chalicelib.services import auth
 from chalicelib.services.auth import ActionType
+from tests.conftest import get_user
 
 url_registration = '/auth/register'
+url_registration_bulk = '/auth/register/bulk'
 url_user = '/user'
 url_user_me = '/user/me'
 url_log_in = '/auth/log-in'
@@ -143,6 +146,85 @@ def test_new_registered_user_can_log_in_if_activation_is_not_required(app, monke
     assert response.status_code == 200
 
 
+def bulk_user(username, **overrides):
+    return {'username': username, 'email': f'{username}@{username}.com', 'password': '12345678', **overrides}
+
+
+def test_bulk_registration_reports_conflicts_per_user(app, db, user_alice, monkeypatch):
+    monkeypatch.setenv('TASKAFARIAN_PASSWORD_ROUNDS', '4')
+    users = [
+        bulk_user('luna', firstName='Luna'),
+        bulk_user('nova'),
+        bulk_user('bob', email='bobby@bob.com'),  # existing username
+        {'username': 'mira', 'email': 'mira@mira.com'},  # no password
+        bulk_user('sol', email='nova@nova.com'),  # email repeated in the batch
+        bulk_user('vega', email='alice@alice.com'),  # existing email
+        bulk_user('orion'),
+    ]
+
+    response = app.http.post(
+        path=url_registration_bulk,
+        json={'teamId': 1, 'users': users},
+        headers={'Authorization': f'Bearer {user_alice.token}'}
+    )
+    assert response.status_code == 201
+    assert [user['username'] for user in response.json_body['created']] == ['luna', 'nova', 'orion']
+    assert response.json_body['created'][0]['firstName'] == 'Luna'
+    assert response.json_body['errors'] == [
+        {'index': 2, 'fields': {'username': ['Already exists']}},
+        {'index': 3, 'fields': {'password': ['Missing data for required field.']}},
+        {'index': 4, 'fields': {'email': ['Duplicate']}},
+        {'index': 5, 'fields': {'email': ['Already exists']}},
+    ]
+
+    with db.cursor() as cursor:
+        cursor.execute('''
+        SELECT app_user.username, app_user.is_active, user_to_team.team_id, user_to_team.user_role
+        FROM app_user
+        JOIN user_to_team USING (user_id)
+        WHERE username IN ('luna', 'nova', 'orion')
+        ORDER BY user_id
+        ;
+        ''')
+        assert cursor.fetchall() == [('luna', False, 1, 'member'), ('nova', False, 1, 'member'),
+                                     ('orion', False, 1, 'member')]
+
+        cursor.execute('''SELECT recipient FROM email_outbox ORDER BY email_id;''')
+        assert [email.recipient for email in cursor.fetchall()] == ['luna@luna.com', 'nova@nova.com',
+                                                                     'orion@orion.com']
+
+        cursor.execute('''UPDATE app_user SET is_active = true WHERE username = 'orion';''')
+        db.commit()
+
+    response = app.http.post(path=url_log_in, json={'username': 'orion', 'password': '12345678'})
+    assert response.status_code == 200
+
+
+def test_only_team_leader_can_register_users_in_bulk(app, user_bob):
+    response = app.http.post(
+        path=url_registration_bulk,
+        json={'teamId': 1, 'users': [bulk_user('luna')]},
+        headers={'Authorization': f'Bearer {user_bob.token}'}
+    )
+    assert response.status_code == 403
+    assert get_user('luna') is None
+
+
+def test_bulk_registration_is_limited(app, user_alice, monkeypatch):
+    monkeypatch.setenv('TASKAFARIAN_BULK_REGISTRATION_LIMIT', '2')
+    response = app.http.post(
+        path=url_registration_bulk,
+        json={'teamId': 1, 'users': [bulk_user('luna'), bulk_user('nova'), bulk_user('orion')]},
+        headers={'Authorization': f'Bearer {user_alice.token}'}
+    )
+    assert response.status_code == 422
+    assert response.json_body['fields'] == {'users': ['At most 2 users per request']}
+
+    response = app.http.post(path=url_registration_bulk, json={'teamId': 1, 'users': []},
+                             headers={'Authorization': f'Bearer {user_alice.token}'})
+    assert response.status_code == 422
+
+
 # log-in
 def test_log_in(app):
     response = app.http.post(
@@ -204,6 +286,239 @@ def test_log_out(app):
     assert response.status_code == 401
 
 
+# token cache
+def test_token_is_authenticated_from_the_cache(app, db, user_alice):
+    cache = auth.get_token_cache()
+    for _ in range(3):
+        response = app.http.get(path=url_user_me, headers={'Authorization': f'Bearer {user_alice.token}'})
+        assert response.status_code == 200
+    assert (cache.stats()['misses'], cache.stats()['hits']) == (1, 2)
+
+    # the database is not asked while the token is cached
+    with db.cursor() as cursor:
+        cursor.execute('DELETE FROM token WHERE token = %s;', (user_alice.token,))
+        db.commit()
+    response = app.http.get(path=url_user_me, headers={'Authorization': f'Bearer {user_alice.token}'})
+    assert response.status_code == 200
+
+    cache.clear()
+    response = app.http.get(path=url_user_me, headers={'Authorization': f'Bearer {user_alice.token}'})
+    assert response.status_code == 401
+
+
+def test_token_is_not_cached_beyond_its_expiry(app, db, user_alice):
+    with db.cursor() as cursor:
+        cursor.execute('''
+        UPDATE token
+        SET expires_at = now() + interval '90 seconds'
+        WHERE token = %s;
+        ''', (user_alice.token,))
+        db.commit()
+
+    response = app.http.get(path=url_user_me, headers={'Authorization': f'Bearer {user_alice.token}'})
+    assert response.status_code == 200
+
+    # tokens expiring within a minute are rejected, so the token can be trusted for 30 seconds at most
+    [(_, expires_at)] = auth.get_token_cache()._entries.values()
+    assert expires_at - time.monotonic() <= 30
+
+
+# signed access tokens
+def log_in_with_access_token(app, monkeypatch, username='alice'):
+    monkeypatch.setenv('TASKAFARIAN_AUTH_TOKEN_MODE', 'jwt')
+    response = app.http.post(path=url_log_in, json={'username': username, 'password': '12345678'})
+    assert response.status_code == 200
+    return response.json_body['token']
+
+
+def test_access_token_is_verified_without_the_database(app, db, monkeypatch):
+    with db.cursor() as cursor:
+        cursor.execute('SELECT count(*) FROM token;')
+        token_count = cursor.fetchone().count
+        db.commit()
+
+    token = log_in_with_access_token(app, monkeypatch)
+    assert auth.is_access_token(token)
+
+    with db.cursor() as cursor:
+        cursor.execute('SELECT count(*) FROM token;')
+        assert cursor.fetchone().count == token_count
+        db.commit()
+
+    # the first request loads the revocation list
+    response = app.http.get(path=url_user_me, headers={'Authorization': f'Bearer {token}'})
+    assert response.status_code == 200
+
+    def get_db(*args, **kwargs):
+        raise AssertionError('the database should not be used')
+    monkeypatch.setattr('chalicelib.services.auth.get_db', get_db)
+
+    response = app.http.get(path=url_user_me, headers={'Authorization': f'Bearer {token}'})
+    assert response.status_code == 200
+    assert response.json_body['username'] == 'alice'
+    assert response.json_body['email'] == 'alice@alice.com'
+
+
+def test_log_out_revokes_access_token(app, db, monkeypatch):
+    token = log_in_with_access_token(app, monkeypatch)
+
+    response = app.http.delete(path=url_log_out, headers={'Authorization': f'Bearer {token}'})
+    assert response.status_code == 200
+
+    response = app.http.get(path=url_user_me, headers={'Authorization': f'Bearer {token}'})
+    assert response.status_code == 401
+
+    with db.cursor() as cursor:
+        cursor.execute('SELECT jti, user_id FROM revoked_token;')
+        [revoked] = cursor.fetchall()
+        db.commit()
+    assert revoked.jti == jwt.decode(token, verify=False)['jti']
+    assert revoked.user_id == 1
+
+
+def test_access_token_revoked_by_another_process_is_rejected(app, db, monkeypatch):
+    token = log_in_with_access_token(app, monkeypatch)
+    response = app.http.get(path=url_user_me, headers={'Authorization': f'Bearer {token}'})
+    assert response.status_code == 200
+
+    with db.cursor() as cursor:
+        cursor.execute('''
+        INSERT INTO revoked_token (jti, user_id, expires_at)
+        VALUES (%s, 1, now() + interval '1 hour');
+        ''', (jwt.decode(token, verify=False)['jti'],))
+        db.commit()
+
+    # the in-process copy of the revocation list is reloaded after the refresh interval
+    response = app.http.get(path=url_user_me, headers={'Authorization': f'Bearer {token}'})
+    assert response.status_code == 200
+    monkeypatch.setenv('TASKAFARIAN_AUTH_REVOCATION_REFRESH', '0')
+    response = app.http.get(path=url_user_me, headers={'Authorization': f'Bearer {token}'})
+    assert response.status_code == 401
+
+
+def test_opaque_tokens_are_accepted_in_jwt_mode(app, user_alice, monkeypatch):
+    monkeypatch.setenv('TASKAFARIAN_AUTH_TOKEN_MODE', 'jwt')
+
+    response = app.http.get(path=url_user_me, headers={'Authorization': f'Bearer {user_alice.token}'})
+    assert response.status_code == 200
+
+    response = app.http.delete(path=url_log_out, headers={'Authorization': f'Bearer {user_alice.token}'})
+    assert response.status_code == 200
+
+    response = app.http.get(path=url_user_me, headers={'Authorization': f'Bearer {user_alice.token}'})
+    assert response.status_code == 401
+
+
+def test_invalid_access_tokens_are_rejected(app, monkeypatch):
+    token = log_in_with_access_token(app, monkeypatch)
+    claims = jwt.decode(token, verify=False)
+
+    expired = jwt.encode({**claims, 'exp': datetime.now(timezone.utc) - timedelta(seconds=1)},
+                         os.getenv('TASKAFARIAN_SECRET_KEY'), algorithm='HS256').decode('utf-8')
+    tampered = jwt.encode({**claims, 'sub': 2}, 'not the secret key', algorithm='HS256').decode('utf-8')
+    activation = auth.create_activation_token(1).decode('utf-8')
+
+    for invalid_token in (expired, tampered, activation):
+        response = app.http.get(path=url_user_me, headers={'Authorization': f'Bearer {invalid_token}'})
+        assert response.status_code == 401
+
+
+# refresh tokens
+url_refresh = '/auth/refresh'
+
+
+def log_in(app):
+    response = app.http.post(path=url_log_in, json={'username': 'alice', 'password': '12345678'})
+    assert response.status_code == 200
+    return response.json_body
+
+
+def test_refresh_rotates_tokens_without_checking_the_password(app, monkeypatch):
+    tokens = log_in(app)
+    assert tokens['refreshToken'] and tokens['refreshTokenExpiresAt']
+
+    def check_password(*args, **kwargs):
+        raise AssertionError('the password should not be checked')
+    monkeypatch.setattr('chalicelib.services.auth.check_password', check_password)
+
+    response = app.http.post(path=url_refresh, json={'refreshToken': tokens['refreshToken']})
+    assert response.status_code == 200
+    new_tokens = response.json_body
+    assert new_tokens['token'] != tokens['token']
+    assert new_tokens['refreshToken'] != tokens['refreshToken']
+    assert new_tokens['refreshTokenExpiresAt'] >= tokens['refreshTokenExpiresAt']
+
+    response = app.http.get(path=url_user_me, headers={'Authorization': f'Bearer {new_tokens["token"]}'})
+    assert response.status_code == 200
+
+    response = app.http.post(path=url_refresh, json={'refreshToken': new_tokens['refreshToken']})
+    assert response.status_code == 200
+
+
+def test_refresh_issues_access_tokens_in_jwt_mode(app, monkeypatch):
+    monkeypatch.setenv('TASKAFARIAN_AUTH_TOKEN_MODE', 'jwt')
+    tokens = log_in(app)
+
+    response = app.http.post(path=url_refresh, json={'refreshToken': tokens['refreshToken']})
+    assert response.status_code == 200
+    assert auth.is_access_token(response.json_body['token'])
+
+    response = app.http.get(path=url_user_me, headers={'Authorization': f'Bearer {response.json_body["token"]}'})
+    assert response.status_code == 200
+    assert response.json_body['username'] == 'alice'
+
+
+def test_reused_refresh_token_revokes_the_family(app, db):
+    tokens = log_in(app)
+    other_session = log_in(app)
+
+    response = app.http.post(path=url_refresh, json={'refreshToken': tokens['refreshToken']})
+    assert response.status_code == 200
+    new_tokens = response.json_body
+
+    # the old refresh token is presented again, e.g by somebody who stole it
+    response = app.http.post(path=url_refresh, json={'refreshToken': tokens['refreshToken']})
+    assert response.status_code == 401
+
+    # the legitimate client can not refresh anymore either
+    response = app.http.post(path=url_refresh, json={'refreshToken': new_tokens['refreshToken']})
+    assert response.status_code == 401
+
+    # other log-ins are not affected
+    response = app.http.post(path=url_refresh, json={'refreshToken': other_session['refreshToken']})
+    assert response.status_code == 200
+
+
+def test_invalid_or_expired_refresh_token_is_rejected(app, db):
+    tokens = log_in(app)
+
+    response = app.http.post(path=url_refresh, json={'refreshToken': 'not a refresh token'})
+    assert response.status_code == 401
+
+    response = app.http.post(path=url_refresh, json={})
+    assert response.status_code == 422
+
+    with db.cursor() as cursor:
+        cursor.execute('''UPDATE refresh_token SET expires_at = now() - interval '1 second';''')
+        db.commit()
+    response = app.http.post(path=url_refresh, json={'refreshToken': tokens['refreshToken']})
+    assert response.status_code == 401
+
+
+def test_log_out_revokes_refresh_token(app):
+    tokens = log_in(app)
+
+    response = app.http.delete(
+        path=url_log_out,
+        headers={'Authorization': f'Bearer {tokens["token"]}'},
+        json={'refreshToken': tokens['refreshToken']}
+    )
+    assert response.status_code == 200
+
+    response = app.http.post(path=url_refresh, json={'refreshToken': tokens['refreshToken']})
+    assert response.status_code == 401
+
+
 # password reset
 def test_reset_password(app, monkeypatch):
     reset_token = ''
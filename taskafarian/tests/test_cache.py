@@ -0,0 +1,55 @@
+from chalicelib.core import cache as cache_module
+from chalicelib.core.cache import TTLCache
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLCache(max_size=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+    assert cache.stats()['evictions'] == 1
+
+
+def test_entries_expire(monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr(cache_module.time, 'monotonic', lambda: now)
+
+    cache = TTLCache(ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2, ttl=10)
+    cache.set('c', 3, ttl=600)  # capped by the ttl of the cache
+    cache.set('d', 4, ttl=-1)  # already expired, not stored
+
+    now += 30
+    assert (cache.get('a'), cache.get('b'), cache.get('c'), cache.get('d')) == (1, None, 3, None)
+
+    now += 31
+    assert cache.get('c') is None
+    assert cache.stats()['expirations'] == 2
+    assert len(cache) == 1
+
+
+def test_invalidation_and_counters():
+    cache = TTLCache()
+    cache.set('a', {'user_id': 1})
+    cache.set('b', {'user_id': 1})
+    cache.set('c', {'user_id': 2})
+
+    cache.invalidate('a')
+    cache.invalidate('does not exist')
+    cache.invalidate_where(lambda user: user['user_id'] == 1)
+
+    assert (cache.get('a'), cache.get('b'), cache.get('c')) == (None, None, {'user_id': 2})
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['invalidations']) == (1, 2, 2)
+    assert stats['hit_ratio'] == 1 / 3
+
+
+def test_disabled_cache_stores_nothing():
+    cache = TTLCache(ttl=0)
+    cache.set('a', 1)
+    assert cache.get('a') is None
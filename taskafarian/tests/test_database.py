@@ -0,0 +1,234 @@
+import threading
+import time
+
+import pytest
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+from chalicelib.core import database
+from chalicelib.core.database import connect
+from chalicelib.core.pool import ConnectionPool, PoolTimeout
+from chalicelib.core.prepared import PreparedStatement
+
+url_health = '/health'
+
+
+def idle_connections():
+    return list(database.get_pool()._idle)
+
+
+def test_connection_is_reused_between_requests(app):
+    response = app.http.get(path=url_health)
+    assert response.status_code == 200
+    [connection] = idle_connections()
+
+    response = app.http.get(path=url_health)
+    assert response.status_code == 200
+    assert idle_connections() == [connection]
+    assert not connection.closed
+    assert connection.uses == 2
+
+
+def test_connection_is_closed_after_request_if_keep_alive_is_disabled(app, monkeypatch):
+    monkeypatch.setenv('TASKAFARIAN_DB_KEEP_ALIVE', 'False')
+
+    response = app.http.get(path=url_health)
+    assert response.status_code == 200
+    assert idle_connections() == []
+    assert database.get_pool().stats()['size'] == 0
+
+
+def test_connection_is_recycled_after_max_uses(app, monkeypatch):
+    monkeypatch.setenv('TASKAFARIAN_DB_CONNECTION_MAX_USES', '2')
+
+    app.http.get(path=url_health)
+    [connection] = idle_connections()
+
+    app.http.get(path=url_health)
+    assert connection.closed
+    assert idle_connections() == []
+
+
+def test_connection_dropped_by_the_server_is_replaced(app, db, monkeypatch):
+    monkeypatch.setenv('TASKAFARIAN_DB_CONNECTION_PING_AFTER', '0')
+
+    app.http.get(path=url_health)
+    [connection] = idle_connections()
+
+    with db.cursor() as cursor:
+        cursor.execute('SELECT pg_terminate_backend(%s);', (connection.get_backend_pid(),))
+        db.commit()
+
+    response = app.http.get(path=url_health)
+    assert response.status_code == 200
+    assert connection not in idle_connections()
+
+
+def test_transaction_left_open_is_rolled_back_on_release(app, db):
+    connection = database.get_db()
+    with connection.cursor() as cursor:
+        cursor.execute('''UPDATE app_user SET first_name = 'Mallory' WHERE username = 'alice';''')
+
+    database.release_db()
+    assert connection.info.transaction_status == TRANSACTION_STATUS_IDLE
+
+    with db.cursor() as cursor:
+        cursor.execute('''SELECT first_name FROM app_user WHERE username = 'alice';''')
+        assert cursor.fetchone().first_name == 'Alice'
+        db.commit()
+
+
+# pool
+def test_each_thread_gets_its_own_connection(app):
+    connections = []
+
+    def request():
+        connections.append(database.get_db())
+        barrier.wait()
+        database.release_db()
+
+    barrier = threading.Barrier(3)
+    threads = [threading.Thread(target=request) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(set(connections)) == 3
+    stats = database.get_pool().stats()
+    assert stats['idle'] == 3
+    assert stats['in_use'] == 0
+    assert stats['peak_in_use'] == 3
+
+
+def test_checkout_times_out_when_pool_is_exhausted(app):
+    pool = ConnectionPool(connect, max_size=1, timeout=0.1)
+    connection = pool.checkout()
+
+    with pytest.raises(PoolTimeout):
+        pool.checkout()
+
+    pool.checkin(connection)
+    assert pool.checkout() is connection
+    assert pool.stats()['timeouts'] == 1
+
+    pool.discard(connection)
+
+
+def test_waiting_checkout_gets_returned_connection(app):
+    pool = ConnectionPool(connect, max_size=1, timeout=5)
+    connection = pool.checkout()
+    checked_out = []
+
+    thread = threading.Thread(target=lambda: checked_out.append(pool.checkout()))
+    thread.start()
+    time.sleep(0.1)
+    pool.checkin(connection)
+    thread.join()
+
+    assert checked_out == [connection]
+    stats = pool.stats()
+    assert stats['waits'] == 1
+    assert stats['wait_time_total_ms'] > 0
+
+    pool.discard(connection)
+
+
+def test_overflow_connections_are_closed_when_returned(app):
+    pool = ConnectionPool(connect, min_size=1, max_size=1, max_overflow=1)
+    assert pool.stats()['size'] == 1
+
+    first = pool.checkout()
+    second = pool.checkout()
+    assert pool.stats()['overflow'] == 1
+
+    pool.checkin(second)
+    pool.checkin(first)
+    assert second.closed
+    assert not first.closed
+    assert pool.stats() == {**pool.stats(), 'size': 1, 'idle': 1, 'overflow': 0, 'peak_overflow': 1}
+
+    pool.close()
+    assert first.closed
+
+
+# prepared statements
+def test_prepared_statement_placeholders_are_positional():
+    statement = PreparedStatement('test_statement', '''
+    SELECT * FROM task WHERE created_by = %(user_id)s OR assignee_id = %(user_id)s AND name LIKE 'a%%' LIMIT %(limit)s;
+    ''')
+
+    assert statement.prepare_sql == (
+        "PREPARE test_statement AS "
+        "SELECT * FROM task WHERE created_by = $1 OR assignee_id = $1 AND name LIKE 'a%' LIMIT $2;"
+    )
+    assert statement.execute_sql == 'EXECUTE test_statement (%(user_id)s, %(limit)s);'
+
+
+def test_hot_queries_are_prepared_once_per_connection(app, user_alice):
+    for _ in range(2):
+        response = app.http.get(path='/task', headers={'Authorization': f'Bearer {user_alice.token}'})
+        assert response.status_code == 200
+
+    connection = database.get_db()
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT name FROM pg_prepared_statements;')
+        assert {row.name for row in cursor.fetchall()} == {'get_user_by_token', 'fetch_many_tasks',
+                                                           'fetch_time_entries_of_tasks'}
+    assert connection.prepared_statements == {'get_user_by_token', 'fetch_many_tasks', 'fetch_time_entries_of_tasks'}
+    database.release_db()
+
+
+def test_statement_is_prepared_again_if_it_was_discarded(app, user_alice):
+    response = app.http.get(path='/task/1', headers={'Authorization': f'Bearer {user_alice.token}'})
+    assert response.status_code == 200
+
+    connection = database.get_db()
+    connection.autocommit = True
+    with connection.cursor() as cursor:
+        cursor.execute('DISCARD ALL;')
+    connection.autocommit = False
+    database.release_db()
+
+    response = app.http.get(path='/task/1', headers={'Authorization': f'Bearer {user_alice.token}'})
+    assert response.status_code == 200
+
+
+def test_prepared_statements_can_be_disabled(app, user_alice, monkeypatch):
+    monkeypatch.setenv('TASKAFARIAN_DB_PREPARED_STATEMENTS', 'False')
+    database.close_db()
+
+    response = app.http.get(path='/task', headers={'Authorization': f'Bearer {user_alice.token}'})
+    assert response.status_code == 200
+
+    connection = database.get_db()
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT count(*) FROM pg_prepared_statements;')
+        assert cursor.fetchone().count == 0
+    database.release_db()
+
+
+# rows
+def test_row_classes_are_cached_by_column_signature(app):
+    connection = database.get_db()
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1 AS a, 2 AS b;')
+        first = cursor.fetchone()
+        cursor.execute('SELECT 3 AS a, 4 AS b;')
+        second = cursor.fetchone()
+
+    assert type(first) is type(second)
+    assert first.a == 1 and first['b'] == 2 and first[1] == 2
+    assert tuple(second) == (3, 4) == second
+    assert second._asdict() == {'a': 3, 'b': 4}
+    database.release_db()
+
+
+def test_row_field_names_are_sanitized(app):
+    connection = database.get_db()
+    with connection.cursor() as cursor:
+        cursor.execute('''SELECT 1 AS "from", 2 AS "1st", 3 AS "some column", 4 AS a, 5 AS a;''')
+        row = cursor.fetchone()
+
+    assert row._fields == ('from_', 'f1st', 'some_column', 'a', 'a_')
+    assert not hasattr(row, '__dict__')
+    database.release_db()
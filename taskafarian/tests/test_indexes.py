@@ -0,0 +1,182 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from chalicelib.services.auth import (get_user_by_token_statement,
+                                      hash_refresh_token,
+                                      rotate_refresh_token_statement)
+from chalicelib.services.task import (autocomplete_statement,
+                                      fetch_many_after_statement,
+                                      fetch_many_statement, fetch_statement,
+                                      get_fetch_many_statement,
+                                      search_after_statement, search_statement)
+from chalicelib.services.time_entry import fetch_of_tasks_statement
+from tests.conftest import load_fixture
+
+
+@pytest.fixture
+def large_dataset(app):
+    load_fixture('large.sql')
+
+
+def explain(db, query, params):
+    with db.cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + query, params)
+        [plan] = cursor.fetchone()[0]
+        db.rollback()
+    return plan['Plan']
+
+
+def used_indexes(node):
+    indexes = {node['Index Name']} if 'Index Name' in node else set()
+    for child in node.get('Plans', []):
+        indexes |= used_indexes(child)
+    return indexes
+
+
+def plan_node_types(node):
+    node_types = {node['Node Type']}
+    for child in node.get('Plans', []):
+        node_types |= plan_node_types(child)
+    return node_types
+
+
+def find_nodes(node, node_type):
+    nodes = [node] if node['Node Type'] == node_type else []
+    for child in node.get('Plans', []):
+        nodes += find_nodes(child, node_type)
+    return nodes
+
+
+def scanned_tables(node):
+    tables = {node['Relation Name']} if node['Node Type'] == 'Seq Scan' else set()
+    for child in node.get('Plans', []):
+        tables |= scanned_tables(child)
+    return tables
+
+
+def test_user_is_found_by_token_using_index(large_dataset, db, user_alice):
+    plan = explain(db, get_user_by_token_statement.query, {
+        'token': user_alice.token,
+        'expires_at': datetime.now(timezone.utc) + timedelta(minutes=1)
+    })
+
+    assert 'token_token_key' in used_indexes(plan)
+    assert 'token' not in scanned_tables(plan)
+
+
+def test_refresh_token_is_found_using_index(large_dataset, db):
+    plan = explain(db, rotate_refresh_token_statement.query, {'token_hash': hash_refresh_token('token')})
+
+    assert 'refresh_token_token_hash_key' in used_indexes(plan)
+    assert 'refresh_token' not in scanned_tables(plan)
+
+
+def test_expired_tokens_are_found_using_index(large_dataset, db):
+    plan = explain(db, '''
+    SELECT user_id, token
+    FROM token
+    WHERE expires_at < now()
+    LIMIT %(batch_size)s
+    ''', {'batch_size': 1000})
+
+    assert 'token_expires_at_idx' in used_indexes(plan)
+    assert 'token' not in scanned_tables(plan)
+
+
+def test_task_list_uses_indexes(large_dataset, db, user_alice):
+    plan = explain(db, fetch_many_statement.query, {'user_id': user_alice.user_id, 'limit': 21})
+
+    assert 'task_created_by_created_at_task_id_idx' in used_indexes(plan)
+    assert 'task' not in scanned_tables(plan)
+
+
+def test_time_entries_of_a_task_page_are_read_from_the_index(large_dataset, db):
+    plan = explain(db, fetch_of_tasks_statement.query, {'task_ids': list(range(1, 21)), 'limit': 10})
+
+    assert 'task_time_entry_task_id_start_datetime_idx' in used_indexes(plan)
+    assert 'task_time_entry' not in scanned_tables(plan)
+
+
+def test_next_task_page_continues_from_the_index(large_dataset, db, user_alice):
+    plan = explain(db, fetch_many_after_statement.query, {
+        'user_id': user_alice.user_id,
+        'sort_value': datetime.now(timezone.utc) - timedelta(days=1),
+        'task_id': 1000,
+        'limit': 21
+    })
+
+    assert 'task_created_by_created_at_task_id_idx' in used_indexes(plan)
+    assert not {'task', 'task_time_entry'} & scanned_tables(plan)
+    # the cursor is an index condition, no sort of the user's tasks
+    assert 'Sort' not in plan_node_types(plan)
+
+
+@pytest.mark.parametrize('filters, order_by, index', [
+    ({'single_status': 'todo'}, '-created_at', 'task_created_by_status_created_at_task_id_idx'),
+    ({'assignee_id': 10}, '-created_at', 'task_created_by_assignee_id_created_at_task_id_idx'),
+    ({}, 'due_date', 'task_created_by_due_date_task_id_idx'),
+    ({}, '-due_date', 'task_created_by_due_date_task_id_idx'),
+    ({'created_at_gt': datetime(2020, 1, 1, tzinfo=timezone.utc)}, 'created_at', 'task_created_by_created_at_task_id_idx'),
+])
+def test_filtered_task_list_uses_indexes(large_dataset, db, user_alice, filters, order_by, index):
+    for after in (False, True):
+        statement = get_fetch_many_statement(tuple(filters), order_by, after)
+        plan = explain(db, statement.query, {
+            **filters,
+            'user_id': user_alice.user_id,
+            'sort_value': datetime.now(timezone.utc),
+            'task_id': 1000,
+            'limit': 21
+        })
+
+        assert index in used_indexes(plan)
+        assert not {'task', 'task_time_entry'} & scanned_tables(plan)
+        # the page is read in order, only the page itself may be sorted afterwards
+        [page] = find_nodes(plan, 'Limit')
+        assert 'Sort' not in plan_node_types(page)
+
+
+def test_task_search_uses_gin_index(large_dataset, db, user_alice):
+    for statement in (search_statement, search_after_statement):
+        plan = explain(db, statement.query, {
+            'query': '1234',
+            'user_id': user_alice.user_id,
+            'team_ids': [1],
+            'rank': 1.0,
+            'task_id': 1000,
+            'limit': 21
+        })
+
+        assert 'task_search_vector_idx' in used_indexes(plan)
+        assert 'task' not in scanned_tables(plan)
+
+
+def test_task_autocomplete_reads_the_closest_names_from_the_index(trigram_indexes, large_dataset, db, user_alice):
+    plan = explain(db, autocomplete_statement.query, {
+        'query': '1234',
+        'user_id': user_alice.user_id,
+        'team_ids': [1],
+        'limit': 10
+    })
+
+    assert {'task_created_by_name_trgm_idx', 'task_team_id_name_trgm_idx'} <= used_indexes(plan)
+    assert 'task' not in scanned_tables(plan)
+    for node in find_nodes(plan, 'Index Scan'):
+        if node['Index Name'] == 'task_created_by_name_trgm_idx':
+            assert 'created_by' in node['Index Cond']
+        if node['Index Name'] == 'task_team_id_name_trgm_idx':
+            assert 'team_id' in node['Index Cond']
+
+
+def test_task_is_fetched_using_index(large_dataset, db, user_alice):
+    plan = explain(db, fetch_statement.query, {'user_id': user_alice.user_id, 'task_id': 1, 'team_ids': [1]})
+
+    assert 'task_pkey' in used_indexes(plan)
+    assert 'task' not in scanned_tables(plan)
+
+
+def test_log_out_uses_index(large_dataset, db, user_alice):
+    plan = explain(db, 'DELETE FROM token WHERE token = %(token)s', {'token': user_alice.token})
+
+    assert 'token_token_key' in used_indexes(plan)
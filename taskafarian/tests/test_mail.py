@@ -0,0 +1,181 @@
+import socket
+
+import pytest
+
+from chalicelib.core.database import connect, release_db
+from chalicelib.core.shared import g
+from chalicelib.services import mail
+from tests.smtp_server import SMTPServer
+
+url_registration = '/auth/register'
+url_request_password_reset = '/auth/password/request-reset'
+url_activate = '/auth/activate'
+url_log_in = '/auth/log-in'
+
+
+@pytest.fixture
+def smtp_server(monkeypatch):
+    server = SMTPServer()
+    server.start()
+    monkeypatch.setenv('TASKAFARIAN_SMTP_HOST', '127.0.0.1')
+    monkeypatch.setenv('TASKAFARIAN_SMTP_PORT', str(server.port))
+    yield server
+    server.stop()
+
+
+def invoke_delivery(app):
+    return app.lambda_.invoke('deliver_emails', app.events.generate_cw_event(
+        source='aws.events', detail_type='Scheduled Event', detail={}, resources=[]
+    )).payload
+
+
+def deliver_emails(**kwargs):
+    try:
+        return mail.deliver_emails(**kwargs)
+    finally:
+        release_db()
+        g.clear()
+
+
+def get_outbox(db):
+    with db.cursor() as cursor:
+        cursor.execute('''
+        SELECT email_id, template, recipient, context, status, attempts, last_error,
+               next_attempt_at - now() AS retry_in
+        FROM email_outbox
+        ORDER BY email_id
+        ;
+        ''')
+        db.commit()
+        return cursor.fetchall()
+
+
+def register(app, username):
+    return app.http.post(path=url_registration, json={
+        'username': username,
+        'email': '{}@{}.com'.format(username, username),
+        'password': '12345678'
+    })
+
+
+def test_registration_adds_activation_email_to_outbox(app, db, smtp_server):
+    response = register(app, 'luna')
+    assert response.status_code == 201
+
+    # nothing is sent on the request path
+    assert smtp_server.messages == []
+
+    outbox = get_outbox(db)
+    assert len(outbox) == 1
+    assert outbox[0].template == 'user_activation'
+    assert outbox[0].recipient == 'luna@luna.com'
+    assert outbox[0].status == 'pending'
+    assert outbox[0].context['token']
+
+
+def test_failed_registration_leaves_no_email_behind(app, db, smtp_server):
+    response = app.http.post(path=url_registration, json={
+        'username': 'alice',
+        'email': 'luna@luna.com',
+        'password': '12345678'
+    })
+    assert response.status_code == 422
+    assert get_outbox(db) == []
+
+
+def test_scheduled_delivery_sends_activation_and_password_reset(app, db, smtp_server):
+    register(app, 'luna')
+    response = app.http.post(path=url_request_password_reset, json={'email': 'alice@alice.com'})
+    assert response.status_code == 200
+
+    result = invoke_delivery(app)
+    assert result['sent'] == 2
+    assert result['retried'] == result['failed'] == 0
+    assert result['completed'] is True
+
+    (recipients, activation), (_, reset) = smtp_server.messages
+    assert recipients == ['luna@luna.com']
+    assert activation['Subject'] == 'Activate your taskafarian account'
+    assert reset['To'] == 'alice@alice.com'
+    assert [email.status for email in get_outbox(db)] == ['sent', 'sent']
+
+    # the emailed token activates the account
+    token = activation.get_content().strip().splitlines()[-1]
+    assert app.http.post(path=url_activate, json={'token': token}).status_code == 200
+    response = app.http.post(path=url_log_in, json={'username': 'luna', 'password': '12345678'})
+    assert response.status_code == 200
+
+    # sent emails are not sent again
+    assert invoke_delivery(app)['sent'] == 0
+    assert len(smtp_server.messages) == 2
+
+
+def test_failed_email_is_retried_with_backoff(app, db, smtp_server):
+    register(app, 'luna')
+    register(app, 'nova')
+    smtp_server.rejected_recipients.add('luna@luna.com')
+
+    result = deliver_emails(retry_backoff=30, max_attempts=2)
+    assert (result['sent'], result['retried'], result['failed']) == (1, 1, 0)
+
+    luna, nova = get_outbox(db)
+    assert nova.status == 'sent'
+    assert luna.status == 'pending'
+    assert luna.attempts == 1
+    assert 'SMTPRecipientsRefused' in luna.last_error
+    assert 25 < luna.retry_in.total_seconds() <= 30
+
+    # not due yet
+    assert deliver_emails()['batches'] == 0
+
+    with db.cursor() as cursor:
+        cursor.execute('''UPDATE email_outbox SET next_attempt_at = now() WHERE email_id = %s;''', (luna.email_id,))
+        db.commit()
+
+    result = deliver_emails(retry_backoff=30, max_attempts=2)
+    assert (result['sent'], result['retried'], result['failed']) == (0, 0, 1)
+    assert get_outbox(db)[0].status == 'failed'
+    assert len(smtp_server.messages) == 1
+
+
+def test_unreachable_smtp_server_retries_every_email(app, db, monkeypatch):
+    register(app, 'luna')
+    register(app, 'nova')
+
+    # a port nobody listens on
+    with socket.socket() as free_socket:
+        free_socket.bind(('127.0.0.1', 0))
+        port = free_socket.getsockname()[1]
+    monkeypatch.setenv('TASKAFARIAN_SMTP_HOST', '127.0.0.1')
+    monkeypatch.setenv('TASKAFARIAN_SMTP_PORT', str(port))
+
+    result = deliver_emails()
+    assert (result['sent'], result['retried'], result['failed']) == (0, 2, 0)
+    assert [email.attempts for email in get_outbox(db)] == [1, 1]
+
+
+def test_delivery_skips_emails_claimed_by_another_worker(app, db, smtp_server):
+    register(app, 'luna')
+    register(app, 'nova')
+
+    other_worker = connect()
+    with other_worker.cursor() as cursor:
+        cursor.execute('''SELECT * FROM email_outbox WHERE recipient = 'luna@luna.com' FOR UPDATE;''')
+
+        result = deliver_emails()
+        assert result['sent'] == 1
+        assert smtp_server.messages[0][0] == ['nova@nova.com']
+        other_worker.rollback()
+    other_worker.close()
+
+    assert deliver_emails()['sent'] == 1
+    assert len(smtp_server.messages) == 2
+
+
+def test_delivery_stops_when_time_budget_is_spent(app, db, smtp_server):
+    register(app, 'luna')
+
+    result = deliver_emails(time_budget=0)
+    assert result['completed'] is False
+    assert result['sent'] == 0
+    assert smtp_server.messages == []
@@ -0,0 +1,76 @@
+import pytest
+
+from chalicelib.core.database import connect
+from chalicelib.services import auth
+
+
+@pytest.fixture
+def expired_tokens(app, db):
+    with db.cursor() as cursor:
+        cursor.execute('''
+        INSERT INTO token (user_id, token, expires_at)
+        SELECT 1, 'expired' || i, now() - i * interval '1 minute'
+        FROM generate_series(1, 25) AS i
+        ;
+
+        INSERT INTO revoked_token (jti, user_id, expires_at)
+        VALUES ('expired', 1, now() - interval '1 minute'), ('valid', 1, now() + interval '1 minute')
+        ;
+
+        INSERT INTO refresh_token (user_id, token_hash, family_id, expires_at)
+        VALUES (1, 'expired', 'family', now() - interval '1 minute'), (1, 'valid', 'family', now() + interval '1 day')
+        ;
+        ''')
+        cursor.execute('SELECT count(*) FROM token WHERE expires_at < now();')
+        count = cursor.fetchone().count
+        db.commit()
+    return count
+
+
+def count_expired(db):
+    with db.cursor() as cursor:
+        cursor.execute('''
+        SELECT (SELECT count(*) FROM token WHERE expires_at < now()) AS token,
+               (SELECT count(*) FROM revoked_token WHERE expires_at < now()) AS revoked_token,
+               (SELECT count(*) FROM refresh_token WHERE expires_at < now()) AS refresh_token,
+               (SELECT count(*) FROM token WHERE expires_at >= now()) AS valid_token
+        ;
+        ''')
+        db.commit()
+        return cursor.fetchone()
+
+
+def test_scheduled_purge_deletes_expired_tokens_in_batches(app, db, expired_tokens, monkeypatch):
+    monkeypatch.setenv('TASKAFARIAN_PURGE_BATCH_SIZE', '10')
+    valid_tokens = count_expired(db).valid_token
+
+    response = app.lambda_.invoke('purge_expired_tokens', app.events.generate_cw_event(
+        source='aws.events', detail_type='Scheduled Event', detail={}, resources=[]
+    ))
+
+    assert response.payload['deleted'] == {'token': expired_tokens, 'revoked_token': 1, 'refresh_token': 1}
+    assert response.payload['batches'] == expired_tokens // 10 + 1 + 1 + 1
+    assert response.payload['completed'] is True
+    assert response.payload['execution_time_ms'] > 0
+    assert count_expired(db) == (0, 0, 0, valid_tokens)
+
+
+def test_purge_skips_locked_rows(app, db, expired_tokens):
+    other_transaction = connect()
+    with other_transaction.cursor() as cursor:
+        cursor.execute('''SELECT * FROM token WHERE token = 'expired1' FOR UPDATE;''')
+
+        result = auth.purge_expired_tokens(batch_size=10)
+        assert result['deleted']['token'] == expired_tokens - 1
+        other_transaction.rollback()
+    other_transaction.close()
+
+    assert count_expired(db).token == 1
+
+
+def test_purge_stops_when_time_budget_is_spent(app, db, expired_tokens):
+    result = auth.purge_expired_tokens(time_budget=0)
+
+    assert result['completed'] is False
+    assert result['deleted'] == {'token': 0, 'revoked_token': 0, 'refresh_token': 0}
+    assert count_expired(db).token == expired_tokens
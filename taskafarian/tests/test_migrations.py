@@ -0,0 +1,178 @@
+import threading
+
+import pytest
+
+from chalicelib.core.migrations import MigrationError, load_migrations, migrate
+
+
+def write_migration(directory, file_name, sql):
+    (directory / file_name).write_text(sql)
+
+
+def applied_migrations(db):
+    with db.cursor() as cursor:
+        cursor.execute('SELECT version, name FROM schema_migration ORDER BY version;')
+        db.commit()
+        return [(row.version, row.name) for row in cursor.fetchall()]
+
+
+def available_extensions(db):
+    with db.cursor() as cursor:
+        cursor.execute('SELECT name FROM pg_available_extensions;')
+        db.commit()
+        return {row.name for row in cursor.fetchall()}
+
+
+def test_all_migrations_are_applied(app, db):
+    extensions = available_extensions(db)
+    assert applied_migrations(db) == [
+        (migration.version, migration.name) for migration in load_migrations()
+        if set(migration.required_extensions) <= extensions
+    ]
+    assert migrate() == []
+
+
+def test_no_transaction_migration_builds_indexes_concurrently(app, db, tmp_path):
+    write_migration(tmp_path, '9001_concurrent_index.sql', '''-- migrate: no-transaction
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS task_name_idx ON task (name);
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS task_status_idx ON task (status);
+    ''')
+
+    [migration] = migrate(tmp_path)
+    assert not migration.is_transactional
+    assert (9001, 'concurrent_index') in applied_migrations(db)
+
+    with db.cursor() as cursor:
+        cursor.execute('''
+        SELECT count(*)
+        FROM pg_indexes
+        WHERE indexname IN ('task_name_idx', 'task_status_idx')
+        ;
+        ''')
+        assert cursor.fetchone().count == 2
+        db.commit()
+
+
+def test_no_transaction_migration_runs_function_bodies_and_batches(app, db, tmp_path):
+    # the statements of the bodies end lines with ';' too, the DO block commits every batch
+    write_migration(tmp_path, '9001_backfill.sql', '''-- migrate: no-transaction
+    ALTER TABLE task ADD COLUMN IF NOT EXISTS name_length int;
+
+    CREATE OR REPLACE FUNCTION task_name_length(name text) RETURNS int
+    LANGUAGE plpgsql IMMUTABLE AS $$
+    BEGIN
+        RETURN length(name);
+    END
+    $$;
+
+    DO $$
+    DECLARE
+        last_task_id bigint := 0;
+    BEGIN
+        WHILE last_task_id < (SELECT max(task_id) FROM task) LOOP
+            UPDATE task
+            SET name_length = task_name_length(name)
+            WHERE task_id > last_task_id AND task_id <= last_task_id + 2;
+            last_task_id := last_task_id + 2;
+            COMMIT;
+        END LOOP;
+    END
+    $$;
+    ''')
+
+    [migration] = migrate(tmp_path)
+    assert len(migration.statements()) == 3
+    assert (9001, 'backfill') in applied_migrations(db)
+
+    with db.cursor() as cursor:
+        cursor.execute('''SELECT count(*) FROM task WHERE name_length IS DISTINCT FROM length(name);''')
+        assert cursor.fetchone().count == 0
+        db.commit()
+
+
+def test_migration_waits_for_its_extensions(app, db, tmp_path):
+    write_migration(tmp_path, '9001_needs_extension.sql', '''-- migrate: no-transaction
+    -- migrate: requires-extensions plpgsql, no_such_extension
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS task_name_idx ON task (name);
+    ''')
+    write_migration(tmp_path, '9002_next.sql', '''
+    CREATE TABLE applied_next (id int);
+    ''')
+
+    # the other migrations are applied, this one again and again until the extension is available
+    assert [migration.name for migration in migrate(tmp_path)] == ['next']
+    assert migrate(tmp_path) == []
+    assert (9001, 'needs_extension') not in applied_migrations(db)
+    assert load_migrations(tmp_path)[0].required_extensions == ['plpgsql', 'no_such_extension']
+
+
+def test_failed_transactional_migration_is_rolled_back(app, db, tmp_path):
+    write_migration(tmp_path, '9001_broken.sql', '''
+    CREATE TABLE tmp_table (id int);
+    SELECT * FROM table_that_does_not_exist;
+    ''')
+
+    with pytest.raises(MigrationError):
+        migrate(tmp_path)
+
+    assert (9001, 'broken') not in applied_migrations(db)
+    with db.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('tmp_table') AS regclass;")
+        assert cursor.fetchone().regclass is None
+        db.commit()
+
+
+def test_failed_concurrent_index_can_be_retried(app, db, tmp_path):
+    # two tasks with the same name: the unique index can not be built
+    write_migration(tmp_path, '9001_unique_task_name.sql', '''-- migrate: no-transaction
+    CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS task_name_key ON task (name);
+    ''')
+    with db.cursor() as cursor:
+        cursor.execute('''UPDATE task SET name = 'duplicate' WHERE task_id IN (1, 2);''')
+        db.commit()
+
+    with pytest.raises(MigrationError):
+        migrate(tmp_path)
+    assert (9001, 'unique_task_name') not in applied_migrations(db)
+
+    with db.cursor() as cursor:
+        cursor.execute('''UPDATE task SET name = 'unique' WHERE task_id = 1;''')
+        db.commit()
+
+    migrate(tmp_path)
+    assert (9001, 'unique_task_name') in applied_migrations(db)
+
+    with db.cursor() as cursor:
+        cursor.execute('''
+        SELECT pg_index.indisvalid
+        FROM pg_index
+        WHERE pg_index.indexrelid = 'task_name_key'::regclass
+        ;
+        ''')
+        assert cursor.fetchone().indisvalid is True
+        db.commit()
+
+
+def test_concurrent_runs_apply_migration_once(app, db, tmp_path):
+    write_migration(tmp_path, '9001_slow.sql', '''
+    SELECT pg_sleep(0.3);
+    CREATE TABLE applied_once (id int);
+    ''')
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(migrate(tmp_path))) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(len(applied) for applied in results) == [0, 0, 1]
+    assert applied_migrations(db).count((9001, 'slow')) == 1
+
+
+def test_duplicate_versions_are_rejected(tmp_path):
+    write_migration(tmp_path, '0001_a.sql', 'SELECT 1;')
+    write_migration(tmp_path, '0001_b.sql', 'SELECT 1;')
+
+    with pytest.raises(MigrationError):
+        load_migrations(tmp_path)
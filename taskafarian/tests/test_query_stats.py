@@ -0,0 +1,61 @@
+import pytest
+
+from chalicelib.core import query_stats
+
+url_query_stats = '/debug/query-stats'
+
+
+@pytest.fixture
+def stats():
+    query_stats.reset()
+    query_stats.enable()
+    yield query_stats
+    query_stats.disable()
+    query_stats.reset()
+
+
+def test_fingerprint_ignores_literals_and_whitespace():
+    assert query_stats.normalize('''
+        SELECT *
+        FROM task   -- comment
+        WHERE task_id IN (1, 2, 3) AND name = 'it''s' AND created_by = %(user_id)s
+        LIMIT 20;
+    ''') == 'SELECT * FROM task WHERE task_id IN (...) AND name = ? AND created_by = ? LIMIT ?'
+
+
+def test_queries_are_grouped_by_fingerprint(app, stats, user_alice, user_bob):
+    for user in (user_alice, user_bob, user_alice):
+        response = app.http.get(path='/task', headers={'Authorization': f'Bearer {user.token}'})
+        assert response.status_code == 200
+
+    by_caller = {
+        caller: query for query in stats.get_stats() for caller in query['callers']
+    }
+    task_list = by_caller['chalicelib.services.task.fetch_many']
+    assert task_list['calls'] == 3
+    assert task_list['callers'] == {'chalicelib.services.task.fetch_many': 3}
+    assert sum(task_list['execution_time_ms']['buckets'].values()) == 3
+    assert task_list['rows']['total'] == 2 + 1 + 2  # alice created 2 tasks, bob 1
+    # the second request of alice is authenticated by the token cache
+    assert by_caller['chalicelib.services.auth.get_user_by_token']['calls'] == 2
+
+
+def test_nothing_is_recorded_when_disabled(app, user_alice):
+    query_stats.reset()
+    query_stats.disable()
+
+    app.http.get(path='/task', headers={'Authorization': f'Bearer {user_alice.token}'})
+    assert query_stats.get_stats() == []
+
+
+def test_query_stats_endpoint(app, stats):
+    app.http.get(path='/health')
+
+    response = app.http.get(path=url_query_stats)
+    assert response.status_code == 200
+    assert response.json_body['enabled'] is True
+    assert [query['fingerprint'] for query in response.json_body['queries']] == ['SELECT ?']
+
+    response = app.http.delete(path=url_query_stats)
+    assert response.status_code == 200
+    assert query_stats.get_stats() == []
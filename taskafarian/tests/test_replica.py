@@ -0,0 +1,122 @@
+import os
+
+import pytest
+
+from chalicelib.core import database
+from chalicelib.core.database import close_db, connect, create_db, drop_db
+from chalicelib.core.migrations import migrate
+from tests.conftest import load_fixture
+
+replica_name = 'test_taskafarian_replica'
+
+
+@pytest.fixture
+def replica(app, monkeypatch):
+    """Second database standing in for the replica.
+    There is no replication between them, so a row that differs tells which database served the request.
+    """
+    primary_name = os.environ['TASKAFARIAN_DB_NAME']
+    os.environ['TASKAFARIAN_DB_NAME'] = replica_name
+    try:
+        drop_db()
+        create_db()
+        migrate()
+        load_fixture('base.sql')
+    finally:
+        os.environ['TASKAFARIAN_DB_NAME'] = primary_name
+
+    connection = connect(db_name=replica_name)
+    with connection.cursor() as cursor:
+        cursor.execute('''UPDATE task SET name = 'served by the replica';''')
+        connection.commit()
+
+    monkeypatch.setenv('TASKAFARIAN_DB_REPLICA_NAME', replica_name)
+    yield connection
+
+    connection.close()
+    close_db()
+
+
+def task_names(app, user):
+    response = app.http.get(path='/task', headers={'Authorization': f'Bearer {user.token}'})
+    assert response.status_code == 200
+    return {task['name'] for task in response.json_body['entities']}
+
+
+def create_task(app, user, name):
+    response = app.http.post(
+        path='/task',
+        json={'name': name, 'status': 'todo'},
+        headers={'Authorization': f'Bearer {user.token}'}
+    )
+    assert response.status_code == 201
+    return response.json_body
+
+
+def test_reads_go_to_the_primary_without_replica(app, user_alice):
+    assert 'served by the replica' not in task_names(app, user_alice)
+
+
+def test_replica_safe_reads_go_to_the_replica(app, replica, user_alice):
+    assert task_names(app, user_alice) == {'served by the replica'}
+
+    response = app.http.get(path='/task/1', headers={'Authorization': f'Bearer {user_alice.token}'})
+    assert response.json_body['name'] == 'served by the replica'
+
+
+def test_writes_and_reads_after_a_write_go_to_the_primary(app, db, replica, user_alice):
+    new_task = create_task(app, user_alice, 'buy milk')
+    # create_task reads the new task back from the primary
+    assert new_task['name'] == 'buy milk'
+
+    with replica.cursor() as cursor:
+        cursor.execute('''SELECT count(*) FROM task WHERE name = 'buy milk';''')
+        assert cursor.fetchone().count == 0
+        replica.commit()
+
+    # no stickiness: the next read is served by the (lagging) replica
+    assert 'buy milk' not in task_names(app, user_alice)
+
+
+def test_reads_stick_to_the_primary_after_a_write(app, replica, user_alice, user_bob, monkeypatch):
+    monkeypatch.setenv('TASKAFARIAN_DB_REPLICA_STICKINESS', '60')
+
+    create_task(app, user_alice, 'buy milk')
+    assert 'buy milk' in task_names(app, user_alice)
+    # other users are still served by the replica
+    assert task_names(app, user_bob) == {'served by the replica'}
+
+    monkeypatch.setattr(database.time, 'monotonic', lambda: float('inf'))
+    assert 'buy milk' not in task_names(app, user_alice)
+
+
+def test_token_missing_on_the_replica_is_looked_up_on_the_primary(app, db, replica):
+    response = app.http.post(path='/auth/log-in', json={'username': 'alice', 'password': '12345678'})
+    assert response.status_code == 200
+    token = response.json_body['token']
+
+    response = app.http.get(path='/user/me', headers={'Authorization': f'Bearer {token}'})
+    assert response.status_code == 200
+    assert response.json_body['username'] == 'alice'
+
+
+def test_unavailable_replica_falls_back_to_the_primary(app, replica, user_alice, monkeypatch):
+    close_db()
+    monkeypatch.setenv('TASKAFARIAN_DB_REPLICA_NAME', 'database_that_does_not_exist')
+
+    assert 'served by the replica' not in task_names(app, user_alice)
+
+
+def test_replica_connections_are_read_only(app, replica, user_alice, monkeypatch):
+    from chalicelib.services import task
+    fetch_many = task.fetch_many
+    connections = []
+
+    def patched_fetch_many(*args, **kwargs):
+        connection = database.get_db(database.READ)
+        connections.append((connection.is_replica, connection.readonly))
+        return fetch_many(*args, **kwargs)
+    monkeypatch.setattr('chalicelib.services.task.fetch_many', patched_fetch_many)
+
+    task_names(app, user_alice)
+    assert connections == [(True, True)]
@@ -0,0 +1,122 @@
+import threading
+import time
+
+import pytest
+
+from chalicelib.core import security
+from chalicelib.core.security import (PasswordHasher, PasswordHasherBusy,
+                                      check_password, hash_password,
+                                      needs_rehash)
+
+
+@pytest.fixture
+def busy_hasher(monkeypatch):
+    """Hasher whose only worker is blocked and that has no queue
+    """
+    hasher = PasswordHasher(workers=1, queue_size=0, timeout=0)
+    release = threading.Event()
+    started = threading.Event()
+
+    def block():
+        started.set()
+        release.wait()
+
+    thread = threading.Thread(target=hasher.run, args=(block,))
+    thread.start()
+    started.wait()
+
+    monkeypatch.setattr(security, '_hasher', hasher)
+    yield hasher
+
+    release.set()
+    thread.join()
+    hasher.close()
+
+
+def test_password_is_hashed_with_configured_rounds(monkeypatch):
+    monkeypatch.setenv('TASKAFARIAN_PASSWORD_ROUNDS', '4')
+    password_hash = hash_password('12345678')
+
+    assert password_hash.startswith('$2b$04$')
+    assert check_password('12345678', password_hash)
+    assert not check_password('87654321', password_hash)
+    assert not needs_rehash(password_hash)
+
+    monkeypatch.setenv('TASKAFARIAN_PASSWORD_ROUNDS', '5')
+    assert needs_rehash(password_hash)
+
+
+def test_calls_beyond_the_queue_are_shed(busy_hasher):
+    with pytest.raises(PasswordHasherBusy):
+        busy_hasher.run(lambda: None)
+
+    stats = busy_hasher.stats()
+    assert (stats['calls'], stats['rejected'], stats['pending']) == (1, 1, 1)
+
+
+def test_calls_wait_in_the_queue():
+    hasher = PasswordHasher(workers=1, queue_size=4, timeout=0)
+    results = []
+    threads = [threading.Thread(target=lambda i=i: results.append(hasher.run(lambda: i))) for i in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(results) == [0, 1, 2, 3, 4]
+    assert hasher.stats()['rejected'] == 0
+    hasher.close()
+
+
+def test_password_is_rehashed_on_log_in_when_rounds_change(app, db, monkeypatch):
+    monkeypatch.setenv('TASKAFARIAN_PASSWORD_ROUNDS', '4')
+
+    for _ in range(2):
+        response = app.http.post(path='/auth/log-in', json={'username': 'alice', 'password': '12345678'})
+        assert response.status_code == 200
+
+    with db.cursor() as cursor:
+        cursor.execute('''SELECT password_hash FROM app_user WHERE username = 'alice';''')
+        assert cursor.fetchone().password_hash.startswith('$2b$04$')
+        db.commit()
+
+
+def test_log_in_is_rejected_when_the_hasher_is_busy(app, busy_hasher):
+    response = app.http.post(path='/auth/log-in', json={'username': 'alice', 'password': '12345678'})
+    assert response.status_code == 503
+
+
+def test_map_runs_a_batch_through_the_queue():
+    hasher = PasswordHasher(workers=2, queue_size=1, timeout=1)
+    assert hasher.map(lambda a, b: a * b, range(10), range(10)) == [i * i for i in range(10)]
+
+    stats = hasher.stats()
+    assert (stats['calls'], stats['rejected']) == (10, 0)
+    assert stats['peak_pending'] <= 2
+    hasher.close()
+
+
+def test_log_in_is_served_during_a_large_batch(app, monkeypatch):
+    hasher = PasswordHasher(workers=1, queue_size=1, timeout=0)
+    monkeypatch.setattr(security, '_hasher', hasher)
+    started = threading.Event()
+
+    def slow_hash(i):
+        started.set()
+        time.sleep(0.01)
+        return i
+
+    results = []
+    thread = threading.Thread(target=lambda: results.extend(hasher.map(slow_hash, range(200))))
+    thread.start()
+    started.wait()
+
+    for _ in range(3):
+        response = app.http.post(path='/auth/log-in', json={'username': 'alice', 'password': '12345678'})
+        assert response.status_code == 200
+    assert thread.is_alive()
+
+    thread.join()
+    assert results == list(range(200))
+    assert hasher.stats()['rejected'] == 0
+    hasher.close()
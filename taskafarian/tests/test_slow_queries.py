@@ -0,0 +1,72 @@
+import pytest
+
+from chalicelib.core import slow_queries
+
+url_slow_queries = '/debug/slow-queries'
+
+
+@pytest.fixture
+def capture_all():
+    slow_queries.reset()
+    slow_queries.configure(threshold=0)
+    yield slow_queries
+    slow_queries.configure(threshold=None)
+    slow_queries.reset()
+
+
+def captured_by(caller):
+    return [entry for entry in slow_queries.get_captures() if entry['caller'] == caller]
+
+
+def test_slow_read_is_analyzed_with_redacted_parameters(app, capture_all, user_alice):
+    response = app.http.get(path='/task/1', headers={'Authorization': f'Bearer {user_alice.token}'})
+    assert response.status_code == 200
+
+    [entry] = captured_by('chalicelib.services.auth.get_user_by_token')
+    assert entry['analyzed'] is True
+    assert entry['params'] == {'token': 'str', 'expires_at': 'datetime'}
+
+    [plan] = entry['plan']
+    assert 'Execution Time' in plan
+    assert user_alice.token not in str(plan)
+
+    [entry] = captured_by('chalicelib.services.task.fetch')
+    assert entry['analyzed'] is True
+
+
+def test_slow_write_is_analyzed_in_a_rolled_back_savepoint(app, db, capture_all, user_alice):
+    response = app.http.patch(
+        path='/task/1',
+        json={'name': 'renamed'},
+        headers={'Authorization': f'Bearer {user_alice.token}'}
+    )
+    assert response.status_code == 200
+    assert response.json_body['name'] == 'renamed'
+
+    [entry] = captured_by('chalicelib.services.task.update_task')
+    assert entry['analyzed'] is True
+    assert entry['params'] == {'name': 'str', 'task_id': 'int', 'team_ids': 'list'}
+
+    with db.cursor() as cursor:
+        cursor.execute('SELECT count(*) FROM task WHERE name = %s;', ('renamed',))
+        assert cursor.fetchone().count == 1
+        db.commit()
+
+
+def test_fingerprint_is_captured_once_per_cooldown(app, capture_all, user_alice):
+    for _ in range(3):
+        app.http.get(path='/user/me', headers={'Authorization': f'Bearer {user_alice.token}'})
+
+    assert len(captured_by('chalicelib.services.auth.get_user_by_token')) == 1
+
+
+def test_report(app, capture_all, user_alice):
+    app.http.get(path='/task', headers={'Authorization': f'Bearer {user_alice.token}'})
+
+    response = app.http.get(path=url_slow_queries)
+    assert response.status_code == 200
+    assert response.json_body['thresholdMs'] == 0
+
+    report = slow_queries.render_report(response.json_body['queries'])
+    assert 'chalicelib.services.task.fetch_many' in report
+    assert '-> ' in report
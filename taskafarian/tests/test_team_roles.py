@@ -0,0 +1,110 @@
+import pytest
+
+from chalicelib.core import query_stats
+from chalicelib.core.database import release_db
+from chalicelib.core.shared import g
+from chalicelib.services import user
+
+
+@pytest.fixture
+def team_roles_queries():
+    query_stats.reset()
+    query_stats.enable()
+
+    def count():
+        return sum(
+            stats['calls'] for stats in query_stats.get_stats()
+            if 'chalicelib.services.user.get_team_roles' in stats['callers']
+        )
+    yield count
+
+    query_stats.disable()
+    query_stats.reset()
+    user.get_team_roles_cache().clear()
+
+
+@pytest.fixture
+def team_roles_cache(monkeypatch):
+    monkeypatch.setattr(user, '_team_roles_cache', None)
+    monkeypatch.setenv('TASKAFARIAN_TEAM_ROLES_CACHE_TTL', '60')
+    yield user.get_team_roles_cache()
+    monkeypatch.setattr(user, '_team_roles_cache', None)
+
+
+def end_request():
+    release_db()
+    g.clear()
+
+
+def get_task(app, token, task_id):
+    return app.http.get(path=f'/task/{task_id}', headers={'Authorization': f'Bearer {token}'})
+
+
+def update_task(app, token, task_id, details):
+    return app.http.patch(path=f'/task/{task_id}', headers={'Authorization': f'Bearer {token}'}, json=details)
+
+
+def delete_task(app, token, task_id):
+    return app.http.delete(path=f'/task/{task_id}', headers={'Authorization': f'Bearer {token}'})
+
+
+def test_team_roles_are_loaded_once_per_request(app, team_roles_queries, user_dave):
+    assert user.get_team_roles(user_dave.user_id) == {1: 'member', 2: 'member'}
+    assert user.get_team_ids(user_dave.user_id) == [1, 2]
+    assert user.get_user_role_in_team(user_dave.user_id, 2) == 'member'
+    assert user.get_user_role_in_team(user_dave.user_id, 3) is None
+    assert team_roles_queries() == 1
+
+    # the next request loads them again
+    end_request()
+    user.get_team_roles(user_dave.user_id)
+    assert team_roles_queries() == 2
+    end_request()
+
+
+def test_team_roles_are_not_cached_across_requests_by_default(app, team_roles_queries, user_bob):
+    for _ in range(2):
+        assert get_task(app, user_bob.token, 1).status_code == 200
+    assert team_roles_queries() == 2
+
+
+def test_team_roles_cache_is_invalidated_on_membership_change(app, team_roles_queries, team_roles_cache,
+                                                              user_bob):
+    for _ in range(2):
+        assert get_task(app, user_bob.token, 1).status_code == 200
+    assert team_roles_queries() == 1
+
+    user.remove_team_member(team_id=1, user_id=user_bob.user_id)
+    end_request()
+    assert get_task(app, user_bob.token, 1).status_code == 404
+    # bob still sees the task he created
+    assert get_task(app, user_bob.token, 3).status_code == 200
+
+    user.add_team_member(team_id=2, user_id=user_bob.user_id, user_role='member')
+    end_request()
+    assert get_task(app, user_bob.token, 100).status_code == 200
+    assert team_roles_queries() == 3
+
+
+def test_writes_are_authorized_with_fresh_team_roles(app, db, team_roles_queries, team_roles_cache, user_bob):
+    assert get_task(app, user_bob.token, 1).status_code == 200
+    assert team_roles_queries() == 1
+
+    # bob leaves the team through another process, the cache of this one still has the old roles
+    with db.cursor() as cursor:
+        cursor.execute('DELETE FROM user_to_team WHERE user_id = %(user_id)s AND team_id = 1;',
+                       {'user_id': user_bob.user_id})
+    db.commit()
+
+    assert get_task(app, user_bob.token, 1).status_code == 200
+    assert update_task(app, user_bob.token, 1, {'name': 'renamed'}).status_code == 404
+    assert delete_task(app, user_bob.token, 1).status_code == 404
+    assert team_roles_queries() == 3
+
+    # reads and writes of the same request share the fresh roles
+    end_request()
+    assert user.get_team_ids(user_bob.user_id, fresh=True) == []
+    assert user.get_team_ids(user_bob.user_id) == []
+    assert user.get_team_ids(user_bob.user_id, fresh=True) == []
+    assert team_roles_queries() == 4
+    end_request()
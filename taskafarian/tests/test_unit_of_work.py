@@ -0,0 +1,90 @@
+from chalicelib.core import database
+
+task_resource = '/task'
+
+
+def count_commits(monkeypatch):
+    commits = []
+    original_commit = database.Connection.commit
+
+    def commit(connection):
+        if not connection.defer_commit:
+            commits.append(connection)
+        return original_commit(connection)
+
+    monkeypatch.setattr(database.Connection, 'commit', commit)
+    return commits
+
+
+def test_protected_request_commits_once(app, db, user_alice, monkeypatch):
+    commits = count_commits(monkeypatch)
+
+    response = app.http.post(
+        path=task_resource,
+        json={'name': 'buy milk', 'status': 'todo'},
+        headers={'Authorization': f'Bearer {user_alice.token}'}
+    )
+    assert response.status_code == 201
+    assert len(commits) == 1
+
+    with db.cursor() as cursor:
+        cursor.execute('SELECT count(*) FROM task WHERE name = %s;', ('buy milk',))
+        assert cursor.fetchone().count == 1
+        db.commit()
+
+
+def test_get_request_runs_in_read_only_transaction(app, user_alice, monkeypatch):
+    from chalicelib.services import task
+    fetch_many = task.fetch_many
+    transaction_read_only = []
+
+    def patched_fetch_many(*args, **kwargs):
+        with database.get_db().cursor() as cursor:
+            cursor.execute('SHOW transaction_read_only;')
+            transaction_read_only.append(cursor.fetchone().transaction_read_only)
+        return fetch_many(*args, **kwargs)
+    monkeypatch.setattr('chalicelib.services.task.fetch_many', patched_fetch_many)
+
+    response = app.http.get(path=task_resource, headers={'Authorization': f'Bearer {user_alice.token}'})
+    assert response.status_code == 200
+    assert transaction_read_only == ['on']
+
+    # the connection is back to read-write for the next request
+    response = app.http.post(
+        path=task_resource,
+        json={'name': 'buy milk', 'status': 'todo'},
+        headers={'Authorization': f'Bearer {user_alice.token}'}
+    )
+    assert response.status_code == 201
+
+
+def test_failed_request_is_rolled_back_as_a_whole(app, db, user_alice, monkeypatch):
+    def broken_dump(*args, **kwargs):
+        raise Exception('something went wrong after the task was inserted')
+    monkeypatch.setattr('chalicelib.task.schema.Task.dump', broken_dump)
+
+    response = app.http.post(
+        path=task_resource,
+        json={'name': 'buy milk', 'status': 'todo'},
+        headers={'Authorization': f'Bearer {user_alice.token}'}
+    )
+    assert response.status_code == 500
+
+    with db.cursor() as cursor:
+        cursor.execute('SELECT count(*) FROM task WHERE name = %s;', ('buy milk',))
+        assert cursor.fetchone().count == 0
+        db.commit()
+
+
+def test_services_commit_on_their_own_without_unit_of_work(app, user_alice, monkeypatch):
+    monkeypatch.setenv('TASKAFARIAN_DB_UNIT_OF_WORK', 'False')
+    commits = count_commits(monkeypatch)
+
+    response = app.http.post(
+        path=task_resource,
+        json={'name': 'buy milk', 'status': 'todo'},
+        headers={'Authorization': f'Bearer {user_alice.token}'}
+    )
+    assert response.status_code == 201
+    # the token lookup and the insert
+    assert len(commits) == 2